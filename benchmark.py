@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for loading, querying, looking up and formatting the AWS IP list.
+
+Runs entirely offline, against a synthetic ip-ranges.json (or rows shaped like a given copy of it),
+scaled to multiples of the real row count.
+
+Usage:
+    benchmark.py [<ip-ranges.json>] [--scale <n> ...] [--repeat <n>] [--only <name> ...] [--json <file>] [--compare <file>]
+
+Options:
+    --scale <n>       Benchmark a dataset of n times the base row count; may be repeated [default: 1].
+    --repeat <n>      How many times to repeat each timing; the fastest is reported [default: 5].
+    --only <name>     Only run benchmarks whose name starts with this; may be repeated.
+    --json <file>     Also write the results to this file as JSON.
+    --compare <file>  Compare against results previously written with --json.
+
+Every benchmark reports the best wall time of --repeat runs, throughput in rows/second and the peak
+memory allocated during one further run (measured with tracemalloc, separately from the timings).
+
+The `startup` benchmarks run generate.py in fresh interpreters: `startup/import` reports the slowest
+modules imported by `import generate` (from -X importtime), and `startup/list` times a complete
+`generate.py list regions` against a snapshot.
+"""
+import gc
+import ipaddress
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from typing import Callable, List, Optional
+
+from docopt import docopt
+
+import formatters
+import generate
+
+from ipranges import CategoryIndex, RangeIndex
+
+# Roughly the shape of the real ip-ranges.json.
+BASE_IPV4_ROWS = 8000
+BASE_IPV6_ROWS = 3000
+SERVICES = ['AMAZON', 'EC2', 'S3', 'CLOUDFRONT', 'ROUTE53', 'DYNAMODB', 'GLOBALACCELERATOR', 'API_GATEWAY',
+            'CODEBUILD', 'EBS', 'ROUTE53_HEALTHCHECKS', 'WORKSPACES_GATEWAYS']
+REGIONS = ['us-east-1', 'us-east-2', 'us-west-1', 'us-west-2', 'eu-west-1', 'eu-central-1', 'ap-south-1',
+           'ap-northeast-1', 'ap-southeast-2', 'sa-east-1', 'ca-central-1', 'GLOBAL']
+
+
+def synthesize(scale: int, template: Optional[dict] = None, seed: int = 0) -> dict:
+    """
+    Build an ip-ranges.json document with `scale` times the base row count.
+
+    With a `template` (a decoded ip-ranges.json), the base row counts, services, regions, border groups
+    and prefix lengths are sampled from it; otherwise built-in values that resemble the real file are used.
+    As in the real file, about a third of the IPv4 rows repeat another row's prefix under the AMAZON service.
+    """
+    rng = random.Random(seed)
+    if template:
+        rows4, rows6 = template.get('prefixes', []), template.get('ipv6_prefixes', [])
+        count4, count6 = len(rows4), len(rows6)
+        combos = [(r['service'], r['region'], r['network_border_group']) for r in rows4 + rows6]
+        lengths4 = [int(r['ip_prefix'].split('/')[1]) for r in rows4] or [24]
+        lengths6 = [int(r['ipv6_prefix'].split('/')[1]) for r in rows6] or [56]
+    else:
+        count4, count6 = BASE_IPV4_ROWS, BASE_IPV6_ROWS
+        combos = [(s, r, r) for s in SERVICES for r in REGIONS]
+        lengths4 = [12, 14, 15, 16, 18, 20, 21, 22, 23, 24, 24, 24, 24, 24]
+        lengths6 = [40, 44, 48, 52, 56, 56, 56, 64]
+
+    prefixes = []
+    while len(prefixes) < count4 * scale:
+        length = rng.choice(lengths4)
+        network = ipaddress.IPv4Network((rng.getrandbits(32) >> (32 - length) << (32 - length), length))
+        service, region, group = rng.choice(combos)
+        prefixes.append({'ip_prefix': str(network), 'region': region, 'service': service, 'network_border_group': group})
+        if rng.random() < 0.5:
+            prefixes.append({'ip_prefix': str(network), 'region': region, 'service': 'AMAZON', 'network_border_group': group})
+
+    ipv6_prefixes = []
+    for _ in range(count6 * scale):
+        length = rng.choice(lengths6)
+        value = (0x2600 << 112) | rng.getrandbits(112)
+        network = ipaddress.IPv6Network((value >> (128 - length) << (128 - length), length))
+        service, region, group = rng.choice(combos)
+        ipv6_prefixes.append({'ipv6_prefix': str(network), 'region': region, 'service': service, 'network_border_group': group})
+
+    return {
+        'syncToken': '0',
+        'createDate': '1970-01-01-00-00-00',
+        'prefixes': prefixes[:count4 * scale],
+        'ipv6_prefixes': ipv6_prefixes,
+    }
+
+
+class NullWriter:
+    """A file-like sink that only counts what's written to it."""
+    def __init__(self):
+        self.written = 0
+
+    def write(self, s: str) -> int:
+        self.written += len(s)
+        return len(s)
+
+    def flush(self):
+        pass
+
+
+def measure(func: Callable, repeat: int) -> dict:
+    """Return the best wall time of `repeat` calls to `func`, and the peak memory of one more call."""
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    gc.collect()
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'seconds': best, 'peak_bytes': peak}
+
+
+def query_opts(**overrides) -> dict:
+    """Parsed generate.py options for a `query` that writes nowhere."""
+    opts = docopt(generate.__doc__, argv=['query', '--output', os.devnull])
+    opts.update(overrides)
+    return opts
+
+
+def benchmarks(document: dict) -> List[tuple]:
+    """
+    Returns `(name, rows, func)` for every benchmark against `document`.
+    """
+    body = json.dumps(document).encode()
+    data = generate.RangeData.from_dict(json.loads(body))
+    rows = data.prefixes + data.ipv6_prefixes
+    total = len(rows)
+
+    sample = rows[len(rows) // 2]
+    service, region, group = sample.service, sample.region, sample.network_border_group
+    services = sorted({r.service for r in rows})[:2]
+    regions = sorted({r.region for r in rows})[:2]
+
+    def chunks(document: bytes, size: int = 1 << 16):
+        return (document[i:i + size] for i in range(0, len(document), size))
+
+    def _lookup_addresses(n: int = 10000) -> List[str]:
+        rng = random.Random(1)
+        return [str(ipaddress.ip_address(rng.getrandbits(32))) for _ in range(n)]
+    addresses = _lookup_addresses()
+
+    def _cmd_query_all():
+        generate.cmd_query_data(query_opts(**{'--service': ['*'], '--region': ['*'], '--format': ['json']}), data)
+
+    result = [
+        ('load/json.loads', total, lambda: json.loads(body)),
+        ('load/from_dict', total, lambda: generate.RangeData.from_dict(json.loads(body))),
+        ('load/from_stream', total, lambda: generate.RangeData.from_stream(chunks(body))),
+        ('load/from_stream+filter', total, lambda: generate.RangeData.from_stream(chunks(body), service=service)),
+        ('index/build', total, lambda: RangeIndex(rows)),
+        ('index/categories', total, lambda: (CategoryIndex(data.prefixes), CategoryIndex(data.ipv6_prefixes))),
+        ('query/service', total, lambda: data.query(service=service)),
+        ('query/region', total, lambda: data.query(region=region)),
+        ('query/service+region', total, lambda: data.query(service=service, region=region)),
+        ('query/border_group', total, lambda: data.query(network_border_group=group)),
+        ('query/multi', total, lambda: data.query(service=services, region=regions)),
+        ('query/all', total, lambda: data.query()),
+        ('query/prefix', total, lambda: data.query(prefix_pattern='52.')),
+        ('cmd_query_data/all', total, _cmd_query_all),
+        ('lookup/10k', len(addresses), lambda: [data.lookup(ip) for ip in addresses]),
+        ('deduplicate', total, lambda: formatters.Get('nginx', rows).deduplicate()),
+    ]
+
+    for code in formatters.List():
+        formatter = formatters.Get(code, rows)
+        try:
+            next(iter(formatter.chunks()), None)
+        except NotImplementedError:
+            continue
+        result.append((f"format/{code}", total, lambda f=formatter: f.write(NullWriter())))
+
+    return result
+
+
+def import_times() -> List[tuple]:
+    """
+    Returns `(cumulative seconds, module)` for `generate` and every module it imports, slowest first.
+    """
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import generate'],
+                             capture_output=True, text=True, check=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+    # Modules are listed after the modules they import, with nested imports indented; collect everything
+    # since the previous top-level import (e.g. `site`), up to and including `generate` itself.
+    result = []
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, module = line[len('import time:'):].split('|')
+        result.append((int(cumulative) / 1e6, module.strip()))
+        if not module.startswith('  '):
+            if module.strip() == 'generate':
+                break
+            result = []
+    result.sort(reverse=True)
+    return result
+
+
+def startup(repeat: int) -> List[dict]:
+    """Time importing generate.py and a whole `list regions` run, each in a fresh interpreter."""
+    runs = [import_times() for _ in range(repeat)]
+    top = min(runs, key=lambda modules: modules[0][0])[:10]
+    best = top[0][0]
+    print(f"   -  startup/import           {best * 1000:>10.2f} ms")
+    for seconds, module in top[1:]:
+        print(f"          {module:<28} {seconds * 1000:>10.2f} ms")
+
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'generate.py')
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'snapshot.bin')
+        generate.write_snapshot(path, generate.RangeData.from_dict(synthesize(1)))
+        argv = [sys.executable, script, 'list', 'regions', '--snapshot', path]
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            subprocess.run(argv, stdout=subprocess.DEVNULL, check=True)
+            times.append(time.perf_counter() - start)
+    print(f"   -  startup/list             {min(times) * 1000:>10.2f} ms", flush=True)
+
+    return [
+        {'scale': 0, 'name': 'startup/import', 'rows': 1, 'seconds': best, 'peak_bytes': 0,
+         'rows_per_second': None, 'modules': [{'module': m, 'seconds': s} for s, m in top]},
+        {'scale': 0, 'name': 'startup/list', 'rows': 1, 'seconds': min(times), 'peak_bytes': 0,
+         'rows_per_second': None},
+    ]
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run(opts) -> dict:
+    template = None
+    if opts['<ip-ranges.json>']:
+        with open(opts['<ip-ranges.json>']) as f:
+            template = json.load(f)
+
+    repeat = int(opts['--repeat'])
+    results = []
+    if not opts['--only'] or any('startup'.startswith(o) or o.startswith('startup') for o in opts['--only']):
+        results.extend(startup(repeat))
+
+    for scale in [int(s) for s in opts['--scale']]:
+        document = synthesize(scale, template)
+        for name, rows, func in benchmarks(document):
+            if opts['--only'] and not any(name.startswith(o) for o in opts['--only']):
+                continue
+            result = {'scale': scale, 'name': name, 'rows': rows, **measure(func, repeat)}
+            result['rows_per_second'] = rows / result['seconds'] if result['seconds'] else None
+            results.append(result)
+            print(f"{scale:>4}x  {name:<24} {rows:>9} rows  {result['seconds'] * 1000:>10.2f} ms  "
+                  f"{result['rows_per_second'] or 0:>14,.0f} rows/s  {result['peak_bytes'] / 1024:>10,.0f} KiB peak",
+                  flush=True)
+
+    return {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'repeat': repeat,
+        'results': results,
+    }
+
+
+def compare(report: dict, baseline: dict):
+    """Print each benchmark's time and peak memory relative to a baseline report."""
+    previous = {(r['scale'], r['name']): r for r in baseline['results']}
+    print(f"\nCompared with {baseline.get('revision') or 'baseline'} (ratios > 1 are slower/larger):")
+    for r in report['results']:
+        old = previous.get((r['scale'], r['name']))
+        if old is None or not old['seconds']:
+            continue
+        time_ratio = r['seconds'] / old['seconds']
+        memory_ratio = r['peak_bytes'] / old['peak_bytes'] if old['peak_bytes'] else float('nan')
+        print(f"{r['scale']:>4}x  {r['name']:<24} time {time_ratio:>6.2f}x  memory {memory_ratio:>6.2f}x")
+
+
+if __name__ == '__main__':
+    opts = docopt(__doc__)
+    report = run(opts)
+
+    if opts['--json']:
+        with open(opts['--json'], 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if opts['--compare']:
+        with open(opts['--compare']) as f:
+            compare(report, json.load(f))
@@ -1,23 +1,61 @@
 """
 Formatters to support a variety of output formats.
+
+Formatter modules are imported on first use, so a run only pays for the ones it needs
+(the YAML formatter, for instance, pulls in PyYAML).
 """
+import importlib
+
 from typing import List
 
 from .formatter import Formatter
-from .json_formatter import JSONFormatter
-from .yaml_formatter import YAMLFormatter
-from .text_formatter import TextFormatter
 
-from .cidr_formatter import CidrFormatter
-from .iptables_formatter import IptablesFormatter
-from .nginx_formatter import NginxFormatter
-from .haproxy_formatter import HAProxyFormatter
+# Format codes and the modules defining them, in the order they're listed.
+FORMATTERS = {
+    'json': 'json_formatter',
+    'yaml': 'yaml_formatter',
+    'text': 'text_formatter',
+    'cidr': 'cidr_formatter',
+    'iptables': 'iptables_formatter',
+    'ipset': 'ipset_formatter',
+    'nftables': 'nftables_formatter',
+    'nginx': 'nginx_formatter',
+    'nginx-geo': 'nginx_formatter',
+    'haproxy': 'haproxy_formatter',
+    'haproxy-map': 'haproxy_formatter',
+    'mmdb': 'mmdb_formatter',
+}
+
+# Formatter classes importable from this package, and their modules.
+CLASSES = {
+    'JSONFormatter': 'json_formatter',
+    'YAMLFormatter': 'yaml_formatter',
+    'TextFormatter': 'text_formatter',
+    'CidrFormatter': 'cidr_formatter',
+    'IptablesFormatter': 'iptables_formatter',
+    'IpsetFormatter': 'ipset_formatter',
+    'NftablesFormatter': 'nftables_formatter',
+    'NginxFormatter': 'nginx_formatter',
+    'NginxGeoFormatter': 'nginx_formatter',
+    'HAProxyFormatter': 'haproxy_formatter',
+    'HAProxyMapFormatter': 'haproxy_formatter',
+    'MMDBFormatter': 'mmdb_formatter',
+}
+
+
+def __getattr__(name: str):
+    if name in CLASSES:
+        module = importlib.import_module(f".{CLASSES[name]}", __name__)
+        return getattr(module, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def Get(code: str, data) -> Formatter:
+    if code in FORMATTERS:
+        importlib.import_module(f".{FORMATTERS[code]}", __name__)
     formatter = Formatter.get_formatter(code)
     return formatter(data)
 
 
 def List() -> List[str]:
-    return [s.code for s in Formatter.__subclasses__()]
+    return list(FORMATTERS)
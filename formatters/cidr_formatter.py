@@ -8,8 +8,8 @@ class CidrFormatter(Formatter):
     That is, it expects a list of IPRanges/dataclasses
     """
     code = 'cidr'
-    def string(self):
-        if not self.is_dataclass() and not type(self.data) is list:
+    def chunks(self):
+        if not self.is_dataclass() and not self.is_list():
             raise ValueError(f"This formatter expects to operate on a list of dataclasses")
 
         for item in self.data:
@@ -17,9 +17,8 @@ class CidrFormatter(Formatter):
                 v4 = getattr(item, 'ip_prefix')
                 v6 = getattr(item, 'ipv6_prefix')
                 if v4:
-                    print(v4)
+                    yield v4 + "\n"
                 elif v6:
-                    print(v6)
+                    yield v6 + "\n"
             except AttributeError:
                 raise ValueError(f"This formatter expects each list item to have 'ip_prefix' and 'ipv6_prefix'")
-            
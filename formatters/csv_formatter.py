@@ -8,5 +8,5 @@ class CSVFormatter(Formatter):
     """
     code = 'csv'
     
-    def string(self):
+    def chunks(self):
         raise NotImplementedError("Not implemented!")
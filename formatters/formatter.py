@@ -1,12 +1,21 @@
 from __future__ import annotations
 
 import dataclasses
+import ipaddress
 
 from abc import ABC, abstractmethod
+from collections.abc import Sequence
+from typing import Iterable, Iterator, List, Optional, TextIO, Tuple
 
 class Formatter(ABC):
     # The --format <code> value
     code: str = ''
+
+    # Whether delta_chunks is implemented
+    supports_delta: bool = False
+
+    # Whether chunks() yields bytes (e.g. a binary database) rather than str
+    binary: bool = False
     
     def __init__(self, data, *args, **kwargs):
         self.data = data
@@ -15,15 +24,55 @@ class Formatter(ABC):
         self._kwargs = kwargs
 
     @abstractmethod
-    def string(self) -> str:
+    def chunks(self) -> Iterator[str]:
         """
-        Return a string representation of the data.
+        Yield the string representation of the data, a piece (usually a line) at a time.
 
         This is the main function that subclasses must implement.
         Many of them will want to also take advantage of 'asdict()'
         """
         pass
 
+    def delta_chunks(self, previous) -> Iterator[str]:
+        """
+        Yield commands that update a deployed copy of the output for `previous` to the output for self.data,
+        e.g. rule deletions and insertions, rather than the whole output.
+
+        Only formatters with `supports_delta` implement this.
+        """
+        raise NotImplementedError(f"The '{self.code}' format doesn't support delta output")
+
+    def string(self) -> str:
+        """
+        Return a string representation of the data.
+        """
+        return "".join(self.chunks())
+
+    def encoded(self) -> bytes:
+        """
+        Return the output as bytes: UTF-8 for text formats, as-is for binary ones.
+        """
+        if self.binary:
+            return b"".join(self.chunks())
+        return self.string().encode()
+
+    def write(self, fp: TextIO, chunks: Optional[Iterable[str]] = None) -> int:
+        """
+        Write the data to `fp` as it's formatted, without building the whole output in memory.
+        `fp` must be opened in binary mode for `binary` formatters.
+
+        Args:
+            chunks (Iterable[str]): Write these instead of self.chunks(), e.g. the output of delta_chunks.
+
+        Returns:
+            int: The number of characters (or bytes, for `binary` formatters) written.
+        """
+        written = 0
+        for chunk in (self.chunks() if chunks is None else chunks):
+            fp.write(chunk)
+            written += len(chunk)
+        return written
+
     @classmethod
     def get_formatter(cls, code: str) -> Formatter:
         """
@@ -35,18 +84,36 @@ class Formatter(ABC):
         Returns:
             Formatter
         """
-        for sub in cls.__subclasses__():
+        for sub in cls.registered():
             if sub.code == code:
                 return sub
         raise ValueError(f"Unsupported format: {code}")
 
+    @classmethod
+    def registered(cls) -> List[type]:
+        """
+        Returns every subclass of this formatter, including subclasses of subclasses.
+        """
+        result = []
+        for sub in cls.__subclasses__():
+            result.append(sub)
+            result.extend(sub.registered())
+        return result
+
     def asdict(self):
         """Alias for dataclasses.asdict(self.data)"""
         return dataclasses.asdict(self.data)
 
+    def is_list(self):
+        """
+        Return True if self.data is a list of items rather than a single value.
+        Any sequence counts (e.g. the tuples of RangeData.prefixes), except strings.
+        """
+        return isinstance(self.data, Sequence) and not isinstance(self.data, (str, bytes))
+
     def is_dataclass(self):
         """Return True if self.data is a dataclass"""
-        if type(self.data) is list:
+        if self.is_list():
             return any(dataclasses.is_dataclass(i) for i in self.data)
         elif type(self.data) is dict:
             return any(dataclasses.is_dataclass(v) for k,v in self.data.items())
@@ -54,7 +121,7 @@ class Formatter(ABC):
 
     def is_list_of_ipranges(self):
         return \
-            type(self.data) is list \
+            self.is_list() \
         and len(self.data) > 0 \
         and hasattr(self.data[0], 'ip_prefix') \
         and hasattr(self.data[0], 'ipv6_prefix')
@@ -65,7 +132,8 @@ class Formatter(ABC):
         However, it's useful for the ones that generate config files to deduplicate the data,
         since many IP ranges are used by multiple services.
 
-        This is done by simple string matching and isn't subnet-aware.
+        This is done by simple string matching and isn't subnet-aware;
+        use `ipranges.aggregate` (the --aggregate flag) first to collapse nested and adjacent prefixes.
         
         allow 98.88.0.0/13; # AWS AMAZON (us-east-1)
         allow 98.88.0.0/13; # AWS EC2 (us-east-1)
@@ -84,4 +152,25 @@ class Formatter(ABC):
             data[prefix].append(ip)
         return data
 
+    @staticmethod
+    def tag(items) -> str:
+        """
+        Name the services and regions of the rows sharing a prefix, e.g. "AMAZON,EC2/us-east-1", for formats
+        that map addresses to a value. Missing values are "-".
+        """
+        services = ",".join(dict.fromkeys(i.service or "-" for i in items))
+        regions = ",".join(dict.fromkeys(i.region or "-" for i in items))
+        return f"{services}/{regions}"
+
+    def tagged_prefixes(self) -> List[Tuple[str, str]]:
+        """
+        Returns `(prefix, tag)` for each distinct prefix (see `deduplicate` and `tag`), IPv4 before IPv6, in address order.
+        """
+        def _key(prefix):
+            network = ipaddress.ip_network(prefix, strict=False)
+            return network.version, int(network.network_address), network.prefixlen
+
+        data = self.deduplicate()
+        return [(prefix, self.tag(data[prefix])) for prefix in sorted(data, key=_key)]
+
                 
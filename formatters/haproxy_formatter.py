@@ -2,10 +2,50 @@ from .formatter import Formatter
 
 class HAProxyFormatter(Formatter):
     """
-    acl aws_ips src 203.0.113.0/24 198.51.100.0/24
-    http-request allow if aws_ips
-    http-request deny
+    Return an HAProxy ACL file, one deduplicated prefix per line, to be loaded with `-f`:
+        # acl aws_ips src -f this-file
+        # http-request allow if aws_ips
+        # http-request deny
+        203.0.113.0/24
+        198.51.100.0/24
+
+    HAProxy loads IP patterns into a prefix tree, so a request is matched with one tree lookup rather than
+    one comparison per prefix, and the file can be updated without touching haproxy.cfg.
     """
     code = 'haproxy'
-    def string(self):
-        raise NotImplementedError("Not implemented yet!")
+    acl_name = 'aws_ips'
+
+    def chunks(self):
+        if not self.is_list_of_ipranges():
+            raise ValueError("This formatter is only intended to operate on lists of IPRanges")
+
+        yield "# Reference this file from haproxy.cfg with:\n"
+        yield f"#   acl {self.acl_name} src -f this-file\n"
+        yield f"#   http-request allow if {self.acl_name}\n"
+        yield "#   http-request deny\n"
+        # Pattern files only allow comments on lines of their own.
+        for prefix, _ in self.tagged_prefixes():
+            yield f"{prefix}\n"
+
+
+class HAProxyMapFormatter(HAProxyFormatter):
+    """
+    Return an HAProxy map file from each deduplicated prefix to the services and regions publishing it:
+        203.0.113.0/24 AMAZON,EC2/us-east-1
+        198.51.100.0/24 S3/us-east-1
+
+    `map_ip` looks addresses up in a prefix tree and returns the value of the most specific match, so
+    traffic can be tagged (logged, routed, rate limited) by AWS service rather than only allowed or denied.
+    """
+    code = 'haproxy-map'
+    variable = 'txn.aws_source'
+
+    def chunks(self):
+        if not self.is_list_of_ipranges():
+            raise ValueError("This formatter is only intended to operate on lists of IPRanges")
+
+        yield "# Reference this file from haproxy.cfg with, e.g.:\n"
+        yield f"#   http-request set-var({self.variable}) src,map_ip(this-file,-)\n"
+        yield f"#   http-request set-header X-AWS-Source %[var({self.variable})]\n"
+        for prefix, tag in self.tagged_prefixes():
+            yield f"{prefix} {tag}\n"
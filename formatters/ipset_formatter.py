@@ -0,0 +1,72 @@
+from .iptables_formatter import IptablesFormatter
+
+class IpsetFormatter(IptablesFormatter):
+    """
+    Return `ipset restore` input with one hash:net set per port and IP version, like:
+        create aws-443-v4-new hash:net family inet maxelem 65536 -exist
+        flush aws-443-v4-new
+        add aws-443-v4-new 203.0.113.0/24
+        create aws-443-v4 hash:net family inet maxelem 65536 -exist
+        swap aws-443-v4-new aws-443-v4
+        destroy aws-443-v4-new
+
+    Each set is filled under a temporary name and swapped into place, so a reload is atomic.
+    The sets are then referenced by a single iptables rule per port (listed in the output's comments):
+        iptables -A OUTPUT -m set --match-set aws-443-v4 dst -p tcp --dport 443 -j ACCEPT
+    """
+
+    code = 'ipset'
+    set_prefix = 'aws'
+    rule_template = "iptables -A OUTPUT -m set --match-set {set} dst -p tcp --dport {port} -j ACCEPT"
+    rule6_template = "ip6tables -A OUTPUT -m set --match-set {set} dst -p tcp --dport {port} -j ACCEPT"
+
+    def set_name(self, port: int, version: int) -> str:
+        return f"{self.set_prefix}-{port}-v{version}"
+
+    def chunks(self):
+        sets = [
+            (port, version, nets)
+            for port, networks in self.port_networks().items()
+            for version, nets in networks.items()
+            if nets
+        ]
+
+        yield "# Load with: ipset restore < this-file\n"
+        yield "# Then reference each set with one rule per port:\n"
+        for port, version, _ in sets:
+            template = self.rule_template if version == 4 else self.rule6_template
+            yield "# " + template.format(set=self.set_name(port, version), port=port) + "\n"
+
+        for port, version, nets in sets:
+            name = self.set_name(port, version)
+            family = 'inet' if version == 4 else 'inet6'
+            maxelem = max(65536, len(nets))
+            yield f"create {name}-new hash:net family {family} maxelem {maxelem} -exist\n"
+            yield f"flush {name}-new\n"
+            for net in nets:
+                yield f"add {name}-new {net}\n"
+            yield f"create {name} hash:net family {family} maxelem {maxelem} -exist\n"
+            yield f"swap {name}-new {name}\n"
+            yield f"destroy {name}-new\n"
+
+    def delta_chunks(self, previous):
+        """
+        Implements Formatter.delta_chunks
+
+        Emits `del`/`add` commands against the live sets (creating any set that's new), for `ipset restore -exist`.
+        """
+        delta = self.port_network_delta(previous)
+
+        yield "# Load with: ipset restore -exist < this-file\n"
+        for port, versions in delta.items():
+            for version, (removed, added, existed) in versions.items():
+                name = self.set_name(port, version)
+                if not existed:
+                    template = self.rule_template if version == 4 else self.rule6_template
+                    family = 'inet' if version == 4 else 'inet6'
+                    yield "# New set; reference it with: " + template.format(set=name, port=port) + "\n"
+                    yield f"create {name} hash:net family {family} maxelem {max(65536, len(added))} -exist\n"
+                for net in removed:
+                    yield f"del {name} {net} -exist\n"
+                for net in added:
+                    yield f"add {name} {net} -exist\n"
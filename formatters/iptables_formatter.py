@@ -1,4 +1,8 @@
-from typing import List
+import copy
+import ipaddress
+import re
+
+from typing import Dict, Iterator, List, Tuple
 
 from .formatter import Formatter
 
@@ -12,13 +16,17 @@ class IptablesFormatter(Formatter):
     code = 'iptables'
     rule_template = "iptables -A OUTPUT -d {ip} -p tcp --dport {port} -j ACCEPT"
 
-    def string(self):
+    supports_delta = True
+
+    def rules(self) -> Iterator[Tuple[str, int, List[str]]]:
+        """
+        Yields `(ip, port, services)` for each rule, in output order.
+        """
         data = self.deduplicate()
 
         ipv4 = sorted(filter(lambda x: data[x][0].ip_prefix, data))
         ipv6 = sorted(filter(lambda x: data[x][0].ipv6_prefix, data))
 
-        rules = ""
         for ip in ipv4:
             items = data[ip]
             ports = set([])
@@ -28,10 +36,110 @@ class IptablesFormatter(Formatter):
                     ports.add(p)
                 services.append(f"{i.service}/{i.region}")
             for port in ports:
-                rules += f"# Allow outbound access to AWS {','.join(services)}\n"
-                rules += self.rule_template.format(ip=ip, port=port) + "\n"
-        return rules
-    
+                yield ip, port, services
+
+    def chunks(self):
+        for ip, port, services in self.rules():
+            yield f"# Allow outbound access to AWS {','.join(services)}\n"
+            yield self.rule_template.format(ip=ip, port=port) + "\n"
+
+    def previous(self, data) -> 'IptablesFormatter':
+        """Returns a formatter of the same type and settings for an older copy of the data."""
+        formatter = copy.copy(self)
+        formatter.data = data
+        return formatter
+
+    def delete_template(self) -> str:
+        """
+        Returns the rule template as a deletion: its "-A <chain>" or "-I <chain> [rule number]" (or the long
+        forms, --append and --insert) becomes "-D <chain>".
+
+        Raises:
+            ValueError: when the template doesn't append or insert exactly one rule, so it can't be inverted.
+        """
+        pattern = r'(?<!\S)(?:-A|--append|-I|--insert)\s+(\S+)(?:\s+\d+(?!\S))?'
+        matches = re.findall(pattern, self.rule_template)
+        if len(matches) != 1:
+            raise ValueError(f"Can't make a rule deletion from the iptables rule template '{self.rule_template}'; "
+                             f"it must contain one '-A <chain>' or '-I <chain>'")
+        return re.sub(pattern, lambda m: f"-D {m.group(1)}", self.rule_template, count=1)
+
+    def delta_chunks(self, previous):
+        """
+        Implements Formatter.delta_chunks
+
+        Rules that are no longer needed are deleted (see `delete_template`) before new rules are appended.
+        Like `chunks`, this only covers IPv4; changed IPv6 prefixes are counted in a comment.
+        Either side may be empty (e.g. a service that appeared or went away), making every rule an addition or a deletion.
+        """
+        delete_template = self.delete_template()
+        old_formatter = self.previous(previous)
+        old = list(old_formatter.rules()) if old_formatter.data else []
+        new = list(self.rules()) if self.data else []
+        old_keys = {(ip, port) for ip, port, _ in old}
+        new_keys = {(ip, port) for ip, port, _ in new}
+
+        ipv6 = [set(p for p in f.deduplicate() if ':' in p) if f.is_list_of_ipranges() else set()
+                for f in (old_formatter, self)]
+        changed = len(ipv6[0] ^ ipv6[1])
+        if changed:
+            yield f"# Skipped {changed} changed IPv6 prefixes; the iptables format only covers IPv4\n"
+
+        for ip, port, services in old:
+            if (ip, port) not in new_keys:
+                yield f"# Remove outbound access to AWS {','.join(services)}\n"
+                yield delete_template.format(ip=ip, port=port) + "\n"
+        for ip, port, services in new:
+            if (ip, port) not in old_keys:
+                yield f"# Allow outbound access to AWS {','.join(services)}\n"
+                yield self.rule_template.format(ip=ip, port=port) + "\n"
+
+    def port_networks(self) -> Dict[int, Dict[int, list]]:
+        """
+        Group the prefixes by the ports their services use, for set-based firewalls.
+
+        Each port's prefixes are collapsed with `ipaddress.collapse_addresses`, so overlapping
+        prefixes (e.g. AMAZON and EC2 listing the same block) only appear once per port.
+
+        Returns:
+            {port: {4: [IPv4Network, ...], 6: [IPv6Network, ...]}}, sorted by port.
+        """
+        if not self.is_list_of_ipranges():
+            raise ValueError("This formatter is only intended to operate on lists of IPRanges")
+
+        ports = {}
+        for prefix, items in self.deduplicate().items():
+            network = ipaddress.ip_network(prefix, strict=False)
+            for port in set(p for i in items for p in self.port_map(i.service)):
+                ports.setdefault(port, {4: [], 6: []})[network.version].append(network)
+
+        return {
+            port: {version: list(ipaddress.collapse_addresses(nets)) for version, nets in networks.items()}
+            for port, networks in sorted(ports.items())
+        }
+
+    def port_network_delta(self, previous) -> Dict[int, Dict[int, tuple]]:
+        """
+        Compare `port_networks` for an older copy of the data with the current one.
+        An empty copy has no networks, so every network is added (or removed).
+
+        Returns:
+            {port: {version: (removed networks, added networks, whether the set existed before)}}, sorted by port.
+        """
+        old_formatter = self.previous(previous)
+        old = old_formatter.port_networks() if old_formatter.data else {}
+        new = self.port_networks() if self.data else {}
+        result = {}
+        for port in sorted(set(old) | set(new)):
+            for version in (4, 6):
+                before = old.get(port, {}).get(version, [])
+                after = new.get(port, {}).get(version, [])
+                removed = sorted(set(before) - set(after))
+                added = sorted(set(after) - set(before))
+                if removed or added:
+                    result.setdefault(port, {})[version] = (removed, added, len(before) > 0)
+        return result
+
     def port_map(self, aws_service_name: str) -> List[int]:
         """
         Generated by ChatGPT. YMMV.
@@ -62,4 +170,7 @@ class IptablesFormatter(Formatter):
             "S3": [443, 80],
             "WORKSPACES_GATEWAYS": [443],
         }
-        return service_ports[aws_service_name]
+        # Anything else (including other providers' services) is assumed to be HTTPS.
+        # Aggregated rows name several services, joined with "," (see ipranges.aggregate).
+        names = aws_service_name.split(',') if aws_service_name else [aws_service_name]
+        return list(dict.fromkeys(p for name in names for p in service_ports.get(name, [443])))
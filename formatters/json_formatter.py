@@ -14,8 +14,9 @@ class JSONEncoder(json.JSONEncoder):
 class JSONFormatter(Formatter): #, json.JSONEncoder):
     code = 'json'
 
-    def string(self) -> str:
+    def chunks(self):
         """
-        Return the data as a JSON-encoded string.
+        Yield the data as JSON, encoded incrementally.
         """
-        return json.dumps(self.data, cls=JSONEncoder)
+        yield from JSONEncoder().iterencode(self.data)
+        yield "\n"
@@ -0,0 +1,187 @@
+import ipaddress
+import struct
+import time
+
+from typing import Dict, List, Optional
+
+from .formatter import Formatter
+
+# Between the search tree and the data section.
+DATA_SECTION_SEPARATOR = b"\x00" * 16
+
+# Starts the metadata section at the end of the file.
+METADATA_MARKER = b"\xab\xcd\xefMaxMind.com"
+
+# Data section types used here (MaxMind DB format 2.0). Types above 7 are "extended".
+STRING, UINT16, UINT32, MAP, UINT64, ARRAY = 2, 5, 6, 7, 9, 11
+
+# Where IPv4 addresses live in an IPv6 tree (::a.b.c.d), and the IPv6 networks conventionally aliased to it:
+# IPv4-mapped (::ffff:0:0/96) and 6to4 (2002::/16) addresses.
+IPV4_START = 96
+IPV4_ALIASES = (ipaddress.IPv6Network('::ffff:0:0/96'), ipaddress.IPv6Network('2002::/16'))
+
+
+def _control(type_: int, size: int) -> bytes:
+    """The control byte(s) starting a field of `type_` with a payload of `size` (bytes, or entries for maps and arrays)."""
+    if type_ <= 7:
+        head, extended = type_ << 5, b""
+    else:
+        head, extended = 0, bytes([type_ - 7])
+    if size < 29:
+        return bytes([head | size]) + extended
+    if size < 29 + 256:
+        return bytes([head | 29]) + extended + bytes([size - 29])
+    if size < 29 + 256 + 65536:
+        return bytes([head | 30]) + extended + (size - 285).to_bytes(2, 'big')
+    return bytes([head | 31]) + extended + (size - 65821).to_bytes(3, 'big')
+
+
+def uint(type_: int, value: int) -> bytes:
+    """Encode an unsigned integer as UINT16, UINT32 or UINT64; readers check the metadata's types."""
+    payload = value.to_bytes((value.bit_length() + 7) // 8, 'big')
+    return _control(type_, len(payload)) + payload
+
+
+def encode(value) -> bytes:
+    """
+    Encode a str, dict or list (of those) as a data section field. `bytes` are taken to be encoded already,
+    e.g. by `uint`.
+    """
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, str):
+        payload = value.encode()
+        return _control(STRING, len(payload)) + payload
+    if isinstance(value, dict):
+        return _control(MAP, len(value)) + b"".join(encode(k) + encode(v) for k, v in value.items())
+    if isinstance(value, list):
+        return _control(ARRAY, len(value)) + b"".join(encode(v) for v in value)
+    raise TypeError(f"Can't encode {type(value).__name__} in an MMDB data section")
+
+
+class MMDBFormatter(Formatter):
+    """
+    Write a MaxMind DB (.mmdb) file: a binary search tree over IPv4 and IPv6 addresses, where each prefix maps to
+        {"service": "AMAZON,EC2", "region": "us-east-1", "network_border_group": "us-east-1"}
+
+    Any MaxMind DB reader (libmaxminddb, the Go, Java and Python readers, lua-resty-maxminddb, ...) can then look
+    addresses up in a memory-mapped file, getting the record of the most specific prefix containing them.
+    As in the classify output, rows sharing a prefix have their values joined with ","; missing values are left out.
+
+    The tree is an IPv6 one, with IPv4 prefixes at ::a.b.c.d (and aliased from ::ffff:0:0/96 and 2002::/16),
+    so a single file answers both address families.
+    """
+    code = 'mmdb'
+    binary = True
+    database_type = 'AWS-IP-Ranges'
+    description = 'AWS IP address ranges, by service, region and network border group'
+
+    def record(self, items) -> Dict[str, str]:
+        """The data stored for a prefix, from the rows sharing it."""
+        result = {}
+        for field in ('service', 'region', 'network_border_group', 'provider'):
+            values = [getattr(i, field, None) for i in items]
+            if any(values):
+                result[field] = ",".join(dict.fromkeys(v for v in values if v))
+        return result
+
+    def chunks(self):
+        if not self.is_list_of_ipranges():
+            raise ValueError("This formatter is only intended to operate on lists of IPRanges")
+
+        # Each node is [left, right]; a record is a node number, ~offset into `data` (i.e. negative), or None.
+        nodes: List[list] = [[None, None]]
+        data = bytearray()
+        offsets = {}
+
+        networks = []
+        for prefix, items in self.deduplicate().items():
+            network = ipaddress.ip_network(prefix, strict=False)
+            if network.version == 4:
+                networks.append((IPV4_START + network.prefixlen, int(network.network_address), items))
+            else:
+                networks.append((network.prefixlen, int(network.network_address), items))
+
+        # Wider prefixes first, so a narrower one is always inserted below the record of the prefix containing it.
+        for length, address, items in sorted(networks, key=lambda n: (n[0], n[1])):
+            value = encode(self.record(items))
+            if value not in offsets:
+                offsets[value] = len(data)
+                data += value
+            self._insert(nodes, address, length, ~offsets[value])
+
+        ipv4 = self._find(nodes, 0, IPV4_START)
+        if ipv4 is not None:
+            for alias in IPV4_ALIASES:
+                self._insert(nodes, int(alias.network_address), alias.prefixlen, ipv4, alias=True)
+
+        node_count = len(nodes)
+        largest = node_count + len(DATA_SECTION_SEPARATOR) + len(data)
+        record_size = 24 if largest < 1 << 24 else 28 if largest < 1 << 28 else 32
+
+        def _value(record) -> int:
+            if record is None:
+                return node_count
+            if record < 0:
+                return node_count + len(DATA_SECTION_SEPARATOR) + ~record
+            return record
+
+        pack = self._packer(record_size)
+        for i in range(0, node_count, 4096):
+            yield b"".join(pack(_value(left), _value(right)) for left, right in nodes[i:i + 4096])
+
+        yield DATA_SECTION_SEPARATOR
+        yield bytes(data)
+        yield METADATA_MARKER
+        yield encode({
+            'binary_format_major_version': uint(UINT16, 2),
+            'binary_format_minor_version': uint(UINT16, 0),
+            'build_epoch': uint(UINT64, int(time.time())),
+            'database_type': self.database_type,
+            'description': {'en': self.description},
+            'ip_version': uint(UINT16, 6),
+            'languages': ['en'],
+            'node_count': uint(UINT32, node_count),
+            'record_size': uint(UINT16, record_size),
+        })
+
+    @staticmethod
+    def _insert(nodes: List[list], address: int, length: int, value: int, alias: bool = False):
+        """
+        Point the record for the `length`-bit prefix of the 128-bit `address` at `value`, splitting any wider
+        prefix's record on the way down. With `alias`, nothing is changed where the path already holds data.
+        """
+        node = 0
+        for depth in range(length - 1):
+            bit = (address >> (127 - depth)) & 1
+            record = nodes[node][bit]
+            if record is None or record < 0:
+                if alias and record is not None:
+                    return
+                nodes.append([record, record])
+                record = nodes[node][bit] = len(nodes) - 1
+            node = record
+        bit = (address >> (128 - length)) & 1
+        if not alias or nodes[node][bit] is None:
+            nodes[node][bit] = value
+
+    @staticmethod
+    def _find(nodes: List[list], address: int, length: int) -> Optional[int]:
+        """The node reached after the first `length` bits of `address`, or None if the path ends sooner."""
+        node = 0
+        for depth in range(length):
+            node = nodes[node][(address >> (127 - depth)) & 1]
+            if node is None or node < 0:
+                return None
+        return node
+
+    @staticmethod
+    def _packer(record_size: int):
+        if record_size == 24:
+            return lambda left, right: left.to_bytes(3, 'big') + right.to_bytes(3, 'big')
+        if record_size == 28:
+            return lambda left, right: (
+                (left & 0xFFFFFF).to_bytes(3, 'big')
+                + bytes([(left >> 24) << 4 | right >> 24])
+                + (right & 0xFFFFFF).to_bytes(3, 'big'))
+        return struct.Struct('>II').pack
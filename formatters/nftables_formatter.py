@@ -0,0 +1,76 @@
+from .iptables_formatter import IptablesFormatter
+
+class NftablesFormatter(IptablesFormatter):
+    """
+    Return an `nft -f` script with a named interval set per port and IP version, like:
+        table inet aws
+        delete table inet aws
+        table inet aws {
+            set aws_443_v4 {
+                type ipv4_addr
+                flags interval
+                elements = { 203.0.113.0/24, 198.51.100.0/24 }
+            }
+            chain output {
+                type filter hook output priority 0; policy accept;
+                ip daddr @aws_443_v4 tcp dport 443 accept
+            }
+        }
+
+    `nft -f` applies the whole file as one transaction, so the table is replaced atomically.
+    """
+
+    code = 'nftables'
+    table = 'aws'
+    chain = 'output'
+    hook = 'output'
+
+    def chunks(self):
+        sets = [
+            (f"{self.table}_{port}_v{version}", port, version, nets)
+            for port, networks in self.port_networks().items()
+            for version, nets in networks.items()
+            if nets
+        ]
+
+        yield f"table inet {self.table}\n"
+        yield f"delete table inet {self.table}\n"
+        yield f"table inet {self.table} {{\n"
+        for name, port, version, nets in sets:
+            yield f"    set {name} {{\n"
+            yield f"        type ipv{version}_addr\n"
+            yield "        flags interval\n"
+            yield "        elements = { "
+            for i, net in enumerate(nets):
+                yield f"{', ' if i else ''}{net}"
+            yield " }\n"
+            yield "    }\n"
+
+        yield f"    chain {self.chain} {{\n"
+        yield f"        type filter hook {self.hook} priority 0; policy accept;\n"
+        for name, port, version, _ in sets:
+            family = 'ip' if version == 4 else 'ip6'
+            yield f"        {family} daddr @{name} tcp dport {port} accept\n"
+        yield "    }\n"
+        yield "}\n"
+
+    def delta_chunks(self, previous):
+        """
+        Implements Formatter.delta_chunks
+
+        Emits `delete element`/`add element` commands against the existing table. Sets for ports that
+        weren't in `previous` are created along with their rule.
+        """
+        delta = self.port_network_delta(previous)
+
+        for port, versions in delta.items():
+            for version, (removed, added, existed) in versions.items():
+                name = f"{self.table}_{port}_v{version}"
+                if not existed:
+                    family = 'ip' if version == 4 else 'ip6'
+                    yield f"add set inet {self.table} {name} {{ type ipv{version}_addr; flags interval; }}\n"
+                    yield f"add rule inet {self.table} {self.chain} {family} daddr @{name} tcp dport {port} accept\n"
+                if removed:
+                    yield f"delete element inet {self.table} {name} {{ {', '.join(str(n) for n in removed)} }}\n"
+                if added:
+                    yield f"add element inet {self.table} {name} {{ {', '.join(str(n) for n in added)} }}\n"
@@ -10,7 +10,7 @@ class NginxFormatter(Formatter):
         deny all;
     """
     code = 'nginx'
-    def string(self):
+    def chunks(self):
         """
         @todo - deal with duplicate ranges:
 
@@ -32,18 +32,67 @@ class NginxFormatter(Formatter):
         ipv4 = sorted(filter(lambda x: data[x][0].ip_prefix, data))
         ipv6 = sorted(filter(lambda x: data[x][0].ipv6_prefix, data))
 
-        nginx = ""
         for cidr in ipv4:
             items = data[cidr]
             services = ",".join([f"{i.service}/{i.region}" for i in items])
-            nginx += f"allow {cidr}; # AWS {services}\n"
+            yield f"allow {cidr}; # AWS {services}\n"
 
-        nginx += "\n";
+        yield "\n"
         for cidr in ipv6:
             items = data[cidr]
             services = ",".join([f"{i.service}/{i.region}" for i in items])
-            nginx += f"allow {cidr}; # AWS {services}\n"
+            yield f"allow {cidr}; # AWS {services}\n"
 
-        nginx += "\n";
-        nginx += "deny all;"
-        return nginx
+        yield "\n"
+        yield "deny all;\n"
+
+
+class NginxGeoFormatter(Formatter):
+    """
+    Return an nginx `geo` block setting a variable to the services and regions of the most specific prefix
+    containing the client address, or "-" for other clients:
+        geo $aws_source {
+            default -;
+            203.0.113.0/24 AMAZON,EC2/us-east-1;
+            198.51.100.0/24 S3/us-east-1;
+        }
+
+    nginx stores the prefixes in a radix tree, so a request costs one tree lookup rather than a pass over a list
+    of `allow` rules, and the variable can be logged or used to route traffic by AWS service.
+
+    With `ranges`, the block uses nginx's `ranges` mode instead: nested prefixes are flattened into disjoint
+    address ranges (see ipranges.RangeIndex.segments), which nginx searches with a binary search.
+    nginx only supports IPv4 in this mode, so IPv6 prefixes are left out.
+    """
+    code = 'nginx-geo'
+    variable = 'aws_source'
+    ranges = False
+
+    def chunks(self):
+        if not self.is_list_of_ipranges():
+            raise ValueError("This formatter is only intended to operate on lists of IPRanges")
+
+        yield f"geo ${self.variable} {{\n"
+        if self.ranges:
+            yield "    ranges;\n"
+        yield "    default -;\n"
+        if self.ranges:
+            yield from self._range_chunks()
+        else:
+            for prefix, tag in self.tagged_prefixes():
+                yield f"    {prefix} {tag};\n"
+        yield "}\n"
+
+    def _range_chunks(self):
+        import ipaddress
+
+        from ipranges.index import RangeIndex
+
+        boundaries, groups = RangeIndex(self.data).segments(4)
+        for i, group in enumerate(groups):
+            if group:
+                first = ipaddress.IPv4Address(boundaries[i])
+                last = ipaddress.IPv4Address(boundaries[i + 1] - 1)
+                yield f"    {first}-{last} {self.tag(group)};\n"
+        if any(item.ipv6_prefix for item in self.data):
+            yield "    # IPv6 prefixes are omitted: nginx only supports IPv4 in ranges mode.\n"
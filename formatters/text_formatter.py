@@ -1,6 +1,6 @@
 import dataclasses
 
-from typing import Optional, List
+from typing import Iterator, Optional, List
 
 from .formatter import Formatter
 
@@ -21,7 +21,23 @@ class TextFormatter(Formatter):
             header_row (bool): Whether self.data[0] is a header row.
             headers (List[str]): Supply explicit headers for when header_row is False
         """
+        return "".join(self.table_chunks(header_row, headers))
 
+    def _columns(self, item) -> Iterator[str]:
+        if dataclasses.is_dataclass(item):
+            for field in dataclasses.fields(item):
+                yield str(getattr(item, field.name))
+        else:
+            for col in item:
+                yield str(col)
+
+    def table_chunks(self, header_row: bool = True, headers: Optional[List[str]] = None) -> Iterator[str]:
+        """
+        Yields the lines of a markdown-style table (see `table`).
+
+        Column widths are measured in a first pass over the data and each row is rendered in a second,
+        so no more than one row is held as strings at a time.
+        """
         row = self.data[0]
         if self.is_dataclass():
             fields = dataclasses.fields(row)
@@ -33,54 +49,35 @@ class TextFormatter(Formatter):
                 headers = ['??' for _ in range(len(row))]
 
         pads = [len(h) for h in headers]
-        rows = []
 
-        data = self.data[1:] if header_row is True else self.data
-        
+        # Dataclass headers come from their fields, so the first row is data rather than a header.
+        data = self.data[1:] if header_row is True and not self.is_dataclass() else self.data
+
         for item in data:
-            if dataclasses.is_dataclass(item):
-                cols = []
-                for i, field in enumerate(dataclasses.fields(item)):
-                    value = str(getattr(item, field.name))
-                    pads[i] = max(pads[i], len(value))
-                    cols.append(value)
-                rows.append(cols)
-            else:
-                _row = []
-                for i, col in enumerate(item):
-                    value = str(col)
-                    pads[i] = max(pads[i], len(value))
-                    _row.append(value)
-                rows.append(_row)
-
-        table = " | ".join(header.ljust(pads[i]) for i, header in enumerate(headers)) + "\n"
-        table += "-+-".join("-" * width for width in pads) + "\n"
-
-        for row in rows:
-            table += " | ".join(str(row[i]).ljust(pads[i]) for i, _ in enumerate(headers)) + "\n"
-        # data_rows = "\n".join(
-        #     " | ".join(row[i].ljust(pads[i]) for i, _ in enumerate(headers))
-        #     for row in rows
-        # )
-        #return f"{table}\n{data_rows}"
-        return table
-    
-    def string(self):
-        """Implements Formatter.string"""
+            for i, value in enumerate(self._columns(item)):
+                pads[i] = max(pads[i], len(value))
+
+        yield " | ".join(header.ljust(pads[i]) for i, header in enumerate(headers)) + "\n"
+        yield "-+-".join("-" * width for width in pads) + "\n"
+
+        for item in data:
+            yield " | ".join(value.ljust(pads[i]) for i, value in enumerate(self._columns(item))) + "\n"
+
+    def chunks(self):
+        """Implements Formatter.chunks"""
         if len(self.data) == 0:
-            return ""
-        
-        if type(self.data) is list and dataclasses.is_dataclass(self.data[0]):
+            return
+
+        if self.is_list() and dataclasses.is_dataclass(self.data[0]):
             self._as_table = True
-            
+
         if self._as_table:
-            return self.table()
+            yield from self.table_chunks()
+            return
 
-        # If it's a list of strings, print them out line by line
-        if type(self.data) is list:
+        # If it's a list of strings, write them out line by line
+        if self.is_list():
             for item in self.data:
-                print(item)
+                yield f"{item}\n"
             return
-        return str(self.data)
-
-
+        yield str(self.data)
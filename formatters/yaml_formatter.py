@@ -13,10 +13,22 @@ class YAMLFormatter(Formatter):
     """Support YAML dumping for dataclasses"""
     code = 'yaml'
 
-    def string(self):
-        """Implements Formatter.string"""
+    def chunks(self):
+        """
+        Implements Formatter.chunks
+
+        A block-style list dumps as the concatenation of its items dumped one at a time,
+        so lists are emitted an item at a time.
+        """
+        if self.is_list() and len(self.data) > 0:
+            for item in self.data:
+                yield self._dump([item])
+        else:
+            yield self._dump(self.data)
+
+    def _dump(self, data) -> str:
         return yaml.dump(
-            self.data,
+            data,
             default_flow_style=False,
             Dumper=YAMLDumper
         )
@@ -5,8 +5,19 @@ Tools for working with the AWS IP list.
 
 Usage:
     generate.py (-h | --help)
-    generate.py query [--region <region> ... ] [--service <service> ... ] [--border-group <border-group> ... ] [(--only-ipv4|--only-ipv6)] [options]
-    generate.py list (regions|services|border-groups) [options]
+    generate.py query [--region <region> ... ] [--service <service> ... ] [--border-group <border-group> ... ] [(--only-ipv4|--only-ipv6)] [--within <cidr> ...] [--overlaps <cidr> ...] [--aggregate [--aggregate-by <fields>]] [--format <format> ...] [--output <outfile> ...] [--jobs <n>] [--provider <code> ...] [--provider-url <code=url> ...] [options]
+    generate.py list (regions|services|border-groups) [--format <format>] [--output <outfile>] [--provider <code> ...] [--provider-url <code=url> ...] [options]
+    generate.py lookup <ip>... [--longest] [--format <format>] [--output <outfile>] [--provider <code> ...] [--provider-url <code=url> ...] [options]
+    generate.py stats [--region <region> ... ] [--service <service> ... ] [--border-group <border-group> ... ] [(--only-ipv4|--only-ipv6)] [--group-by <fields>] [--format <format>] [--output <outfile>] [--provider <code> ...] [--provider-url <code=url> ...] [options]
+    generate.py classify [--input <file> ...] [--batch-size <n>] [--output <outfile>] [--jobs <n>] [--counts <file>] [--counts-only] [--provider <code> ...] [--provider-url <code=url> ...] [options]
+    generate.py compile <snapshot> [options]
+    generate.py history record [--history-dir <dir>] [options]
+    generate.py history import <file>... [--history-dir <dir>] [options]
+    generate.py history log [--history-dir <dir>] [--format <format>] [--output <outfile>] [options]
+    generate.py history lookup <ip>... [--at <date>] [--longest] [--history-dir <dir>] [--format <format>] [--output <outfile>] [options]
+    generate.py history query [--at <date>] [--region <region> ... ] [--service <service> ... ] [--border-group <border-group> ... ] [(--only-ipv4|--only-ipv6)] [--history-dir <dir>] [--format <format>] [--output <outfile>] [options]
+    generate.py serve [--host <host>] [--port <port>] [--refresh <seconds>] [--provider <code> ...] [--provider-url <code=url> ...] [options]
+    generate.py diff [<old> [<new>]] [--region <region> ... ] [--service <service> ... ] [--border-group <border-group> ... ] [(--only-ipv4|--only-ipv6)] [--format <format>] [--output <outfile>] [options]
 
 
 Options:
@@ -16,30 +27,69 @@ Options:
     -b <border-group>, --border-group <border-group>  The network border group to filter by.
     -f <format>, --format <format>                    Output format [default: text].
     -o <outfile>, --output <outfile>                  Writes results to a file [default: stdout].
+    -j <n>, --jobs <n>                                Render up to n formats at once (default: one per format, up to the CPU count), or classify with n processes (default: 1).
+    --within <cidr>                                   Only prefixes inside this network (or any of several networks).
+    --overlaps <cidr>                                 Only prefixes sharing any address with this network (or any of several networks).
+    --aggregate                                       Collapse nested and adjacent prefixes into the fewest CIDR blocks.
+    --aggregate-by <fields>                           Only aggregate prefixes sharing these comma-separated fields, e.g. "service,region".
+    --group-by <fields>                               Count "stats" per these comma-separated fields instead of per service, region and border group, e.g. "service".
+    --longest                                         Only return the most specific prefix containing each IP.
+    -i <file>, --input <file>                         Read IP addresses to classify, one per line; .gz, .bz2 and .xz files are decompressed [default: -].
+    --counts <file>                                   Also write the number of addresses per service, region and border group to this file ("-" for stderr).
+    --counts-only                                     Only write --counts, not a line per address.
+    --batch-size <n>                                  Number of addresses to classify at a time [default: 65536].
+    --url <url>                                       Where to download the IP ranges from; a URL or a local file [default: https://ip-ranges.amazonaws.com/ip-ranges.json].
+    -p <code>, --provider <code>                      Load and merge these providers' ranges (aws, gcp, azure, cloudflare, fastly or all), tagging each row with its provider.
+    --provider-url <code=url>                         Load a provider from this URL or local file instead of its default, e.g. "azure=ServiceTags_Public.json".
+    --cache-dir <dir>                                 Cache downloads in this directory (or set $AWS_IP_RANGES_CACHE_DIR).
+    --cache-ttl <seconds>                             Serve cached downloads younger than this without revalidating [default: 3600].
+    --offline                                         Only use the cache; never download.
+    --mirrors <urls>                                  Comma-separated URLs or local files to load the AWS ranges from when --url fails, in order.
+    --connect-timeout <seconds>                       Give up on connecting to a server after this long [default: 5].
+    --read-timeout <seconds>                          Give up on a download when the server sends nothing for this long [default: 30].
+    --retries <n>                                     Retry failed or interrupted downloads this many times, backing off between attempts [default: 3].
+    --deadline <seconds>                              Give up on a download, retries included, after this long (default: no limit).
+    --snapshot <file>                                 Load the IP ranges from a snapshot written by "compile" instead of downloading them.
+    --history-dir <dir>                               Keep the "history" archive in this directory (or set $AWS_IP_RANGES_HISTORY_DIR).
+    --at <date>                                       Answer "history" lookups and queries as of this date (UTC), e.g. 2024-01-03 (the end of that day) or 2024-01-03T12:30:00 (default: the latest snapshot).
+    --host <host>                                     Address for "serve" to listen on [default: 127.0.0.1].
+    --port <port>                                     Port for "serve" to listen on [default: 8080].
+    --refresh <seconds>                               How often "serve" reloads the IP ranges; 0 disables reloading [default: 3600].
+    --timings                                         Print the wall time, peak memory and row/byte counts of each stage to stderr.
+    --timings-json <file>                             Write the stage timings to this file as JSON ("-" for stderr).
+    --timings-hook <module:function>                  Call this function with each stage as it finishes, e.g. to export metrics from "serve".
+    --profile <file>                                  Run under cProfile and write the stats to this file (see "python -m pstats").
+    --nginx-geo-ranges                                Write the nginx-geo format in nginx's "ranges" mode (IPv4 only).
     --iptables-rule-template <rule-template>          Set the iptables rule template. [default: iptables -A OUTPUT -d {ip} -p tcp --dport {port} -j ACCEPT]
 """
+import os
 import sys
-import re
-import requests
 import dataclasses
-import json, yaml
+import json
 
-from argparse import ArgumentParser
-from dataclasses import dataclass
 from docopt import docopt
-from typing import List, Optional
+from typing import Callable, Iterable, List, Optional
 
 import formatters
+import providers
+
+from ipranges import Classifier
+from ipranges.aggregate import aggregate
+from ipranges.categories import matcher
+from ipranges.cache import CACHE_DIR_ENV, CacheError, DownloadCache, is_local, older, read_source
+from ipranges.data import IPRange, PrefixList, ProviderIPRange, RangeData, SnapshotRangeData
+from ipranges.diff import diff
+from ipranges.fetch import DownloadError, Fetcher
+from ipranges.history import HISTORY_DIR_ENV, History, HistoryError, parse_date
+from ipranges.snapshot import MAGIC as SNAPSHOT_MAGIC, Snapshot, write_snapshot
+from ipranges.stats import prefix_stats
+from ipranges.stream import iter_document, read_chunks
+from ipranges.timings import Timings, load_hook
 
 IP_RANGES_URL = "https://ip-ranges.amazonaws.com/ip-ranges.json"
 
-RAW_DATA = None # Raw data from IP_RANGES_URL.json()
-ALL_DATA = None # RangeData
-
-# These are populated as RangeData is constructed from the JSON response.
-ALL_SERVICES = set([])
-ALL_REGIONS = set([])
-ALL_NETWORK_BORDER_GROUPS = set([])
+# Per-stage wall time, memory and counters for this run; see --timings.
+TIMINGS = Timings()
 
 class EnhancedJSONEncoder(json.JSONEncoder):
     """Support json.dumps on dataclasses"""
@@ -48,163 +98,208 @@ class EnhancedJSONEncoder(json.JSONEncoder):
             return dataclasses.asdict(o)
         return super().default(o)
 
-class EnhancedYAMLDumper(yaml.Dumper):
-    """Support YAML dumping for dataclasses"""
-    def represent_data(self, data):
-        if dataclasses.is_dataclass(data):
-            return super().represent_data(dataclasses.asdict(data))
-        return super().represent_data(data)
-
-@dataclass
-class IPRange:
-    """
-    Represents the individual line items from ip-ranges.json
-    """
-    ip_prefix: str = None
-    ipv6_prefix: str = None
-    region: str = None
-    service: str = None
-    network_border_group: str = None
-
-    def to_dict(self):
-        return dict(
-            ip_prefix=self.ip_prefix,
-            ipv6_prefix=self.ipv6_prefix,
-            region=self.region,
-            service=self.service,
-            network_border_group=self.network_border_group)
-
-    def __iter__(self):
-        for k, v in self.to_dict().items():
-            yield k, v
-
-    def __getitem__(self, key):
-        attrs = dict(self)
-        return attrs[key]
-    
-@dataclass
-class PrefixList:
+def load_snapshot(path: str) -> RangeData:
     """
-    The return type of RangeData.query, containing separate lists of IPRanges for IPv4 and IPv6.
+    Load a snapshot written by the "compile" command, in place of download().
     """
-    ipv4: List[IPRange]
-    ipv6: List[IPRange]
+    with TIMINGS.stage('load', source=path) as stage:
+        data = SnapshotRangeData(Snapshot(path))
+        stage.count('rows', data.row_count())
+    return data
 
-    def all(self):
-        return self.ipv4 + self.ipv6
-    
-@dataclass
-class RangeData:
-    """
-    RangeData represents the data structure of the ip-ranges.json file.
-    """
-    syncToken: str
-    createDate: str
-    prefixes: List[IPRange]
-    ipv6_prefixes: List[IPRange]
-
-    @staticmethod
-    def from_dict(data: dict):
-        def _tally(i):
-            ALL_REGIONS.add(i.get('region'))
-            ALL_SERVICES.add(i.get('service'))
-            ALL_NETWORK_BORDER_GROUPS.add(i.get('network_border_group'))
-            return IPRange(**i)
-
-        ip4 = [_tally(item) for item in data.get('prefixes', [])]
-        ip6 = [_tally(item) for item in data.get('ipv6_prefixes', [])]
-        
-        return RangeData(
-            syncToken=data['syncToken'],
-            createDate=data['createDate'],
-            prefixes=ip4,
-            ipv6_prefixes=ip6
-        )
-        
-
-    def query(self,
-              service: str = '*',
-              region: str = '*',
-              network_border_group: str = '*',
-              prefix_pattern: str = '',
-              prefix_match_type: str = 'prefix',
-              re_flags: Optional[re.RegexFlag] = None) -> PrefixList:
-        """
-        Filter the IPRanges by basic criteria like service and/or region, or regex/substring matching against the CIDR string.
-
-        Currently, only the `prefix_pattern` supports pattern matching; `region`, `service`, and `network_border_group` are evaluated with "==".
-
-        Examples:
-            data.query(service='EC2')                                      # All EC2 IP ranges in all regions.
-            data.query(service='EC2', region='us-east-1')                  # EC2 IP ranges in us-east-1.
-            data.query(network_border_group='us-east-1-wl1-bos-wlz-1')     # All services in the 'us-east-1-wl1-bos-wlz-1' network border group.
-            data.query(prefix_pattern='12.34', prefix_match_type='prefix') # Returns all addresses starting with `12.34`.
-
-        Args:
-            service (str): Return only rows matching this service.
-            region (str): Return only rows matching this region.
-            network_border_group (str): Return only rows matching this network border group.
-            prefix_pattern (str): A regular expression or substring to match.
-            prefix_match_type (str): Whether to treat `prefix_pattern` as `regex`, `substr`, or `prefix` (startswith)
-            re_flags (re.RegexFlag): A way to pass in regex flags as needed. When re_flags is None, assumes `re.MULTILINE`.
-
-        Raises:
-            ValueError: when an invalid prefix_match_type is specified.
-        
-        Returns:
-            result (PrefixList): A list of IPv4 and IPv6 matches.
-        """
-        def _match_prefix(prefix: str, pattern: str, method: str):
-            if pattern == '':
-                return True # N/A
-            
-            if method == 'substr':
-                return pattern in prefix
-            elif method == 'prefix':
-                return prefix.startswith(pattern)
-            elif method == 'regex':
-                if re_flags is None:
-                    re_flags = re.MULTILINE
-                g = re.search(prefix_pattern, prefix, re_flags)
-                return g is not None and len(g.group()) > 0
-            raise ValueError(f"Unknown match method '{method}'")
-        
-        def _query(items):
-            result = []
-            for item in items:
-                prefix = item.ip_prefix if item.ip_prefix is not None else item.ipv6_prefix
-                matches = {
-                    'region_match': region == '*' or item.region.lower() == region,
-                    'service_match': service == '*' or item.service.upper() == service,
-                    'network_match': network_border_group == '*' or item.network_border_group == network_border_group,
-                    'prefix_match': _match_prefix(prefix, prefix_pattern, prefix_match_type),
-                }
-
-                if all(matches.values()):
-                    result.append(item)
-            return result
-
-        ip4 = _query(self.prefixes)
-        ip6 = _query(self.ipv6_prefixes)
-
-        return PrefixList(**{
-            "ipv4": ip4,
-            "ipv6": ip6,
-        })
+def load_file(path: str) -> RangeData:
+    """
+    Load a local copy of ip-ranges.json, or a snapshot written by the "compile" command.
+    """
+    return RangeData.from_file(path)
+
+def get_fetcher(opts) -> Fetcher:
+    """
+    Returns a Fetcher with the --connect-timeout, --read-timeout, --retries and --deadline given.
+    """
+    return Fetcher(connect_timeout=float(opts['--connect-timeout']),
+                   read_timeout=float(opts['--read-timeout']),
+                   retries=int(opts['--retries']),
+                   deadline=float(opts['--deadline']) if opts['--deadline'] else None)
+
+def get_cache(opts, fetcher: Optional[Fetcher] = None) -> Optional[DownloadCache]:
+    """
+    Returns the DownloadCache selected by --cache-dir or $AWS_IP_RANGES_CACHE_DIR, if any.
+    """
+    cache_dir = opts['--cache-dir'] or os.environ.get(CACHE_DIR_ENV)
+    return DownloadCache(cache_dir, ttl=float(opts['--cache-ttl']), fetcher=fetcher) if cache_dir else None
+
+def validator(code: str, required: bool = False) -> Callable[[str], Optional[str]]:
+    """
+    Returns a function checking a downloaded copy of provider `code`'s document (see DownloadCache.path):
+    it must parse, and with `required`, have a syncToken. The function returns the syncToken.
+    """
+    def _validate(path: str) -> Optional[str]:
+        with open(path, 'rb') as f:
+            version = providers.Get(code).check(read_chunks(f))
+        if required and not version:
+            raise ValueError("it has no syncToken")
+        return version
+    return _validate
+
+def download(url=IP_RANGES_URL, cache: Optional[DownloadCache] = None, offline: bool = False,
+             mirrors: Iterable[str] = (), fetcher: Optional[Fetcher] = None, **filters) -> RangeData:
+    """
+    Download and parse the IP ranges, through `cache` when one is given.
+
+    The response (or cached copy) is parsed as it's read; `filters` are passed to RangeData.from_stream,
+    so rows they exclude are never kept.
+
+    When `url` can't be loaded (after the fetcher's retries), or what it returns is truncated, invalid, or older
+    than the copy already cached, each of `mirrors` (URLs or local files) is tried in turn, and then any stale
+    cached copy. A warning is printed on stderr for each source that failed.
+
+    Raises:
+        DownloadError: when none of them could be loaded.
+    """
+    sources = [url] + [m for m in mirrors if m != url]
+    # Reject anything older than the newest copy already cached, from any of the sources.
+    versions = [cache.version(source) for source in sources] if cache is not None else []
+    newest = max((v for v in versions if v and v.isdigit()), key=int, default=None)
+    validate = validator('aws', required=True)
+    errors = []
+
+    def _load(source: str, offline: bool) -> Optional[RangeData]:
+        try:
+            with TIMINGS.stage('load', source=source) as stage:
+                chunks = read_source(source, cache=cache, offline=offline, fetcher=fetcher, validate=validate,
+                                     fallback=False)
+                data = RangeData.from_stream(stage.reading(chunks), **filters)
+                stage.count('rows', data.row_count())
+            if not data.syncToken:
+                raise ValueError(f"{source} has no syncToken")
+            if older(data.syncToken, newest):
+                raise ValueError(f"{source} is version {data.syncToken}, older than the cached version {newest}")
+        except (DownloadError, CacheError, OSError, ValueError) as e:
+            errors.append(str(e))
+            if len(sources) > 1 or cache is not None:
+                print(f"Warning: couldn't load the IP ranges from {source}: {e}", file=sys.stderr)
+            return None
+        return data
+
+    for source in sources:
+        data = _load(source, offline)
+        if data is not None:
+            return data
+
+    if cache is not None and not offline:
+        # Last resort: a cached copy, however old.
+        for source in sources:
+            age = cache.age(source) if not is_local(source) else None
+            if age is None:
+                continue
+            print(f"Warning: using a cached copy of {source} ({age:.0f}s old)", file=sys.stderr)
+            data = _load(source, offline=True)
+            if data is not None:
+                return data
+
+    raise DownloadError(f"Couldn't load the IP ranges: {'; '.join(errors)}")
+
+def load_providers(codes: List[str], urls: Optional[dict] = None, cache: Optional[DownloadCache] = None,
+                   offline: bool = False, fetcher: Optional[Fetcher] = None) -> RangeData:
+    """
+    Load the ranges of several providers concurrently, and merge them into one RangeData.
+
+    Every row is a ProviderIPRange tagged with its provider, so a single index (and a single lookup)
+    answers for all of them. The merged syncToken and createDate list each provider's, e.g. "aws:1700000000 gcp:1700000001".
+
+    Args:
+        codes (List[str]): Provider codes (see providers.List()), in the order their rows should appear.
+        urls (dict): Where to load each provider from instead of its default URL; a URL or a local file.
+
+    Raises:
+        DownloadError: when any of the providers can't be loaded.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    urls = urls or {}
+    regions = {}
+    services = {}
+    groups = {}
+
+    def _load(code: str) -> tuple:
+        provider = providers.Get(code)
+        url = urls.get(code) or provider.url
+        if not url:
+            raise ValueError(f"The '{code}' provider has no default URL; give one with --provider-url {code}=<url or file>")
+        region, service, group = regions.setdefault, services.setdefault, groups.setdefault
+        ip4, ip6 = [], []
+        with TIMINGS.stage(f"load/{code}", source=url) as stage:
+            chunks = read_source(url, cache=cache, offline=offline, fetcher=fetcher, validate=validator(code))
+            for row in provider.rows(stage.reading(chunks)):
+                item = ProviderIPRange(
+                    row.ip_prefix,
+                    row.ipv6_prefix,
+                    region(row.region, row.region),
+                    service(row.service, row.service),
+                    group(row.network_border_group, row.network_border_group),
+                    code)
+                (ip4 if row.ip_prefix is not None else ip6).append(item)
+            stage.count('rows', len(ip4) + len(ip6))
+        return provider, ip4, ip6
 
-            
-def download(url=IP_RANGES_URL):
-    global RAW_DATA
-    global ALL_DATA
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        RAW_DATA = response.json()
-        ALL_DATA = RangeData.from_dict(RAW_DATA)
-        return ALL_DATA
-    except requests.RequestException as e:
-        print(f"Error downloading IP ranges: {e}")
-        return None
+        with ThreadPoolExecutor(len(codes) or 1) as pool:
+            loaded = list(pool.map(_load, codes))
+    except (CacheError, OSError, ValueError) as e:
+        raise DownloadError(f"Couldn't load the IP ranges: {e}") from e
+
+    return RangeData(
+        syncToken=" ".join(f"{p.code}:{p.sync_token}" for p, _, _ in loaded),
+        createDate=" ".join(f"{p.code}:{p.create_date}" for p, _, _ in loaded),
+        prefixes=[item for _, ip4, _ in loaded for item in ip4],
+        ipv6_prefixes=[item for _, _, ip6 in loaded for item in ip6],
+        services=frozenset(s for s in services if s is not None),
+        regions=frozenset(r for r in regions if r is not None),
+        network_border_groups=frozenset(g for g in groups if g is not None))
+
+def provider_urls(opts) -> dict:
+    """
+    Returns the --provider-url overrides as {code: url}, with --url (when it isn't the default) standing in for aws.
+    """
+    urls = {}
+    if opts['--url'] != IP_RANGES_URL:
+        urls['aws'] = opts['--url']
+    for value in opts.get('--provider-url') or []:
+        code, sep, url = value.partition('=')
+        if not sep or code not in providers.List():
+            raise ValueError(f"Expected --provider-url <code>=<url or file>, with one of {providers.List()} (got '{value}')")
+        urls[code] = url
+    return urls
+
+def provider_codes(opts, urls: dict) -> List[str]:
+    """
+    Returns the providers selected by --provider. "all" means every provider with a URL: those without a
+    default one (i.e. azure) are skipped with a warning unless --provider-url gives one.
+    """
+    if 'all' not in opts['--provider']:
+        return opts['--provider']
+    codes = []
+    for code in providers.List():
+        if urls.get(code) or providers.Get(code).url:
+            codes.append(code)
+        else:
+            print(f"Warning: skipping the '{code}' provider, which has no default URL; "
+                  f"give one with --provider-url {code}=<url or file>", file=sys.stderr)
+    return codes
+
+def load_data(opts, **filters) -> RangeData:
+    """
+    Load the data selected by --provider (several providers), or download the AWS list otherwise.
+    """
+    fetcher = get_fetcher(opts)
+    cache = get_cache(opts, fetcher)
+    if opts.get('--provider'):
+        urls = provider_urls(opts)
+        return load_providers(provider_codes(opts, urls), urls, cache=cache, offline=opts['--offline'], fetcher=fetcher)
+    mirrors = [m.strip() for m in (opts['--mirrors'] or '').split(',') if m.strip()]
+    return download(opts['--url'], cache=cache, offline=opts['--offline'], mirrors=mirrors, fetcher=fetcher,
+                    **filters)
 
 def datatable(data: List[any]):
     if not data:
@@ -254,98 +349,497 @@ def encode_text(data):
 
     raise ValueError(f"Unsupported data type {type(data)}")
 
-def encode_data(data, opts) -> str:
-    fmt = opts['--format']
+def outputs(opts) -> List[tuple]:
+    """
+    Returns `(format, output)` for each --format, paired with the --output given in the same position.
+
+    One format may write to stdout; when several are given, each needs its own --output.
+    """
+    fmts, paths = opts['--format'], opts['--output']
+    if len(fmts) == 1 and len(paths) == 1:
+        return [(fmts[0], paths[0])]
+    if len(fmts) != len(paths) or 'stdout' in paths:
+        raise ValueError(f"Give an --output file for each --format (got formats {fmts} and outputs {paths})")
+    if len(set(paths)) != len(paths):
+        raise ValueError(f"Each --format needs a different --output (got {paths})")
+    return list(zip(fmts, paths))
+
+def encode_data(data, opts, fmt: Optional[str] = None) -> formatters.Formatter:
+    """
+    Returns the Formatter for `fmt` (by default, the first --format) for `data`; nothing is rendered until it's written.
+    """
+    fmt = fmt or opts['--format'][0]
     if fmt not in formatters.List():
         raise ValueError(f"Invalid format type '{fmt}'. Valid values are: {formatters.List()}")
     
     formatter = formatters.Get(fmt, data)
     if fmt == 'iptables':
         formatter.rule_template = opts['--iptables-rule-template']
-        
-    return formatter.string()
-
-# OUTPUT_FORMATS = {
-#     'json': lambda d: json.dumps(d, cls=EnhancedJSONEncoder),
-#     'yaml': lambda d: yaml.dump(d, default_flow_style=False, Dumper=EnhancedYAMLDumper),
-#     'text': encode_text
-# }
-# def encode_data(data, fmt: str = 'json'):
-#     try:
-#         func = OUTPUT_FORMATS[fmt]
-#     except KeyError:
-#         raise ValueError(f"Invalid output format '{fmt}'. Valid options are: {OUTPUT_FORMATS}")
-#     return func(data)
-
-def write_data(opts, data):
-    if opts['--output'] == 'stdout':
-        print(data)
-        return None
-    
-    with open(opts['--output'], 'w') as fd:
-        fd.write(data)
+    elif fmt == 'nginx-geo':
+        formatter.ranges = bool(opts.get('--nginx-geo-ranges'))
+
+    return formatter
+
+# Buffer size for --output files; formatters write many small chunks.
+OUTPUT_BUFFER_SIZE = 1 << 16
+
+def write_file(path: str, formatter: formatters.Formatter, chunks=None) -> int:
+    """
+    Stream the formatter's output (or `chunks`) to a temporary file next to `path`, then rename it over `path`,
+    so readers of `path` only ever see a complete file. Returns the number of characters written.
+    """
+    import tempfile
 
-def cmd_query_data(opts):
+    mode = 'wb' if formatter.binary else 'w'
+    if os.path.exists(path) and not os.path.isfile(path):
+        # Devices and pipes (e.g. /dev/null) can't be replaced; write to them directly.
+        with open(path, mode, buffering=OUTPUT_BUFFER_SIZE) as f:
+            return formatter.write(f, chunks)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.")
+    try:
+        with os.fdopen(fd, mode, buffering=OUTPUT_BUFFER_SIZE) as f:
+            written = formatter.write(f, chunks)
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmp, 0o666 & ~umask)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return written
+
+def write_data(opts, formatter: formatters.Formatter, chunks=None, output: Optional[str] = None):
+    """
+    Stream the formatter's output (or `chunks`) to `output` (by default, the first --output) or stdout as it's rendered.
+    """
+    output = output or opts['--output'][0]
+    with TIMINGS.stage(f"format/{formatter.code}") as stage:
+        if isinstance(formatter.data, list):
+            stage.count('rows', len(formatter.data))
+        if output == 'stdout' and formatter.binary:
+            sys.stdout.flush()
+            stage.count('bytes', formatter.write(sys.stdout.buffer, chunks))
+            sys.stdout.buffer.flush()
+        elif output == 'stdout':
+            stage.count('chars', formatter.write(sys.stdout, chunks))
+        elif formatter.binary:
+            stage.count('bytes', write_file(output, formatter, chunks))
+        else:
+            stage.count('chars', write_file(output, formatter, chunks))
+
+# The rows and options being rendered by render_outputs(), inherited by forked workers rather than pickled.
+_RENDERING = None
+
+def _render_output(fmt: str, output: str):
+    """Render one output in a worker, returning its timings to be recorded by the parent."""
+    data, opts = _RENDERING
+    write_data(opts, encode_data(data, opts, fmt), output=output)
+    return TIMINGS.stages[-1]
+
+def render_outputs(data, opts, targets: List[tuple]):
+    """
+    Render `data` once for each `(format, output)` in `targets`, concurrently.
+
+    Where the platform can fork, each output is rendered in a worker process that inherits `data` from this one,
+    so large outputs render in parallel without copying the rows to the workers; elsewhere, a thread pool is used.
+    Every file is written atomically, so a failed or interrupted run leaves any previous outputs intact.
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+    global _RENDERING
+    for fmt, _ in targets:
+        encode_data(data, opts, fmt)  # Reject unknown formats before rendering anything.
+
+    jobs = int(opts['--jobs']) if opts.get('--jobs') else min(len(targets), os.cpu_count() or 1)
+    if jobs <= 1 or len(targets) == 1:
+        for fmt, output in targets:
+            write_data(opts, encode_data(data, opts, fmt), output=output)
+        return
+
+    _RENDERING = (data, opts)
+    try:
+        forked = 'fork' in multiprocessing.get_all_start_methods()
+        if forked:
+            pool = ProcessPoolExecutor(jobs, mp_context=multiprocessing.get_context('fork'))
+        else:
+            pool = ThreadPoolExecutor(jobs)
+        with pool:
+            futures = [pool.submit(_render_output, fmt, output) for fmt, output in targets]
+            for future in futures:
+                stage = future.result()
+                if forked:
+                    TIMINGS.record(stage)
+    finally:
+        _RENDERING = None
+
+def select(data: RangeData, opts) -> List[IPRange]:
+    """
+    Apply the --service/--region/--border-group, --within/--overlaps and --only-ipv4/--only-ipv6 filters to `data`
+    """
+    with TIMINGS.stage('query', rows=data.row_count()) as stage:
+        r = data.query(
+            service=opts['--service'] or '*',
+            region=opts['--region'] or '*',
+            network_border_group=opts['--border-group'] or '*',
+            within=opts.get('--within'),
+            overlaps=opts.get('--overlaps'))
+
+        results = []
+        if not opts['--only-ipv6']:
+            results.extend(r.ipv4)
+        if not opts['--only-ipv4']:
+            results.extend(r.ipv6)
+        stage.count('matched', len(results))
+    return results
+
+def cmd_query_data(opts, data: RangeData):
     """
     Primary command function that queries data
     """
-    regions = opts['--region'] if opts['--region'] else ALL_REGIONS
-    services = opts['--service'] if opts['--service'] else ALL_SERVICES
+    results = select(data, opts)
+
+    if opts['--aggregate']:
+        group_by = opts['--aggregate-by'].split(',') if opts['--aggregate-by'] else None
+        with TIMINGS.stage('aggregate', rows=len(results)) as stage:
+            results = aggregate(results, group_by=group_by)
+            stage.count('blocks', len(results))
 
+    render_outputs(results, opts, outputs(opts))
+    
+    return results
+
+def cmd_lookup(opts, data: RangeData):
+    """
+    Find the IPRanges containing each of the given IP addresses
+    """
     results = []
+    with TIMINGS.stage('lookup', addresses=len(opts['<ip>'])) as stage:
+        for ip in opts['<ip>']:
+            results.extend(data.lookup(ip, longest=opts['--longest']))
+        stage.count('matched', len(results))
+
+    write_data(opts, encode_data(results, opts))
+
+    return results
+
+def cmd_stats(opts, data: RangeData):
+    """
+    Count the prefixes and addresses per service, region and border group (or --group-by), and per IP version.
+
+    Addresses are counted both per prefix and as the union of the group's prefixes, so nested and duplicate
+    prefixes (e.g. AMAZON and EC2 publishing the same block) only count once in `unique_addresses`.
+    """
+    results = select(data, opts)
+    group_by = opts['--group-by'].split(',') if opts['--group-by'] else None
+
+    with TIMINGS.stage('stats', rows=len(results)) as stage:
+        stats = prefix_stats(results, group_by=group_by)
+        stage.count('groups', len(stats))
+
+    write_data(opts, encode_data(stats, opts))
+
+    return stats
+
+def cmd_classify(opts, data: RangeData):
+    """
+    Tag each IP address in the input with its most specific prefix, service, region and border group.
+
+    Several inputs (or one large file, split into byte ranges) can be classified by a pool of --jobs processes,
+    which share the classifier built here rather than each loading the data.
+    """
+    from ipranges.parallel import classify_files, summarize
+
+    with TIMINGS.stage('index', rows=data.row_count()):
+        classifier = Classifier(data.index)
+    batch_size = int(opts['--batch-size'])
+    jobs = int(opts['--jobs'] or 1)
+    snapshot = data.snapshot.path if isinstance(data, SnapshotRangeData) else None
+    temporary = None
+    if jobs > 1 and snapshot is None:
+        import multiprocessing
+
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            # Workers that can't inherit the classifier build it from a memory-mapped snapshot instead.
+            import tempfile
+
+            fd, temporary = tempfile.mkstemp(suffix='.snapshot')
+            os.close(fd)
+            write_snapshot(temporary, data)
+            snapshot = temporary
+
+    if opts['--counts-only']:
+        outfile = None
+    else:
+        outfile = sys.stdout if opts['--output'][0] == 'stdout' else open(opts['--output'][0], 'w')
+    try:
+        with TIMINGS.stage('classify', jobs=jobs) as stage:
+            counts = classify_files(classifier, opts['--input'], outfile, jobs=jobs, batch_size=batch_size, snapshot=snapshot)
+            count = sum(counts.values())
+            stage.count('rows', count)
+    finally:
+        if outfile not in (None, sys.stdout):
+            outfile.close()
+        if temporary is not None:
+            os.unlink(temporary)
+
+    if opts['--counts']:
+        countfile = sys.stderr if opts['--counts'] == '-' else open(opts['--counts'], 'w')
+        try:
+            countfile.write("service\tregion\tnetwork_border_group\taddresses\n")
+            for row in summarize(counts):
+                countfile.write("\t".join(map(str, row)) + "\n")
+        finally:
+            if countfile is not sys.stderr:
+                countfile.close()
+    return count
+
+def cmd_compile(opts, data: RangeData):
+    """
+    Write the current data to a binary snapshot, for use with --snapshot
+    """
+    if not write_snapshot(opts['<snapshot>'], data):
+        print(f"{opts['<snapshot>']} is already up to date (syncToken {data.syncToken})", file=sys.stderr)
+
+def cmd_diff(opts, data: Optional[RangeData]):
+    """
+    Show what changed between two copies of the data.
+
+    With no arguments, compares the previous cached download with the current one (requires --cache-dir).
+    With <old>, compares that file with the current download; with <old> and <new>, compares the two files.
+    Formats that support it (e.g. iptables, ipset) emit only the commands needed to apply the change;
+    other formats get the list of added and removed rows.
+    """
+    if opts['<old>']:
+        old = load_file(opts['<old>'])
+    else:
+        cache = get_cache(opts)
+        previous = cache.previous(opts['--url']) if cache else None
+        if previous is None:
+            raise RuntimeError("There's no previous download to compare with; pass <old> or use --cache-dir")
+        old = RangeData.from_dict(json.loads(previous))
+    new = load_file(opts['<new>']) if opts['<new>'] else data
+
+    old_rows = select(old, opts)
+    new_rows = select(new, opts)
+
+    formatter = encode_data(new_rows, opts)
+    if formatter.supports_delta:
+        write_data(opts, formatter, formatter.delta_chunks(old_rows))
+        return new_rows
+
+    changes = diff(old_rows, new_rows)
+    write_data(opts, encode_data(changes, opts))
+    return changes
+
+def cmd_serve(opts):
+    """
+    Serve lookups and queries over HTTP from memory, reloading the data in the background
+    """
+    from ipranges.server import RangeServer
+
+    def _load():
+        if opts['--snapshot']:
+            return load_file(opts['--snapshot'])
+        return load_data(opts)
+
+    # Stages are only passed to the hooks, rather than kept for the life of the server.
+    TIMINGS.keep = False
+    server = RangeServer(
+        loader=_load,
+        encode=lambda data, fmt: encode_data(data, opts, fmt),
+        refresh=float(opts['--refresh']),
+        timings=TIMINGS)
+    server.serve_forever(opts['--host'], int(opts['--port']))
+
+def get_history(opts) -> History:
+    """
+    Returns the History archive selected by --history-dir or $AWS_IP_RANGES_HISTORY_DIR.
+    """
+    directory = opts['--history-dir'] or os.environ.get(HISTORY_DIR_ENV)
+    if not directory:
+        raise HistoryError(f"The history commands need --history-dir (or ${HISTORY_DIR_ENV})")
+    return History(directory)
+
+def create_date(path: str) -> str:
+    """
+    Read the createDate of a copy of ip-ranges.json (or a snapshot) without loading its rows.
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(SNAPSHOT_MAGIC)) == SNAPSHOT_MAGIC:
+            snapshot = Snapshot(path)
+            try:
+                return snapshot.create_date
+            finally:
+                snapshot.close()
+        f.seek(0)
+        for key, value in iter_document(read_chunks(f), arrays=()):
+            if key == 'createDate':
+                return value
+    raise ValueError(f"{path} has no createDate")
+
+def cmd_history(opts, data: Optional[RangeData]):
+    """
+    Archive copies of the data as the changes between them, and answer lookups and queries as of a past date.
 
-    for region in regions:
-        for svc in services:
-            r = ALL_DATA.query(svc, region)
-            if not opts['--only-ipv6']:
-                for ip4 in r.ipv4:
-                    results.append(ip4)
-            if not opts['--only-ipv4']:
-                for ip6 in r.ipv6:
-                    results.append(ip6)
+    "record" archives the current download (e.g. from cron), and "import" archives local copies, oldest first.
+    "lookup" and "query" take the same arguments as the top-level commands, plus --at, and return each row
+    with the dates it was published from and until.
+    """
+    history = get_history(opts)
+
+    if opts['record'] or opts['import']:
+        if opts['record']:
+            paths = [None]
+        else:
+            paths = sorted(opts['<file>'], key=create_date)
+        for path in paths:
+            snapshot = data if path is None else load_file(path)
+            try:
+                archived = history.add(snapshot)
+            except HistoryError as e:
+                if path is None:
+                    raise
+                print(f"Skipping {path}: {e}", file=sys.stderr)
+                continue
+            if archived is None:
+                print(f"syncToken {snapshot.syncToken} ({snapshot.createDate}) is already archived", file=sys.stderr)
+            else:
+                print(f"Archived syncToken {archived.syncToken} ({archived.createDate}): "
+                      f"{archived.added} rows added, {archived.removed} removed", file=sys.stderr)
+        return
+
+    if opts['log']:
+        snapshots = history.snapshots()
+        write_data(opts, encode_data(snapshots, opts))
+        return snapshots
+
+    with TIMINGS.stage('index') as stage:
+        index = history.index()
+        stage.count('rows', len(index.rows))
+    at = parse_date(opts['--at']) if opts['--at'] else None
+
+    if opts['lookup']:
+        results = []
+        with TIMINGS.stage('lookup', addresses=len(opts['<ip>'])) as stage:
+            for ip in opts['<ip>']:
+                results.extend(index.lookup(ip, at=at, longest=opts['--longest']))
+            stage.count('matched', len(results))
+    else:
+        with TIMINGS.stage('query') as stage:
+            keep = matcher(service=opts['--service'] or '*',
+                           region=opts['--region'] or '*',
+                           network_border_group=opts['--border-group'] or '*')
+            results = [
+                row for row in index.state(at)
+                if (keep is None or keep(row))
+                and not (opts['--only-ipv4'] and row.ipv6_prefix)
+                and not (opts['--only-ipv6'] and row.ip_prefix)
+            ]
+            stage.count('matched', len(results))
 
     write_data(opts, encode_data(results, opts))
-    
+
     return results
 
-def cmd_list(opts):
+def cmd_list(opts, data: RangeData):
     """List things"""
-    things_to_list = {'regions': ALL_REGIONS, 'services': ALL_SERVICES, 'border-groups': ALL_NETWORK_BORDER_GROUPS}
+    # The values of every row in the document, even when the data was loaded filtered.
+    things_to_list = {'regions': data.regions, 'services': data.services, 'border-groups': data.network_border_groups}
     for k, v in opts.items():
         if k in things_to_list and opts[k] is True:
-            return write_data(opts, encode_data(things_to_list[k], opts))
+            return write_data(opts, encode_data(sorted(things_to_list[k]), opts))
     raise RuntimeError(f"Expected to match one of {things_to_list.keys()}, but apparently that didn't happen.")
 
-def main(opts):
-    if opts['list']:
-        return cmd_list(opts)
+def main(opts, data: Optional[RangeData]):
+    if opts['history']:
+        return cmd_history(opts, data)
+
+    elif opts['list']:
+        return cmd_list(opts, data)
     
     elif opts['query']:
-        return cmd_query_data(opts)
+        return cmd_query_data(opts, data)
 
+    elif opts['lookup']:
+        return cmd_lookup(opts, data)
 
-if __name__ == '__main__':
-    opts = docopt(__doc__)
-    # print(opts)
-    # exit()
-    data = download()
+    elif opts['stats']:
+        return cmd_stats(opts, data)
+
+    elif opts['classify']:
+        return cmd_classify(opts, data)
+
+    elif opts['compile']:
+        return cmd_compile(opts, data)
+
+    elif opts['diff']:
+        return cmd_diff(opts, data)
+
+    elif opts['serve']:
+        return cmd_serve(opts)
 
-    # Sort the lists populated during the download() process.
-    # These are used by the "list" command to ensure up-to-date info.
-    ALL_REGIONS = sorted(ALL_REGIONS)
-    ALL_SERVICES = sorted(ALL_SERVICES)
-    ALL_NETWORK_BORDER_GROUPS = sorted(ALL_NETWORK_BORDER_GROUPS)
 
-    # support '--region all'
-    if 'all' in opts['--region']:
-        opts['--region'] = ALL_REGIONS
+def run(opts):
+    """
+    Load the data the command needs, then run it.
+    """
+    # support '--region all', '--service all' and '--border-group all' ('*' matches every value)
+    for opt in ('--region', '--service', '--border-group'):
+        if 'all' in opts[opt]:
+            opts[opt] = ['*']
+
+    if opts['--snapshot']:
+        data = load_snapshot(opts['--snapshot'])
+    elif opts['diff'] and opts['<new>']:
+        data = None # Both sides of the diff come from files.
+    elif opts['serve']:
+        data = None # The server loads (and reloads) the data itself.
+    elif opts['history'] and not opts['record']:
+        data = None # Everything comes from the archive.
+    elif opts['query'] or opts['stats']:
+        # Only keep the rows the query can return.
+        data = load_data(opts,
+                         service=opts['--service'] or '*',
+                         region=opts['--region'] or '*',
+                         network_border_group=opts['--border-group'] or '*',
+                         ipv4=not opts['--only-ipv6'],
+                         ipv6=not opts['--only-ipv4'])
+    else:
+        data = load_data(opts)
+
+    return main(opts, data)
 
-    # support '--service all'
-    if 'all' in opts['--service']:
-        opts['--service'] = ALL_SERVICES
 
-    # support '--border-group all'
-    if 'all' in opts['--border-group']:
-        opts['--border-group'] = ALL_NETWORK_BORDER_GROUPS
+if __name__ == '__main__':
+    opts = docopt(__doc__)
+    # print(opts)
+    # exit()
+    if opts['--timings-hook']:
+        TIMINGS.add_hook(load_hook(opts['--timings-hook']))
 
-    results = main(opts)
+    try:
+        if opts['--profile']:
+            import cProfile
+
+            profiler = cProfile.Profile()
+            try:
+                results = profiler.runcall(run, opts)
+            finally:
+                profiler.dump_stats(opts['--profile'])
+        else:
+            results = run(opts)
+    except (DownloadError, CacheError, HistoryError, ValueError) as e:
+        # ValueError covers invalid option values, e.g. an unknown --aggregate-by or --group-by field.
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    if opts['--timings']:
+        TIMINGS.report(sys.stderr)
+    if opts['--timings-json'] == '-':
+        TIMINGS.write_json(sys.stderr)
+    elif opts['--timings-json']:
+        with open(opts['--timings-json'], 'w') as f:
+            TIMINGS.write_json(f)
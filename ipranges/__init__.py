@@ -0,0 +1,7 @@
+"""
+Supporting data structures for working with the AWS IP list.
+"""
+from .index import RangeIndex
+from .categories import CategoryIndex
+from .classify import Classifier
+from .data import ActiveRangeData, IPRange, PrefixList, ProviderIPRange, RangeData, SnapshotRangeData
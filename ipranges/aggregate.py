@@ -0,0 +1,124 @@
+import dataclasses
+import ipaddress
+
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+# The fields that identify where a prefix came from.
+ATTRIBUTION = ('service', 'region', 'network_border_group')
+
+# Also joined for merged blocks, when the rows have them (e.g. ProviderIPRange).
+JOINED = ATTRIBUTION + ('provider',)
+
+
+def cidr_blocks(start: int, end: int, bits: int) -> Iterator[Tuple[int, int]]:
+    """
+    Yield `(network, prefix length)` for the fewest CIDR blocks exactly covering the addresses [start, end].
+
+    Args:
+        bits (int): 32 for IPv4, 128 for IPv6.
+    """
+    while start <= end:
+        # The largest block that is aligned at `start` and doesn't run past `end`.
+        aligned = (start & -start).bit_length() - 1 if start else bits
+        fits = (end - start + 1).bit_length() - 1
+        size = min(aligned, fits)
+        yield start, bits - size
+        start += 1 << size
+
+
+def aggregate(items: Sequence, group_by: Optional[Sequence[str]] = None) -> List:
+    """
+    Collapse nested and adjacent prefixes into the minimal set of CIDR blocks covering the same addresses.
+
+    Each returned row is a copy of a source IPRange with its prefix replaced by the aggregated block, and each
+    block is returned once. A block that absorbed rows from several services/regions/border groups names all
+    of them, joined with "," as in the classify and mmdb output (e.g. service="AMAZON,EC2"); missing values
+    are left out.
+
+    When `group_by` is given, prefixes are only merged with others that share the same values for those
+    fields, and a block is returned once for each distinct (service, region, network_border_group) merged
+    into it, so each row keeps a single, exact attribution at the cost of a less compact result:
+
+        aggregate(rows)                                # Fewest blocks overall.
+        aggregate(rows, group_by=['service', 'region']) # Fewest blocks per service and region.
+
+    Runs in O(n log n): one sort per IP version/group, then a linear merge.
+
+    Args:
+        items (Sequence[IPRange]): The rows to aggregate.
+        group_by (Sequence[str]): Only merge rows with equal values for these of service, region and network_border_group.
+
+    Raises:
+        ValueError: when `group_by` names another field.
+
+    Returns:
+        result (List[IPRange]): The aggregated rows, IPv4 before IPv6, in address order.
+    """
+    group_by = tuple(group_by or ())
+    unknown = set(group_by) - set(ATTRIBUTION)
+    if unknown:
+        raise ValueError(f"Can't aggregate by {', '.join(sorted(unknown))}; expected some of {', '.join(ATTRIBUTION)}")
+
+    groups = {}
+    for item in items:
+        network = ipaddress.ip_network(item.ip_prefix or item.ipv6_prefix, strict=False)
+        key = (network.version,) + tuple(getattr(item, f) for f in group_by)
+        groups.setdefault(key, []).append((int(network.network_address), int(network.broadcast_address), item))
+
+    result = []
+    for key, ranges in groups.items():
+        version = key[0]
+        ranges.sort(key=lambda r: (r[0], -r[1]))
+        merged_start, merged_end, members = None, None, []
+        for start, end, item in ranges:
+            if members and start <= merged_end + 1:
+                merged_end = max(merged_end, end)
+                members.append((start, item))
+                continue
+            if members:
+                result.extend(_split(merged_start, merged_end, members, version, join=not group_by))
+            merged_start, merged_end, members = start, end, [(start, item)]
+        if members:
+            result.extend(_split(merged_start, merged_end, members, version, join=not group_by))
+
+    result.sort(key=lambda r: r[0])
+    return [item for _, item in result]
+
+
+def _split(start: int, end: int, members: list, version: int, join: bool = True) -> List[tuple]:
+    """
+    Break one merged address range into CIDR blocks, attributing each source row to the block containing it.
+
+    Source prefixes are aligned blocks themselves, so each falls entirely within one output block.
+    With `join`, each block is one row naming every attribution of its rows; otherwise it's one row per attribution.
+    """
+    bits = 32 if version == 4 else 128
+    field = 'ip_prefix' if version == 4 else 'ipv6_prefix'
+    network_class = ipaddress.IPv4Network if version == 4 else ipaddress.IPv6Network
+
+    result = []
+    i = 0
+    for network, prefixlen in cidr_blocks(start, end, bits):
+        last = network + (1 << (bits - prefixlen)) - 1
+        cidr = str(network_class((network, prefixlen)))
+        seen = {}
+        while i < len(members) and members[i][0] <= last:
+            item = members[i][1]
+            seen.setdefault(tuple(getattr(item, f) for f in ATTRIBUTION), item)
+            i += 1
+        if join:
+            result.append(((version, network), _joined(list(seen.values()), field, cidr)))
+            continue
+        for item in seen.values():
+            result.append(((version, network), dataclasses.replace(item, **{field: cidr})))
+    return result
+
+
+def _joined(items: list, field: str, cidr: str):
+    """One row for `cidr`, with the distinct values of `items` for each attribution field joined with ","."""
+    values = {field: cidr}
+    if len(items) > 1:
+        for name in JOINED:
+            if hasattr(items[0], name):
+                values[name] = ",".join(dict.fromkeys(v for v in (getattr(i, name) for i in items) if v)) or None
+    return dataclasses.replace(items[0], **values)
@@ -0,0 +1,271 @@
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+
+from typing import Callable, Iterator, Optional
+
+from .fetch import DownloadError, Fetcher, http_get
+from .stream import read_chunks
+
+# Environment variable that enables the cache when --cache-dir isn't given.
+CACHE_DIR_ENV = 'AWS_IP_RANGES_CACHE_DIR'
+
+
+class CacheError(Exception):
+    """Raised when the cache can't satisfy a request, e.g. a cold cache in offline mode."""
+
+
+def older(version: Optional[str], than: Optional[str]) -> bool:
+    """
+    Whether document version `version` (e.g. a syncToken) is older than `than`. Only numeric versions
+    (Unix times, change numbers) can be ordered; anything else is never considered older.
+    """
+    if not version or not than or not version.isdigit() or not than.isdigit():
+        return False
+    return int(version) < int(than)
+
+
+class DownloadCache:
+    """
+    A directory of downloaded documents, revalidated with conditional HTTP requests.
+
+    Each URL is stored as files named after a hash of the URL:
+        <key>.body  The response body, exactly as downloaded.
+        <key>.meta  JSON with the URL, ETag and Last-Modified headers, the body's SHA-256 and its version.
+        <key>.prev  The body it replaced, the last time the document changed (see `previous`).
+
+    The body's mtime records when it was last fetched or revalidated, so deciding whether a
+    cached copy is still fresh costs a single stat().
+    """
+    def __init__(self, directory: str, ttl: float = 3600, fetcher: Optional[Fetcher] = None):
+        """
+        Args:
+            directory (str): Where to store cached documents. Created if it doesn't exist.
+            ttl (float): Seconds a cached copy is served without revalidating it.
+            fetcher (Fetcher): Downloads documents; by default, with the default timeouts and retries.
+        """
+        self.directory = directory
+        self.ttl = ttl
+        self.fetcher = fetcher
+
+    def _paths(self, url: str) -> tuple:
+        key = hashlib.sha256(url.encode()).hexdigest()[:16]
+        base = os.path.join(self.directory, key)
+        return base + '.body', base + '.meta', base + '.prev'
+
+    def _mkstemp(self) -> tuple:
+        """
+        Create a temporary file in the cache to be renamed into place. Unlike tempfile.mkstemp (which uses 0600),
+        it's created 0644 less the umask, so a cache shared between users (e.g. cron and a service) stays readable.
+        """
+        while True:
+            tmp = os.path.join(self.directory, f".tmp-{os.urandom(8).hex()}")
+            try:
+                return os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644), tmp
+            except FileExistsError:
+                continue
+
+    def _write(self, path: str, data: bytes):
+        """Atomically replace `path`, so readers never see a partial file."""
+        fd, tmp = self._mkstemp()
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def age(self, url: str) -> Optional[float]:
+        """Seconds since `url` was last fetched or revalidated, or None when it isn't cached."""
+        body, _, _ = self._paths(url)
+        try:
+            return time.time() - os.stat(body).st_mtime
+        except FileNotFoundError:
+            return None
+
+    def _meta(self, url: str) -> dict:
+        _, meta_path, _ = self._paths(url)
+        try:
+            with open(meta_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def version(self, url: str) -> Optional[str]:
+        """The version (see `path`) of the cached copy of `url`, or None when it isn't cached or has none."""
+        return self._meta(url).get('version') if self.age(url) is not None else None
+
+    def path(self, url: str, offline: bool = False, validate: Optional[Callable[[str], Optional[str]]] = None,
+             not_before: Optional[str] = None, fallback: bool = True) -> str:
+        """
+        Make sure `url` is cached, and return the path of its body on disk.
+
+        A cached copy younger than the TTL is used without any network access. Older copies are
+        revalidated with If-None-Match/If-Modified-Since; a 304 refreshes the copy's age, anything else
+        replaces it. When revalidation fails, the stale copy is used with a warning on stderr.
+
+        New downloads are streamed to disk, so the document is never held in memory; read it in
+        chunks (e.g. with ipranges.stream.read_chunks) to keep it that way. They only replace the cached
+        copy once `validate` accepts them, and aren't older than it: a truncated or corrupted download,
+        or a stale copy from a lagging CDN edge, is rejected like a failed one.
+
+        Args:
+            url (str): The URL to fetch.
+            offline (bool): Never touch the network; use whatever is cached regardless of age.
+            validate (Callable): Called with the path of a new download; raises ValueError when it isn't
+                a valid document, and returns its version (e.g. the syncToken), or None.
+            not_before (str): Also reject downloads older than this version, e.g. that of another copy.
+            fallback (bool): Use a stale cached copy when the download fails or is rejected.
+
+        Raises:
+            CacheError: when offline and `url` isn't cached.
+            DownloadError: when the download fails or is rejected, and there's no cached copy to fall back to.
+
+        Returns:
+            path (str): The cached body. It's replaced atomically, so it can be read while other processes refresh it.
+        """
+        body_path, meta_path, prev_path = self._paths(url)
+        age = self.age(url)
+
+        if age is not None and (offline or age < self.ttl):
+            return body_path
+        if offline:
+            raise CacheError(f"{url} isn't cached in {self.directory} and --offline was given")
+
+        meta = {}
+        headers = {}
+        if age is not None:
+            meta = self._meta(url)
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+
+        try:
+            response = http_get(url, headers=headers, stream=True, fetcher=self.fetcher)
+            if response.status_code == 304 and age is not None:
+                os.utime(body_path)
+                return body_path
+            os.makedirs(self.directory, exist_ok=True)
+            tmp, digest = self._download(response)
+            try:
+                version = self._validate(url, tmp, validate, [meta.get('version'), not_before])
+            except BaseException:
+                os.unlink(tmp)
+                raise
+        except DownloadError as e:
+            if age is None or not fallback:
+                raise
+            print(f"Warning: using a cached copy of {url} ({age:.0f}s old): {e}", file=sys.stderr)
+            return body_path
+
+        try:
+            if age is not None and digest != (meta.get('sha256') or self._digest(body_path)):
+                self._copy(body_path, prev_path)
+            os.replace(tmp, body_path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        self._write(meta_path, json.dumps({
+            'url': url,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'sha256': digest,
+            'version': version,
+        }).encode())
+        return body_path
+
+    @staticmethod
+    def _validate(url: str, path: str, validate: Optional[Callable[[str], Optional[str]]], minimums: list) -> Optional[str]:
+        """Check a new download with `validate`, returning its version. Raises DownloadError when it's rejected."""
+        if validate is None:
+            return None
+        try:
+            version = validate(path)
+        except ValueError as e:
+            raise DownloadError(f"{url} isn't a valid document: {e}") from e
+        for minimum in minimums:
+            if older(version, minimum):
+                raise DownloadError(f"{url} is version {version}, older than version {minimum}")
+        return version
+
+    def fetch(self, url: str, offline: bool = False) -> bytes:
+        """
+        Return the body of `url`, from disk when possible. See `path` for when it's (re)downloaded.
+        """
+        with open(self.path(url, offline=offline), 'rb') as f:
+            return f.read()
+
+    def _download(self, response) -> tuple:
+        """Stream a response body to a temporary file in the cache. Returns `(temporary path, sha256)`."""
+        digest = hashlib.sha256()
+        fd, tmp = self._mkstemp()
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in response.chunks():
+                    digest.update(chunk)
+                    f.write(chunk)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        return tmp, digest.hexdigest()
+
+    def _copy(self, source: str, path: str):
+        """Atomically replace `path` with a copy of `source`."""
+        fd, tmp = self._mkstemp()
+        try:
+            with os.fdopen(fd, 'wb') as f, open(source, 'rb') as src:
+                shutil.copyfileobj(src, f)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    @staticmethod
+    def _digest(path: str) -> str:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 16), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def previous(self, url: str) -> Optional[bytes]:
+        """
+        Return the copy of `url` that was cached before the document last changed, or None.
+        """
+        _, _, prev_path = self._paths(url)
+        try:
+            with open(prev_path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+
+def is_local(url: str) -> bool:
+    """Whether `url` is a local path (or a file:// URL) rather than something to download."""
+    return url.startswith('file://') or '://' not in url
+
+
+def read_source(url: str, cache: Optional[DownloadCache] = None, offline: bool = False,
+                fetcher: Optional[Fetcher] = None, validate: Optional[Callable[[str], Optional[str]]] = None,
+                fallback: bool = True) -> Iterator[bytes]:
+    """
+    Yield the document at `url` in chunks, as it's downloaded or read from disk.
+
+    `url` may also be a local path (or a file:// URL), which is read directly. Other URLs go
+    through `cache` when one is given (see DownloadCache.path for `validate` and `fallback`).
+    """
+    if is_local(url):
+        with open(url[len('file://'):] if url.startswith('file://') else url, 'rb') as f:
+            yield from read_chunks(f)
+    elif cache is not None:
+        with open(cache.path(url, offline=offline, validate=validate, fallback=fallback), 'rb') as f:
+            yield from read_chunks(f)
+    elif offline:
+        raise CacheError(f"Can't read {url} offline without a cache (--cache-dir or ${CACHE_DIR_ENV})")
+    else:
+        yield from http_get(url, stream=True, fetcher=fetcher).chunks()
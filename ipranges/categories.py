@@ -0,0 +1,108 @@
+from typing import Callable, Iterable, List, Optional, Union
+
+# The category fields that can be filtered on, and how values are normalized before comparing them.
+FIELDS = {
+    'service': str.upper,
+    'region': str.lower,
+    'network_border_group': None,
+}
+
+Criteria = Union[str, Iterable[str], None]
+
+
+def normalize(field: str, value: Optional[str]) -> Optional[str]:
+    """Normalize a category value the way queries compare it."""
+    func = FIELDS[field]
+    return func(value) if func is not None and value is not None else value
+
+
+def wanted(field: str, criteria: Criteria) -> Optional[set]:
+    """
+    Turn a query argument into a set of normalized values, or None when it doesn't filter anything.
+
+    A single string is one value, any other iterable is several values ("OR"), and None, '*' or any
+    iterable containing '*' matches everything.
+    """
+    if criteria is None:
+        return None
+    if isinstance(criteria, str):
+        criteria = [criteria]
+    values = set(criteria)
+    if '*' in values:
+        return None
+    return {normalize(field, v) for v in values}
+
+
+def matcher(service: Criteria = None, region: Criteria = None, network_border_group: Criteria = None) -> Optional[Callable]:
+    """
+    Returns a function testing whether one row matches every given field, as `CategoryIndex.select` would,
+    or None when none of them filters anything.
+    """
+    filters = [
+        (field, values)
+        for field, values in (('service', wanted('service', service)),
+                              ('region', wanted('region', region)),
+                              ('network_border_group', wanted('network_border_group', network_border_group)))
+        if values is not None
+    ]
+    if not filters:
+        return None
+
+    def _match(item) -> bool:
+        return all(normalize(field, getattr(item, field)) in values for field, values in filters)
+    return _match
+
+
+class CategoryIndex:
+    """
+    Inverted indexes from each service, region and network border group to the positions of the rows that have it.
+
+    `select` starts from the smallest posting list among the filtered fields and checks the remaining fields
+    per candidate, so a query costs roughly the size of its most selective filter rather than a scan of every row.
+    """
+    def __init__(self, items: List):
+        self._size = len(items)
+        self._postings = {field: {} for field in FIELDS}
+        self._keys = {field: [] for field in FIELDS}
+        for i, item in enumerate(items):
+            for field in FIELDS:
+                key = normalize(field, getattr(item, field))
+                self._postings[field].setdefault(key, []).append(i)
+                self._keys[field].append(key)
+
+    def __len__(self):
+        return self._size
+
+    def values(self, field: str) -> List[Optional[str]]:
+        """Return the distinct (normalized) values of `field`."""
+        return list(self._postings[field])
+
+    def select(self, service: Criteria = None, region: Criteria = None, network_border_group: Criteria = None) -> List[int]:
+        """
+        Return the positions of the rows matching every given field ("AND"), in their original order.
+
+        See `wanted` for how each argument is interpreted.
+        """
+        filters = []
+        for field, criteria in (('service', service), ('region', region), ('network_border_group', network_border_group)):
+            values = wanted(field, criteria)
+            if values is None:
+                continue
+            postings = self._postings[field]
+            filters.append((sum(len(postings.get(v, ())) for v in values), field, values))
+
+        if not filters:
+            return list(range(self._size))
+
+        filters.sort(key=lambda f: f[0])
+        _, field, values = filters[0]
+        postings = self._postings[field]
+        if len(values) == 1:
+            rows = list(postings.get(next(iter(values)), ()))
+        else:
+            rows = sorted(i for v in values for i in postings.get(v, ()))
+
+        for _, field, values in filters[1:]:
+            keys = self._keys[field]
+            rows = [i for i in rows if keys[i] in values]
+        return rows
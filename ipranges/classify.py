@@ -0,0 +1,159 @@
+import socket
+
+from bisect import bisect_right
+from itertools import islice
+from typing import List, Optional, TextIO
+
+from .index import RangeIndex
+
+# NumPy is optional, and slow enough to import that it's only loaded once a Classifier is created.
+numpy = None
+
+
+def _import_numpy() -> bool:
+    """Import NumPy into this module if it's installed; returns whether it's available."""
+    global numpy
+    if numpy is None:
+        try:
+            import numpy
+        except ImportError:
+            return False
+    return True
+
+# Output for addresses that aren't covered by any prefix (or aren't valid addresses).
+UNMATCHED = "\t".join(["-"] * 4)
+
+
+class Classifier:
+    """
+    Bulk, longest-prefix classification of IP addresses against a RangeIndex.
+
+    Addresses are converted to integers with `socket.inet_pton` and resolved against the
+    flattened segment table from `RangeIndex.segments`, one batch at a time. When NumPy is
+    installed, each batch is packed into a single array and resolved with one `searchsorted`
+    call; otherwise each address costs one `bisect`.
+
+    Each output line is tab-separated:
+        address  prefix  service(s)  region(s)  network_border_group(s)
+
+    When several rows share the matching prefix (e.g. AMAZON and EC2), their values are joined with ",".
+    Unmatched and unparseable addresses get "-" in every column, as do fields a row doesn't have (e.g. the
+    region of a Cloudflare prefix).
+    """
+    def __init__(self, index: RangeIndex, use_numpy: Optional[bool] = None):
+        """
+        Args:
+            index (RangeIndex): The prefixes to classify against.
+            use_numpy (bool): Force the NumPy (True) or pure-Python (False) path. Defaults to NumPy when available.
+        """
+        available = use_numpy is not False and _import_numpy()
+        if use_numpy and not available:
+            raise RuntimeError("NumPy isn't installed")
+        self.use_numpy = available
+
+        # version -> (address family, packed width in bytes, boundaries, labels, NumPy boundaries)
+        self._tables = {}
+        for version, family, width in ((4, socket.AF_INET, 4), (6, socket.AF_INET6, 16)):
+            boundaries, groups = index.segments(version)
+            # Boundaries past the end of the address space are never reached.
+            limit = 1 << (width * 8)
+            keep = [i for i, b in enumerate(boundaries) if b < limit]
+            boundaries = [boundaries[i] for i in keep]
+            labels = [self._label(groups[i]) for i in keep]
+            self._tables[version] = (family, width, boundaries, labels, self._vectorize(boundaries, width))
+
+    @staticmethod
+    def _label(group) -> str:
+        if not group:
+            return UNMATCHED
+        prefix = group[0].ip_prefix or group[0].ipv6_prefix
+        columns = [
+            ",".join(dict.fromkeys(getattr(row, field) or "-" for row in group))
+            for field in ('service', 'region', 'network_border_group')
+        ]
+        return "\t".join([prefix] + columns)
+
+    def _vectorize(self, boundaries: List[int], width: int):
+        """
+        Return the boundaries as a NumPy array, or None when the batch path can't be used.
+
+        IPv6 doesn't fit in a NumPy integer, but AWS publishes nothing longer than a /64, so when every
+        boundary is 64-bit aligned only the upper half of each address matters.
+        """
+        if not self.use_numpy:
+            return None
+        if width == 4:
+            return numpy.array(boundaries, dtype=numpy.uint64)
+        if any(b & 0xFFFFFFFFFFFFFFFF for b in boundaries):
+            return None
+        return numpy.array([b >> 64 for b in boundaries], dtype=numpy.uint64)
+
+    def classify(self, addresses: List[str]) -> List[str]:
+        """
+        Classify a batch of addresses.
+
+        Args:
+            addresses (List[str]): IPv4/IPv6 address strings, already stripped of whitespace.
+
+        Returns:
+            result (List[str]): One tab-separated line (without newline) per address, in input order.
+        """
+        return [f"{address}\t{label}" for address, label in zip(addresses, self.labels(addresses))]
+
+    def labels(self, addresses: List[str]) -> List[str]:
+        """
+        Like `classify`, but returns only the columns after the address: the matching prefix, services, regions
+        and border groups (or UNMATCHED). Addresses matching the same prefix share one string object, so the
+        result is cheap to count (e.g. with collections.Counter).
+        """
+        result = [UNMATCHED] * len(addresses)
+        v4 = []
+        v6 = []
+        for i, address in enumerate(addresses):
+            (v6 if ':' in address else v4).append(i)
+
+        for version, positions in ((4, v4), (6, v6)):
+            if not positions:
+                continue
+            family, width, boundaries, labels, vector = self._tables[version]
+            packed = []
+            valid = []
+            for i in positions:
+                try:
+                    packed.append(socket.inet_pton(family, addresses[i]))
+                    valid.append(i)
+                except (OSError, ValueError):
+                    pass
+
+            if vector is not None and valid:
+                values = numpy.frombuffer(b"".join(packed), dtype='>u8' if width == 16 else '>u4')
+                if width == 16:
+                    values = values[0::2]
+                found = numpy.searchsorted(vector, values.astype(numpy.uint64), side='right') - 1
+                for i, n in zip(valid, found.tolist()):
+                    if n >= 0:
+                        result[i] = labels[n]
+            else:
+                for i, raw in zip(valid, packed):
+                    n = bisect_right(boundaries, int.from_bytes(raw, 'big')) - 1
+                    if n >= 0:
+                        result[i] = labels[n]
+
+        return result
+
+    def stream(self, infile: TextIO, outfile: TextIO, batch_size: int = 65536) -> int:
+        """
+        Classify every non-blank line of `infile`, writing one result line per address to `outfile`.
+
+        Returns:
+            count (int): The number of addresses classified.
+        """
+        count = 0
+        lines = (line.strip() for line in infile)
+        addresses = (line for line in lines if line)
+        while True:
+            batch = list(islice(addresses, batch_size))
+            if not batch:
+                return count
+            outfile.write("\n".join(self.classify(batch)) + "\n")
+            count += len(batch)
@@ -0,0 +1,558 @@
+import dataclasses
+import ipaddress
+import re
+import threading
+
+from dataclasses import dataclass
+from typing import Callable, FrozenSet, Iterable, List, Optional, Tuple
+
+from .categories import CategoryIndex, Criteria, matcher
+from .index import RangeIndex
+from .snapshot import MAGIC as SNAPSHOT_MAGIC, Snapshot
+from .stream import iter_document, read_chunks
+
+
+@dataclass(frozen=True, slots=True)
+class IPRange:
+    """
+    Represents the individual line items from ip-ranges.json
+
+    Instances are immutable and slotted (no per-instance __dict__), and RangeData.from_dict shares one string
+    object between every row with the same service, region or network border group, since
+    there are tens of thousands of rows but only a few hundred distinct values.
+    """
+    ip_prefix: str = None
+    ipv6_prefix: str = None
+    region: str = None
+    service: str = None
+    network_border_group: str = None
+
+    def to_dict(self):
+        return dict(
+            ip_prefix=self.ip_prefix,
+            ipv6_prefix=self.ipv6_prefix,
+            region=self.region,
+            service=self.service,
+            network_border_group=self.network_border_group)
+
+    def __iter__(self):
+        for k in IPRANGE_FIELDS:
+            yield k, getattr(self, k)
+
+    def __getitem__(self, key):
+        if key not in IPRANGE_FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+IPRANGE_FIELDS = tuple(f.name for f in dataclasses.fields(IPRange))
+
+
+@dataclass(frozen=True, slots=True)
+class ProviderIPRange(IPRange):
+    """
+    An IPRange loaded from one of several providers, tagged with the code of the provider it came from.
+    """
+    provider: str = None
+
+    def to_dict(self):
+        return dict(IPRange.to_dict(self), provider=self.provider)
+
+    def __iter__(self):
+        for k in PROVIDER_IPRANGE_FIELDS:
+            yield k, getattr(self, k)
+
+    def __getitem__(self, key):
+        if key not in PROVIDER_IPRANGE_FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+PROVIDER_IPRANGE_FIELDS = tuple(f.name for f in dataclasses.fields(ProviderIPRange))
+
+
+@dataclass
+class PrefixList:
+    """
+    The return type of RangeData.query, containing separate lists of IPRanges for IPv4 and IPv6.
+    """
+    ipv4: List[IPRange]
+    ipv6: List[IPRange]
+
+    def all(self):
+        return self.ipv4 + self.ipv6
+
+
+def _values(*tables: Iterable[Optional[str]]) -> FrozenSet[str]:
+    """The distinct values seen for a category, without None."""
+    return frozenset(v for table in tables for v in table if v is not None)
+
+
+@dataclass(frozen=True, eq=False)
+class RangeData:
+    """
+    RangeData represents the data structure of the ip-ranges.json file.
+
+    A RangeData never changes once it's built: its rows are immutable tuples of frozen IPRanges, and it owns
+    the distinct `services`, `regions` and `network_border_groups` of the document it was built from. Its
+    indexes are built once, on first use or by `prepare`, and never modified afterwards, so any number of
+    threads can look up and query the same RangeData without locking. To move to new data, build a new
+    RangeData and swap it in (see ActiveRangeData).
+
+        data = RangeData.from_file('ip-ranges.json')
+        data.lookup('52.95.110.1', longest=True)
+        data.query(service='EC2', region='us-east-1').ipv4
+    """
+    syncToken: str
+    createDate: str
+    prefixes: Tuple[IPRange, ...]
+    ipv6_prefixes: Tuple[IPRange, ...]
+    # Every value in the document, including those of rows dropped by the filters of from_stream.
+    services: FrozenSet[str] = None
+    regions: FrozenSet[str] = None
+    network_border_groups: FrozenSet[str] = None
+
+    def __post_init__(self):
+        # Reentrant, since building one value can need another (e.g. SnapshotRangeData's index needs its rows).
+        object.__setattr__(self, '_lock', threading.RLock())
+        if 'prefixes' not in self.__dict__:
+            return  # Rows loaded on demand, e.g. by SnapshotRangeData.
+        object.__setattr__(self, 'prefixes', tuple(self.prefixes))
+        object.__setattr__(self, 'ipv6_prefixes', tuple(self.ipv6_prefixes))
+        items = self.prefixes + self.ipv6_prefixes
+        for field, attribute in (('services', 'service'), ('regions', 'region'),
+                                 ('network_border_groups', 'network_border_group')):
+            values = getattr(self, field)
+            object.__setattr__(self, field, frozenset(values) if values is not None else
+                               _values(getattr(i, attribute) for i in items))
+
+    def _once(self, name: str, build: Callable):
+        """
+        Return the value cached as `name`, building it first if needed. The lock is only taken until it's built
+        (and makes concurrent first uses share one build); reads after that are a dictionary lookup.
+        """
+        try:
+            return self.__dict__[name]
+        except KeyError:
+            pass
+        with self._lock:
+            if name not in self.__dict__:
+                self.__dict__[name] = build()
+            return self.__dict__[name]
+
+    @staticmethod
+    def from_dict(data: dict) -> 'RangeData':
+        # One shared string per distinct value; these double as the category tables.
+        regions = {}
+        services = {}
+        groups = {}
+
+        def _rows(items):
+            region, service, group = regions.setdefault, services.setdefault, groups.setdefault
+            return [
+                IPRange(
+                    i.get('ip_prefix'),
+                    i.get('ipv6_prefix'),
+                    region(i.get('region'), i.get('region')),
+                    service(i.get('service'), i.get('service')),
+                    group(i.get('network_border_group'), i.get('network_border_group')))
+                for i in items
+            ]
+
+        ip4 = _rows(data.get('prefixes', []))
+        ip6 = _rows(data.get('ipv6_prefixes', []))
+
+        return RangeData(
+            syncToken=data['syncToken'],
+            createDate=data['createDate'],
+            prefixes=ip4,
+            ipv6_prefixes=ip6,
+            services=_values(services),
+            regions=_values(regions),
+            network_border_groups=_values(groups)
+        )
+
+    @staticmethod
+    def from_stream(chunks: Iterable[bytes],
+                    service: Criteria = '*',
+                    region: Criteria = '*',
+                    network_border_group: Criteria = '*',
+                    ipv4: bool = True,
+                    ipv6: bool = True) -> 'RangeData':
+        """
+        Build a RangeData while parsing ip-ranges.json incrementally from `chunks` (e.g. a streamed download),
+        so neither the whole document nor its decoded form is ever held in memory.
+
+        Rows that don't match `service`, `region` and `network_border_group` (compared as in `query`), or whose
+        IP version is turned off, are dropped as they're parsed, so memory use follows the size of the result.
+        The category tables (`services`, `regions`, `network_border_groups`) still see the values of every row.
+
+        Examples:
+            with open('ip-ranges.json', 'rb') as f:
+                data = RangeData.from_stream(read_chunks(f), service='EC2', ipv6=False)
+
+        Raises:
+            ValueError: when the document isn't valid JSON, or lacks a syncToken/createDate.
+        """
+        regions = {}
+        services = {}
+        groups = {}
+        match_categories = matcher(service, region, network_border_group)
+        rows = {'prefixes': [] if ipv4 else None, 'ipv6_prefixes': [] if ipv6 else None}
+        meta = {}
+        # Whether each distinct (service, region, network_border_group) passes the filters.
+        matches = {}
+
+        region_, service_, group_ = regions.setdefault, services.setdefault, groups.setdefault
+        for key, value in iter_document(chunks):
+            if key not in rows:
+                meta[key] = value
+                continue
+            item = IPRange(
+                value.get('ip_prefix'),
+                value.get('ipv6_prefix'),
+                region_(value.get('region'), value.get('region')),
+                service_(value.get('service'), value.get('service')),
+                group_(value.get('network_border_group'), value.get('network_border_group')))
+            if rows[key] is None:
+                continue
+            if match_categories is not None:
+                category = (item.service, item.region, item.network_border_group)
+                match = matches.get(category)
+                if match is None:
+                    match = matches[category] = match_categories(item)
+                if not match:
+                    continue
+            rows[key].append(item)
+
+        try:
+            return RangeData(
+                syncToken=meta['syncToken'],
+                createDate=meta['createDate'],
+                prefixes=rows['prefixes'] or [],
+                ipv6_prefixes=rows['ipv6_prefixes'] or [],
+                services=_values(services),
+                regions=_values(regions),
+                network_border_groups=_values(groups)
+            )
+        except KeyError as e:
+            raise ValueError(f"Not an ip-ranges.json document: missing {e}")
+
+    @staticmethod
+    def from_bytes(body: bytes, **filters) -> 'RangeData':
+        """Build a RangeData from the contents of ip-ranges.json. `filters` are as for from_stream."""
+        return RangeData.from_stream([body], **filters)
+
+    @staticmethod
+    def from_file(path: str, **filters) -> 'RangeData':
+        """
+        Load a local copy of ip-ranges.json, or a snapshot written by ipranges.snapshot.write_snapshot
+        (which is memory-mapped rather than read; `filters` only apply to JSON files).
+        """
+        with open(path, 'rb') as f:
+            if f.read(len(SNAPSHOT_MAGIC)) == SNAPSHOT_MAGIC:
+                return SnapshotRangeData(Snapshot(path))
+            f.seek(0)
+            return RangeData.from_stream(read_chunks(f), **filters)
+
+    @staticmethod
+    def from_url(url: str, cache=None, fetcher=None, **filters) -> 'RangeData':
+        """
+        Download and parse ip-ranges.json from `url` (or read a local path or file:// URL), through `cache`
+        (a DownloadCache) when one is given, with `fetcher` (an ipranges.fetch.Fetcher) setting the timeouts
+        and retries. `filters` are as for from_stream.
+
+        Raises:
+            DownloadError: when the document can't be downloaded.
+            ValueError: when it isn't a valid ip-ranges.json document.
+        """
+        from .cache import read_source
+
+        return RangeData.from_stream(read_source(url, cache=cache, fetcher=fetcher), **filters)
+
+    def row_count(self) -> int:
+        """The number of IPv4 and IPv6 rows."""
+        return len(self.prefixes) + len(self.ipv6_prefixes)
+
+    def prepare(self) -> 'RangeData':
+        """Build the indexes now rather than on first use, e.g. before making the data visible to other threads."""
+        self.index
+        self.categories
+        return self
+
+    @property
+    def index(self) -> RangeIndex:
+        """
+        An interval index over both `prefixes` and `ipv6_prefixes`, built on first use.
+        """
+        return self._once('_index', lambda: RangeIndex(self.prefixes + self.ipv6_prefixes))
+
+    def lookup(self, ip: str, longest: bool = False) -> List[IPRange]:
+        """
+        Return the IPRanges whose prefix contains `ip`, most specific prefix first.
+
+        Examples:
+            data.lookup('52.95.110.1')                # Every service/region/border group containing the address.
+            data.lookup('52.95.110.1', longest=True)  # Only the longest-prefix match.
+
+        Args:
+            ip (str): An IPv4 or IPv6 address.
+            longest (bool): Only return rows for the longest matching prefix.
+
+        Raises:
+            ValueError: when `ip` isn't a valid IP address.
+
+        Returns:
+            result (List[IPRange]): The matching rows, or an empty list.
+        """
+        if longest:
+            return self.index.longest_match(ip)
+        return self.index.containing(ip)
+
+    @property
+    def categories(self) -> tuple:
+        """
+        Inverted service/region/border group indexes over `prefixes` and `ipv6_prefixes`, built on first use.
+        """
+        return self._once('_categories', lambda: (CategoryIndex(self.prefixes), CategoryIndex(self.ipv6_prefixes)))
+
+    def query(self,
+              service: Criteria = '*',
+              region: Criteria = '*',
+              network_border_group: Criteria = '*',
+              prefix_pattern: str = '',
+              prefix_match_type: str = 'prefix',
+              re_flags: Optional[re.RegexFlag] = None,
+              within: Criteria = None,
+              overlaps: Criteria = None) -> PrefixList:
+        """
+        Filter the IPRanges by basic criteria like service and/or region, by address range, or regex/substring matching against the CIDR string.
+
+        `region`, `service`, and `network_border_group` are evaluated with "==", after lower-casing regions and upper-casing services.
+        Each of them also accepts a list of values, which are "OR"ed together. They're answered from the inverted indexes in `categories`,
+        so only the matching rows are visited.
+
+        `within` and `overlaps` compare address ranges, not text: `within` keeps prefixes inside a network (or any of several networks),
+        and `overlaps` keeps prefixes sharing any address with one. They're answered from the interval index, so they cost a few bisects
+        plus the size of the result, and the result is in address order. Prefer them over `prefix_pattern`, which only matches the CIDR
+        string (e.g. the prefix '10.1' matches 10.1.0.0/16 and 10.100.0.0/16, but not 10.0.0.0/8).
+
+        Examples:
+            data.query(service='EC2')                                      # All EC2 IP ranges in all regions.
+            data.query(service='EC2', region='us-east-1')                  # EC2 IP ranges in us-east-1.
+            data.query(network_border_group='us-east-1-wl1-bos-wlz-1')     # All services in the 'us-east-1-wl1-bos-wlz-1' network border group.
+            data.query(service=['EC2', 'S3'], region=['us-east-1', 'us-west-2']) # EC2 or S3, in us-east-1 or us-west-2.
+            data.query(within='52.0.0.0/8')                                # Every prefix inside 52.0.0.0/8.
+            data.query(overlaps=['10.0.0.0/8', '172.16.0.0/12'])           # Every prefix sharing addresses with either network.
+            data.query(prefix_pattern='12.34', prefix_match_type='prefix') # Returns all addresses starting with `12.34`.
+
+        Args:
+            service (str|List[str]): Return only rows matching this service (or any of these services).
+            region (str|List[str]): Return only rows matching this region (or any of these regions).
+            network_border_group (str|List[str]): Return only rows matching this network border group (or any of these).
+            prefix_pattern (str): A regular expression or substring to match.
+            prefix_match_type (str): Whether to treat `prefix_pattern` as `regex`, `substr`, or `prefix` (startswith)
+            re_flags (re.RegexFlag): A way to pass in regex flags as needed. When re_flags is None, assumes `re.MULTILINE`.
+            within (str|List[str]): Return only rows whose prefix lies inside this network (or any of these networks).
+            overlaps (str|List[str]): Return only rows whose prefix overlaps this network (or any of these networks).
+
+        Raises:
+            ValueError: when an invalid prefix_match_type, regular expression or network is specified.
+
+        Returns:
+            result (PrefixList): A list of IPv4 and IPv6 matches.
+        """
+        match_prefix = self._prefix_matcher(prefix_pattern, prefix_match_type, re_flags)
+        within = [within] if isinstance(within, str) else list(within or ())
+        overlaps = [overlaps] if isinstance(overlaps, str) else list(overlaps or ())
+
+        if within or overlaps:
+            return self._query_ranges(within, overlaps, matcher(service, region, network_border_group), match_prefix)
+
+        def _query(items, categories):
+            result = []
+            for i in categories.select(service, region, network_border_group):
+                item = items[i]
+                prefix = item.ip_prefix if item.ip_prefix is not None else item.ipv6_prefix
+                if match_prefix is None or match_prefix(prefix):
+                    result.append(item)
+            return result
+
+        ip4 = _query(self.prefixes, self.categories[0])
+        ip6 = _query(self.ipv6_prefixes, self.categories[1])
+
+        return PrefixList(**{
+            "ipv4": ip4,
+            "ipv6": ip6,
+        })
+
+    @staticmethod
+    def _prefix_matcher(pattern: str, method: str, re_flags: Optional[re.RegexFlag] = None):
+        """
+        Returns a function testing a CIDR string against `pattern`, or None when there's no pattern.
+        Regular expressions are compiled once here rather than for every row.
+        """
+        if method not in ('substr', 'prefix', 'regex'):
+            raise ValueError(f"Unknown match method '{method}'")
+        if pattern == '':
+            return None # N/A
+
+        if method == 'substr':
+            return lambda prefix: pattern in prefix
+        elif method == 'prefix':
+            return lambda prefix: prefix.startswith(pattern)
+
+        try:
+            regex = re.compile(pattern, re.MULTILINE if re_flags is None else re_flags)
+        except re.error as e:
+            raise ValueError(f"Invalid regular expression {pattern!r}: {e}")
+
+        def _search(prefix):
+            g = regex.search(prefix)
+            return g is not None and len(g.group()) > 0
+        return _search
+
+    def _query_ranges(self, within: List[str], overlaps: List[str], match_categories, match_prefix) -> PrefixList:
+        """
+        Implements `query` for `within`/`overlaps`, starting from the interval index rather than the category indexes.
+        """
+        networks = [ipaddress.ip_network(n, strict=False) for n in within + overlaps]
+        within_networks, overlaps_networks = networks[:len(within)], networks[len(within):]
+
+        # Seed with the more selective kind of filter; each row is then checked against the other.
+        if within:
+            seeds = [row for n in within_networks for row in self.index.within(n)]
+        else:
+            seeds = [row for n in overlaps_networks for row in self.index.overlapping(n)]
+
+        result = {4: [], 6: []}
+        seen = set()
+        for item in seeds:
+            if id(item) in seen:
+                continue
+            seen.add(id(item))
+            prefix = item.ip_prefix if item.ip_prefix is not None else item.ipv6_prefix
+            if within and overlaps:
+                network = ipaddress.ip_network(prefix, strict=False)
+                if not any(network.overlaps(n) for n in overlaps_networks):
+                    continue
+            if match_categories is not None and not match_categories(item):
+                continue
+            if match_prefix is not None and not match_prefix(prefix):
+                continue
+            result[4 if item.ip_prefix is not None else 6].append(item)
+
+        if len(networks) > 1:
+            # Results from several networks can interleave.
+            for rows in result.values():
+                rows.sort(key=lambda i: ipaddress.ip_network(i.ip_prefix or i.ipv6_prefix, strict=False))
+
+        return PrefixList(ipv4=result[4], ipv6=result[6])
+
+
+class SnapshotRangeData(RangeData):
+    """
+    RangeData backed by a memory-mapped Snapshot.
+
+    `prefixes` and `ipv6_prefixes` are only built when something needs every row (e.g. `lookup`).
+    Queries that don't use `prefix_pattern`, `within` or `overlaps` filter on the snapshot's category ids and only create
+    IPRanges for the matching rows.
+    """
+    def __init__(self, snapshot: Snapshot):
+        set_ = object.__setattr__
+        set_(self, 'snapshot', snapshot)
+        set_(self, 'syncToken', snapshot.sync_token)
+        set_(self, 'createDate', snapshot.create_date)
+        set_(self, 'services', frozenset(snapshot.services))
+        set_(self, 'regions', frozenset(snapshot.regions))
+        set_(self, 'network_border_groups', frozenset(snapshot.border_groups))
+        self.__post_init__()
+
+    def row_count(self) -> int:
+        return len(self.snapshot)
+
+    @property
+    def prefixes(self) -> Tuple[IPRange, ...]:
+        return self._once('_prefixes', lambda: tuple(IPRange(**row) for row in self.snapshot.rows(4)))
+
+    @property
+    def ipv6_prefixes(self) -> Tuple[IPRange, ...]:
+        return self._once('_ipv6_prefixes', lambda: tuple(IPRange(**row) for row in self.snapshot.rows(6)))
+
+    def query(self,
+              service: Criteria = '*',
+              region: Criteria = '*',
+              network_border_group: Criteria = '*',
+              prefix_pattern: str = '',
+              prefix_match_type: str = 'prefix',
+              re_flags: Optional[re.RegexFlag] = None,
+              within: Criteria = None,
+              overlaps: Criteria = None) -> PrefixList:
+        """Implements RangeData.query"""
+        if prefix_pattern != '' or within or overlaps:
+            return super().query(service, region, network_border_group, prefix_pattern, prefix_match_type, re_flags,
+                                 within, overlaps)
+
+        def _query(version):
+            rows = self.snapshot.select(version, service, region, network_border_group)
+            return [IPRange(**self.snapshot.row(version, i)) for i in rows]
+
+        return PrefixList(ipv4=_query(4), ipv6=_query(6))
+
+
+class ActiveRangeData:
+    """
+    The RangeData an application is currently answering from, replaced atomically when new data arrives.
+
+    Readers never lock: `data` is a single reference, and each RangeData is immutable, so a request that
+    fetched it keeps a consistent view even while `replace` swaps in a newer one. Only `replace` takes a
+    lock, so that concurrent replacements don't go backwards.
+
+        ACTIVE = ActiveRangeData(RangeData.from_url(IP_RANGES_URL))
+
+        def handler(request):
+            return ACTIVE.lookup(request.client_ip, longest=True)
+
+        def refresh():  # e.g. from a background thread
+            ACTIVE.replace(RangeData.from_url(IP_RANGES_URL))
+    """
+    def __init__(self, data: Optional[RangeData] = None):
+        self._data = data.prepare() if data is not None else None
+        self._lock = threading.Lock()
+
+    @property
+    def data(self) -> RangeData:
+        """
+        The current RangeData. Hold on to it (rather than reading this again) for answers that must agree.
+
+        Raises:
+            LookupError: when no data has been set yet.
+        """
+        data = self._data
+        if data is None:
+            raise LookupError("No IP ranges have been loaded yet")
+        return data
+
+    def replace(self, data: RangeData) -> bool:
+        """
+        Make `data` the current RangeData, unless it's older (by syncToken) than the current one.
+        Its indexes are built first, so no reader ever waits for them.
+
+        Returns:
+            replaced (bool): False when `data` was older, and the current RangeData was kept.
+        """
+        from .cache import older
+
+        data.prepare()
+        with self._lock:
+            if self._data is not None and older(data.syncToken, self._data.syncToken):
+                return False
+            self._data = data
+            return True
+
+    def lookup(self, ip: str, longest: bool = False) -> List[IPRange]:
+        """See RangeData.lookup"""
+        return self.data.lookup(ip, longest=longest)
+
+    def query(self, *args, **kwargs) -> PrefixList:
+        """See RangeData.query"""
+        return self.data.query(*args, **kwargs)
+
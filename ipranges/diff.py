@@ -0,0 +1,45 @@
+import ipaddress
+
+from dataclasses import dataclass
+from typing import Iterable, List
+
+# The fields that identify a row; two rows are the same when all of them match.
+KEY_FIELDS = ('ip_prefix', 'ipv6_prefix', 'region', 'service', 'network_border_group')
+
+
+@dataclass
+class PrefixChange:
+    """
+    A row that was added to or removed from the IP ranges between two copies of the data.
+    """
+    change: str = None
+    ip_prefix: str = None
+    ipv6_prefix: str = None
+    region: str = None
+    service: str = None
+    network_border_group: str = None
+
+
+def diff(old: Iterable, new: Iterable) -> List[PrefixChange]:
+    """
+    Compare two sets of IPRanges using hashed sets, so it costs O(len(old) + len(new)) plus sorting the changes.
+
+    Returns:
+        changes (List[PrefixChange]): Removed and added rows, ordered by service, region,
+            border group, then "removed" before "added", then address.
+    """
+    def _keys(items):
+        return {tuple(getattr(item, f) for f in KEY_FIELDS) for item in items}
+
+    before = _keys(old)
+    after = _keys(new)
+
+    changes = [PrefixChange('removed', *key) for key in before - after]
+    changes += [PrefixChange('added', *key) for key in after - before]
+
+    def _order(c: PrefixChange):
+        network = ipaddress.ip_network(c.ip_prefix or c.ipv6_prefix, strict=False)
+        return (str(c.service), str(c.region), str(c.network_border_group),
+                c.change != 'removed', network.version, int(network.network_address), network.prefixlen)
+
+    return sorted(changes, key=_order)
@@ -0,0 +1,286 @@
+import random
+import threading
+import time
+import zlib
+
+from typing import Iterator, Optional
+
+# How much of a streamed response body to read at a time.
+CHUNK_SIZE = 1 << 16
+
+# Defaults for Fetcher: seconds to wait for a connection, and for each read from it.
+CONNECT_TIMEOUT = 5.0
+READ_TIMEOUT = 30.0
+
+# Defaults for Fetcher: attempts after the first, and the delay before the first retry (doubled for each one after).
+RETRIES = 3
+BACKOFF = 0.5
+
+# The longest delay between attempts, including one asked for with Retry-After.
+MAX_BACKOFF = 30.0
+
+# Responses worth retrying; other 4xx/5xx responses fail straight away.
+RETRY_STATUSES = frozenset({408, 429, 500, 502, 503, 504})
+
+
+class DownloadError(Exception):
+    """Raised when a document can't be downloaded."""
+
+
+def _decoder(encoding: Optional[str]):
+    """A streaming decompressor for a Content-Encoding, or None for an uncompressed body."""
+    encoding = (encoding or 'identity').strip().lower()
+    if encoding in ('gzip', 'x-gzip'):
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if encoding == 'deflate':
+        return zlib.decompressobj()
+    if encoding == 'identity':
+        return None
+    raise DownloadError(f"Unsupported Content-Encoding '{encoding}'")
+
+
+class Fetcher:
+    """
+    HTTP GETs over one pooled session, bounded in time.
+
+    Each attempt has separate connect and read timeouts. Connection failures, timeouts and retryable statuses
+    (e.g. 503, or 429 with Retry-After) are retried up to `retries` times with jittered exponential backoff,
+    and `deadline` (when given) bounds the whole download, retries included, so a server trickling bytes can't
+    hold a cron slot either.
+
+    Bodies are requested gzip-compressed and decompressed as they're read, so a transfer that breaks midway can
+    be resumed where it stopped with a Range request (or, when the server doesn't support ranges, by downloading
+    it again and skipping what was already read).
+
+        fetcher = Fetcher(read_timeout=10, retries=5, deadline=120)
+        for chunk in fetcher.get(url, stream=True).chunks():
+            ...
+    """
+    def __init__(self,
+                 connect_timeout: float = CONNECT_TIMEOUT,
+                 read_timeout: float = READ_TIMEOUT,
+                 retries: int = RETRIES,
+                 backoff: float = BACKOFF,
+                 deadline: Optional[float] = None):
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.deadline = deadline
+        self._session = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        """The pooled requests.Session, created on first use; `requests` is only imported then."""
+        with self._lock:
+            if self._session is None:
+                import requests
+
+                self._session = requests.Session()
+                self._session.headers['Accept-Encoding'] = 'gzip'
+            return self._session
+
+    def get(self, url: str, headers: Optional[dict] = None, stream: bool = False) -> 'Response':
+        """
+        GET `url`, raising DownloadError once it has failed `retries + 1` times, for 4xx/5xx responses that
+        aren't worth retrying, and when the deadline passes.
+
+        With `stream`, only the headers are read before returning; the body is read from `Response.chunks()`,
+        so it never has to be held in memory all at once.
+        """
+        started = time.monotonic()
+        response = Response.streaming(self, url, headers or {}, self._send(url, headers or {}, started), started)
+        if not stream:
+            response.content = b"".join(response.chunks())
+        return response
+
+    def _send(self, url: str, headers: dict, started: float):
+        """Make the request, with retries; returns the (unread) requests.Response."""
+        import requests
+
+        attempt = 0
+        while True:
+            retry_after = None
+            try:
+                response = self.session.get(url, headers=headers, stream=True, timeout=self._timeout(started))
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = str(e)
+            except requests.RequestException as e:
+                raise DownloadError(f"{url}: {e}") from e
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    try:
+                        response.raise_for_status()
+                    except requests.HTTPError as e:
+                        response.close()
+                        raise DownloadError(str(e)) from e
+                    return response
+                error = f"HTTP {response.status_code}"
+                retry_after = response.headers.get('Retry-After')
+                response.close()
+            attempt += 1
+            self.pause(url, error, attempt, started, retry_after)
+
+    def pause(self, url: str, error: str, attempt: int, started: float, retry_after: Optional[str] = None):
+        """
+        Wait before retry number `attempt`, or raise DownloadError when there are no retries left or the
+        wait would run past the deadline.
+        """
+        if attempt > self.retries:
+            raise DownloadError(f"{url}: {error} (gave up after {attempt} attempts)")
+        delay = min(MAX_BACKOFF, self.backoff * 2 ** (attempt - 1)) * random.uniform(0.5, 1.5)
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, min(float(retry_after), MAX_BACKOFF))
+        self.check_deadline(url, started, delay)
+        time.sleep(delay)
+
+    def _timeout(self, started: float) -> tuple:
+        """The (connect, read) timeouts for an attempt, shortened so it can't run far past the deadline."""
+        if self.deadline is None:
+            return self.timeout
+        remaining = max(0.001, self.deadline - (time.monotonic() - started))
+        return tuple(min(timeout, remaining) for timeout in self.timeout)
+
+    def check_deadline(self, url: str, started: float, extra: float = 0.0):
+        if self.deadline is not None and time.monotonic() - started + extra > self.deadline:
+            raise DownloadError(f"{url}: not downloaded within the {self.deadline:g}s deadline")
+
+
+class Response:
+    """
+    The parts of an HTTP response the rest of the code needs, independent of the HTTP client.
+
+    A streamed response (see `Fetcher.get`) has no `content`; its body is read by iterating `chunks()` once.
+    """
+    def __init__(self, status_code: int, content: Optional[bytes], headers: dict, raw=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+        self._raw = raw
+        self._fetcher = None
+        self._url = None
+        self._request_headers = None
+        self._started = None
+
+    @classmethod
+    def streaming(cls, fetcher: Fetcher, url: str, request_headers: dict, raw, started: float) -> 'Response':
+        response = cls(raw.status_code, None, raw.headers, raw=raw)
+        response._fetcher = fetcher
+        response._url = url
+        response._request_headers = request_headers
+        response._started = started
+        return response
+
+    def chunks(self, size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        """
+        Yield the (decompressed) body in chunks as it arrives.
+
+        When the connection fails midway, the rest is requested again (see Fetcher) and reading carries on;
+        DownloadError is raised once the retries or the deadline run out, or if the document changed in between.
+        """
+        if self._raw is None:
+            if self.content:
+                yield self.content
+            return
+
+        import requests
+        import urllib3
+
+        raw = self._raw
+        self._raw = None
+        fetcher = self._fetcher
+        decoder = _decoder(raw.headers.get('Content-Encoding'))
+        received = 0  # Bytes of the body as sent (i.e. compressed)
+        produced = 0  # Bytes yielded
+        skip = 0      # Bytes to drop after restarting from the beginning
+        attempt = 0
+        try:
+            while True:
+                try:
+                    for block in self._blocks(raw, size):
+                        received += len(block)
+                        data = decoder.decompress(block) if decoder else block
+                        if skip:
+                            dropped = min(skip, len(data))
+                            data = data[dropped:]
+                            skip -= dropped
+                        if data:
+                            produced += len(data)
+                            yield data
+                    if decoder is not None:
+                        tail = decoder.flush()
+                        if tail:
+                            produced += len(tail)
+                            yield tail
+                    return
+                except (urllib3.exceptions.HTTPError, requests.RequestException, OSError, zlib.error) as e:
+                    raw.close()
+                    fetcher.check_deadline(self._url, self._started)
+                    attempt += 1
+                    fetcher.pause(self._url, f"download interrupted: {e}", attempt, self._started)
+                    raw = self._resume(received)
+                    if raw.status_code == 200:
+                        # No range support: start again, dropping what was already yielded.
+                        decoder = _decoder(raw.headers.get('Content-Encoding'))
+                        received, skip = 0, produced
+        finally:
+            raw.close()
+
+    def _blocks(self, raw, size: int) -> Iterator[bytes]:
+        """
+        Yield the body as sent (i.e. still encoded), bounded by the deadline.
+
+        Each read returns whatever has arrived (up to `size`) rather than waiting for `size` bytes, and the
+        socket's timeout is shortened to the time left before each one, so a server trickling a byte at a time
+        (which would reset a plain read timeout with every byte) is still stopped at the deadline.
+        """
+        fetcher = self._fetcher
+        body = raw.raw
+        connection = getattr(body, 'connection', None)
+        sock = getattr(connection, 'sock', None)
+        while True:
+            fetcher.check_deadline(self._url, self._started)
+            if sock is not None:
+                sock.settimeout(fetcher._timeout(self._started)[1])
+            block = body.read1(size, decode_content=False)
+            if not block:
+                return
+            yield block
+
+    def _resume(self, offset: int):
+        """Request the body from `offset` (of the encoded bytes) on, for the same version of the document."""
+        validator = self.headers.get('ETag') or self.headers.get('Last-Modified')
+        headers = dict(self._request_headers)
+        if validator and self.headers.get('Accept-Ranges', '').lower() == 'bytes':
+            headers['Range'] = f"bytes={offset}-"
+            headers['If-Range'] = validator
+
+        raw = self._fetcher._send(self._url, headers, self._started)
+        if raw.status_code == 206:
+            if not raw.headers.get('Content-Range', '').startswith(f"bytes {offset}-"):
+                raw.close()
+                raise DownloadError(f"{self._url}: the server resumed from the wrong offset")
+            return raw
+        if validator and (raw.headers.get('ETag') or raw.headers.get('Last-Modified')) != validator:
+            raw.close()
+            raise DownloadError(f"{self._url} changed while it was being downloaded")
+        return raw
+
+
+# Used by http_get when no Fetcher is given.
+_DEFAULT_FETCHER = None
+
+
+def http_get(url: str, headers: Optional[dict] = None, stream: bool = False, fetcher: Optional[Fetcher] = None) -> Response:
+    """
+    GET `url` with `fetcher` (by default, a shared Fetcher with the default timeouts and retries).
+    See Fetcher.get.
+
+    `requests` is only imported once a request is made, so commands served from a cache or snapshot never pay for loading it.
+    """
+    global _DEFAULT_FETCHER
+    if fetcher is None:
+        if _DEFAULT_FETCHER is None:
+            _DEFAULT_FETCHER = Fetcher()
+        fetcher = _DEFAULT_FETCHER
+    return fetcher.get(url, headers=headers, stream=stream)
@@ -0,0 +1,258 @@
+import json
+import os
+import re
+import time
+
+from bisect import bisect_right
+from dataclasses import dataclass
+from typing import Iterable, Iterator, List, Optional
+
+from .index import RangeIndex
+
+# Environment variable that enables the archive when --history-dir isn't given.
+HISTORY_DIR_ENV = 'AWS_IP_RANGES_HISTORY_DIR'
+
+# Dates accepted by parse_date: a day, optionally followed by a time (with ":" or "-" separators).
+_DATE = re.compile(r'(\d{4})-(\d{2})-(\d{2})(?:[T _-](\d{2})[:-](\d{2})(?:[:-](\d{2}))?)?Z?$')
+
+
+class HistoryError(Exception):
+    """Raised when the archive can't be used, e.g. a snapshot older than the latest one archived."""
+
+
+@dataclass
+class HistoricalRange:
+    """
+    A row of the IP ranges and one period it was published for: from the createDate of the snapshot that added
+    it to the createDate of the one that removed it (None while it's still in the latest archived snapshot).
+    """
+    ip_prefix: str = None
+    ipv6_prefix: str = None
+    region: str = None
+    service: str = None
+    network_border_group: str = None
+    valid_from: str = None
+    valid_to: str = None
+
+
+@dataclass
+class ArchivedSnapshot:
+    """One snapshot in the archive, and how many rows it added and removed."""
+    syncToken: str = None
+    createDate: str = None
+    added: int = 0
+    removed: int = 0
+    rows: int = 0
+
+
+def parse_date(text: str) -> str:
+    """
+    Convert a date ("2024-01-03", "2024-01-03T12:30:00Z", a createDate, or Unix seconds like a syncToken) to
+    createDate form, "YYYY-MM-DD-HH-MM-SS" in UTC, which sorts chronologically. A day alone means its last second.
+
+    Raises:
+        ValueError: when `text` isn't in one of those forms.
+    """
+    if text.isdigit():
+        return time.strftime('%Y-%m-%d-%H-%M-%S', time.gmtime(int(text)))
+    m = _DATE.match(text.strip())
+    if m is None:
+        raise ValueError(f"Expected a date like 2024-01-03 or 2024-01-03T12:30:00, got '{text}'")
+    year, month, day, hour, minute, second = m.groups()
+    if hour is None:
+        hour, minute, second = '23', '59', '59'
+    return f"{year}-{month}-{day}-{hour}-{minute}-{second or '00'}"
+
+
+def _key(item) -> tuple:
+    """The row as it's stored: prefix (ip_prefix or ipv6_prefix), region, service, border group."""
+    return (item.ip_prefix or item.ipv6_prefix, item.region, item.service, item.network_border_group)
+
+
+class History:
+    """
+    An append-only archive of the IP ranges over time, kept as the changes between consecutive snapshots.
+
+    The archive is one file, history.jsonl, with a line per snapshot:
+        {"syncToken": "...", "createDate": "...", "added": [[prefix, region, service, border group], ...], "removed": [...]}
+
+    Since only added and removed rows are stored, it grows with the churn in the data rather than with the number
+    of snapshots: a snapshot that changed nothing costs one short line.
+    """
+    def __init__(self, directory: str):
+        """
+        Args:
+            directory (str): Where the archive is kept. Created when the first snapshot is added.
+        """
+        self.directory = directory
+        self.path = os.path.join(directory, 'history.jsonl')
+
+    def records(self) -> Iterator[dict]:
+        """Yield each archived snapshot's changes, oldest first."""
+        try:
+            f = open(self.path)
+        except FileNotFoundError:
+            return
+        with f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def snapshots(self) -> List[ArchivedSnapshot]:
+        rows = 0
+        result = []
+        for record in self.records():
+            rows += len(record['added']) - len(record['removed'])
+            result.append(ArchivedSnapshot(record['syncToken'], record['createDate'],
+                                           len(record['added']), len(record['removed']), rows))
+        return result
+
+    def add(self, data) -> Optional[ArchivedSnapshot]:
+        """
+        Archive `data` (a RangeData) as the changes since the latest archived snapshot.
+
+        Raises:
+            HistoryError: when `data` is older than the latest archived snapshot.
+
+        Returns:
+            snapshot (ArchivedSnapshot): What was archived, or None when the archive already has this syncToken.
+        """
+        state = set()
+        latest = None
+        for record in self.records():
+            if record['syncToken'] == data.syncToken:
+                return None
+            state.difference_update(map(tuple, record['removed']))
+            state.update(map(tuple, record['added']))
+            latest = record
+
+        if latest is not None and data.createDate < latest['createDate']:
+            raise HistoryError(f"{data.createDate} (syncToken {data.syncToken}) is older than the latest archived "
+                               f"snapshot, {latest['createDate']}; import snapshots in chronological order")
+
+        rows = {_key(item) for item in list(data.prefixes) + list(data.ipv6_prefixes)}
+        added = sorted(rows - state, key=repr)
+        removed = sorted(state - rows, key=repr)
+        line = json.dumps({
+            'syncToken': data.syncToken,
+            'createDate': data.createDate,
+            'added': added,
+            'removed': removed,
+        }, separators=(',', ':')) + "\n"
+
+        os.makedirs(self.directory, exist_ok=True)
+        # One write per snapshot, so a reader never sees half a line unless the disk fills up or the machine dies
+        # mid-write; `records` would then fail on the last line, which is the one to delete.
+        with open(self.path, 'a') as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+        return ArchivedSnapshot(data.syncToken, data.createDate, len(added), len(removed), len(rows))
+
+    def index(self) -> 'HistoryIndex':
+        return HistoryIndex(self.records())
+
+
+class _Timeline:
+    """
+    Every period a prefix was published for, flattened into consecutive segments of snapshots (like
+    RangeIndex.segments, but over time): `active[i]` lists the rows published from snapshot `starts[i]`
+    until `starts[i + 1]`.
+    """
+    __slots__ = ('ip_prefix', 'ipv6_prefix', 'starts', 'active')
+
+    def __init__(self, prefix: str):
+        self.ip_prefix = None if ':' in prefix else prefix
+        self.ipv6_prefix = prefix if ':' in prefix else None
+        self.starts = []
+        self.active = []
+
+    def change(self, snapshot: int, rows: tuple):
+        if self.starts and self.starts[-1] == snapshot:
+            self.active[-1] = rows
+        else:
+            self.starts.append(snapshot)
+            self.active.append(rows)
+
+    def at(self, snapshot: int) -> tuple:
+        i = bisect_right(self.starts, snapshot) - 1
+        return self.active[i] if i >= 0 else ()
+
+
+class HistoryIndex:
+    """
+    Point-in-time lookups over the archive.
+
+    Replaying the archive once gives every row's validity periods. The prefixes go into a RangeIndex, and each
+    prefix keeps a timeline of which of its rows were published when, so looking an address up at a date costs
+    a bisect over the snapshot dates, the RangeIndex lookup, and a bisect in each containing prefix's timeline.
+    """
+    def __init__(self, records: Iterable[dict]):
+        self.snapshots: List[tuple] = []  # (createDate, syncToken), oldest first
+        self.rows: List[HistoricalRange] = []
+        timelines = {}
+        current = {}  # prefix -> {row key: HistoricalRange}, for the rows in the latest snapshot
+
+        for n, record in enumerate(records):
+            self.snapshots.append((record['createDate'], record['syncToken']))
+            touched = set()
+            for key in map(tuple, record['removed']):
+                row = current.get(key[0], {}).pop(key, None)
+                if row is not None:
+                    row.valid_to = record['createDate']
+                    touched.add(key[0])
+            for key in map(tuple, record['added']):
+                prefix, region, service, group = key
+                row = HistoricalRange(None if ':' in prefix else prefix, prefix if ':' in prefix else None,
+                                      region, service, group, valid_from=record['createDate'])
+                current.setdefault(prefix, {})[key] = row
+                self.rows.append(row)
+                touched.add(prefix)
+            for prefix in touched:
+                if prefix not in timelines:
+                    timelines[prefix] = _Timeline(prefix)
+                timelines[prefix].change(n, tuple(current[prefix].values()))
+
+        self._dates = [date for date, _ in self.snapshots]
+        self._index = RangeIndex(timelines.values())
+
+    def __len__(self):
+        return len(self.snapshots)
+
+    def snapshot_at(self, at: Optional[str] = None) -> Optional[int]:
+        """
+        The position of the snapshot in effect at `at` (a createDate, see parse_date; default: the latest),
+        or None before the first one.
+        """
+        if at is None:
+            return len(self.snapshots) - 1 if self.snapshots else None
+        n = bisect_right(self._dates, at) - 1
+        return n if n >= 0 else None
+
+    def lookup(self, ip, at: Optional[str] = None, longest: bool = False) -> List[HistoricalRange]:
+        """
+        Return the rows containing `ip` that were published at `at`, most specific prefix first
+        (only the most specific prefix's rows with `longest`).
+
+        Raises:
+            ValueError: when `ip` isn't a valid IPv4 or IPv6 address.
+        """
+        n = self.snapshot_at(at)
+        if n is None:
+            self._index.containing(ip)  # Still reject invalid addresses.
+            return []
+        result = []
+        for timeline in self._index.containing(ip):
+            rows = timeline.at(n)
+            if rows and longest:
+                return list(rows)
+            result.extend(rows)
+        return result
+
+    def state(self, at: Optional[str] = None) -> List[HistoricalRange]:
+        """Return every row published at `at`, i.e. the archived copy of the data as it was then."""
+        n = self.snapshot_at(at)
+        if n is None:
+            return []
+        date = self._dates[n]
+        return [row for row in self.rows if row.valid_from <= date and (row.valid_to is None or date < row.valid_to)]
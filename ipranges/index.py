@@ -0,0 +1,159 @@
+import ipaddress
+
+from bisect import bisect_left, bisect_right
+from typing import List
+
+
+class RangeIndex:
+    """
+    A sorted integer-interval table for answering "which prefixes contain this IP?" (and "which
+    prefixes are inside or overlap this network?").
+
+    Every prefix is stored as an inclusive [start, end] pair of integers, sorted by
+    start address (widest first on ties). Since CIDR blocks are either nested or
+    disjoint, each interval also records the index of its nearest enclosing interval,
+    so a lookup is one bisect followed by a short walk up the nesting chain (at most
+    the prefix length, in practice only a handful of steps).
+
+    Rows that share an identical prefix (e.g. AMAZON and EC2) are grouped together.
+    """
+    def __init__(self, items):
+        """
+        Args:
+            items: An iterable of IPRanges (or anything with `ip_prefix` and `ipv6_prefix`)
+        """
+        groups = {4: {}, 6: {}}
+        for item in items:
+            network = ipaddress.ip_network(item.ip_prefix or item.ipv6_prefix, strict=False)
+            key = (int(network.network_address), int(network.broadcast_address))
+            groups[network.version].setdefault(key, []).append(item)
+
+        self._tables = {version: self._build(rows) for version, rows in groups.items()}
+
+    @staticmethod
+    def _build(groups: dict) -> tuple:
+        keys = sorted(groups, key=lambda k: (k[0], -k[1]))
+        starts = [k[0] for k in keys]
+        ends = [k[1] for k in keys]
+        rows = [groups[k] for k in keys]
+
+        parents = []
+        stack = []
+        for i, (start, end) in enumerate(keys):
+            while stack and ends[stack[-1]] < start:
+                stack.pop()
+            parents.append(stack[-1] if stack else -1)
+            stack.append(i)
+
+        return starts, ends, parents, rows
+
+    def segments(self, version: int) -> tuple:
+        """
+        Flatten the nested intervals for one IP version into disjoint segments.
+
+        Returns a pair `(boundaries, groups)` where `boundaries` is a sorted list of segment start
+        addresses and `groups[i]` is the list of rows for the most specific prefix covering
+        `[boundaries[i], boundaries[i + 1])`, or None where no prefix applies. This trades the
+        nesting walk in `longest_match` for a single bisect, which suits bulk/vectorized lookups.
+        """
+        starts, ends, _, rows = self._tables[version]
+        boundaries = []
+        labels = []
+
+        def _emit(position, label):
+            if boundaries and boundaries[-1] == position:
+                labels[-1] = label
+            elif not labels or labels[-1] != label:
+                boundaries.append(position)
+                labels.append(label)
+
+        stack = []
+        for i, start in enumerate(starts):
+            while stack and ends[stack[-1]] < start:
+                top = stack.pop()
+                _emit(ends[top] + 1, stack[-1] if stack else -1)
+            _emit(start, i)
+            stack.append(i)
+        while stack:
+            top = stack.pop()
+            _emit(ends[top] + 1, stack[-1] if stack else -1)
+
+        return boundaries, [rows[i] if i >= 0 else None for i in labels]
+
+    def __len__(self):
+        return sum(len(table[0]) for table in self._tables.values())
+
+    def _chain(self, ip):
+        """Yields the row groups containing `ip`, most specific first."""
+        address = ipaddress.ip_address(ip)
+        starts, ends, parents, rows = self._tables[address.version]
+        value = int(address)
+
+        i = bisect_right(starts, value) - 1
+        while i >= 0 and ends[i] < value:
+            i = parents[i]
+        while i >= 0:
+            yield rows[i]
+            i = parents[i]
+
+    def containing(self, ip) -> List:
+        """
+        Return every row whose prefix contains `ip`, ordered from the most specific prefix to the least.
+
+        Raises:
+            ValueError: when `ip` isn't a valid IPv4 or IPv6 address.
+        """
+        return [row for group in self._chain(ip) for row in group]
+
+    def longest_match(self, ip) -> List:
+        """
+        Return the rows for the longest (most specific) prefix containing `ip`, or an empty list.
+
+        Raises:
+            ValueError: when `ip` isn't a valid IPv4 or IPv6 address.
+        """
+        for group in self._chain(ip):
+            return list(group)
+        return []
+
+    def _range(self, network) -> tuple:
+        network = ipaddress.ip_network(network, strict=False)
+        return self._tables[network.version], int(network.network_address), int(network.broadcast_address)
+
+    def within(self, network) -> List:
+        """
+        Return every row whose prefix lies inside `network` (including `network` itself), in address order.
+
+        Prefixes inside a network start inside it, so this is two bisects and a scan of the matching slice.
+
+        Raises:
+            ValueError: when `network` isn't a valid IPv4 or IPv6 network.
+        """
+        (starts, ends, _, rows), first, last = self._range(network)
+        result = []
+        for i in range(bisect_left(starts, first), bisect_right(starts, last)):
+            # The only prefixes starting inside `network` but not lying inside it are ones containing it.
+            if ends[i] <= last:
+                result.extend(rows[i])
+        return result
+
+    def overlapping(self, network) -> List:
+        """
+        Return every row whose prefix overlaps `network`, in address order.
+
+        CIDR blocks overlap only when one contains the other, so these are the prefixes containing `network`
+        (the nesting chain above its first address) followed by the prefixes inside it (see `within`).
+
+        Raises:
+            ValueError: when `network` isn't a valid IPv4 or IPv6 network.
+        """
+        (starts, ends, parents, rows), first, last = self._range(network)
+        enclosing = []
+        i = bisect_right(starts, first) - 1
+        while i >= 0 and ends[i] < first:
+            i = parents[i]
+        while i >= 0:
+            if starts[i] < first or ends[i] > last:
+                enclosing.append(rows[i])
+            i = parents[i]
+        return [row for group in reversed(enclosing) for row in group] + self.within(network)
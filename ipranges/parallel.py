@@ -0,0 +1,208 @@
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+
+from collections import Counter
+from itertools import islice
+from typing import BinaryIO, Iterable, Iterator, List, NamedTuple, Optional, TextIO, Tuple
+
+from .classify import Classifier
+from .index import RangeIndex
+
+# Plain files larger than this are split into byte ranges of (at least) this size.
+SHARD_SIZE = 1 << 26
+
+# Compressed inputs, by extension. They can't be split, so each is one shard.
+COMPRESSED = {'.gz': 'gzip', '.bz2': 'bz2', '.xz': 'lzma'}
+
+# The Classifier used by this process's shards: set before the pool forks, or loaded by `_attach`.
+_CLASSIFIER: Optional[Classifier] = None
+
+
+class Shard(NamedTuple):
+    """
+    A piece of the input: a whole file, or the lines *starting* in bytes [start, end) of a plain file.
+    """
+    path: str
+    start: int = 0
+    end: Optional[int] = None
+
+
+class _Row(NamedTuple):
+    """A snapshot row, with the attributes RangeIndex and Classifier read."""
+    ip_prefix: Optional[str] = None
+    ipv6_prefix: Optional[str] = None
+    region: Optional[str] = None
+    service: Optional[str] = None
+    network_border_group: Optional[str] = None
+
+
+def open_input(path: str) -> BinaryIO:
+    """Open an input file for reading as bytes, decompressing it according to its extension. "-" is stdin."""
+    if path == '-':
+        return sys.stdin.buffer
+    module = COMPRESSED.get(os.path.splitext(path)[1])
+    if module is not None:
+        return __import__(module).open(path, 'rb')
+    return open(path, 'rb')
+
+
+def shards(paths: Iterable[str], jobs: int, shard_size: int = SHARD_SIZE) -> List[Shard]:
+    """
+    Split the inputs into shards for `jobs` workers.
+
+    Stdin and compressed files are one shard each. With more than one job, plain files larger than `shard_size`
+    are split into byte ranges, about four per job so that a slow shard doesn't leave the other workers idle.
+    """
+    result = []
+    for path in paths:
+        if jobs <= 1 or path == '-' or os.path.splitext(path)[1] in COMPRESSED:
+            result.append(Shard(path))
+            continue
+        size = os.path.getsize(path)
+        step = max(shard_size, -(-size // (jobs * 4)))
+        if size <= step:
+            result.append(Shard(path))
+        else:
+            result.extend(Shard(path, start, min(start + step, size)) for start in range(0, size, step))
+    return result
+
+
+def read_lines(shard: Shard) -> Iterator[bytes]:
+    """
+    Yield the lines of a shard. A line belongs to the shard its first byte is in, so the shards of a file
+    between them yield every line exactly once.
+    """
+    f = open_input(shard.path)
+    try:
+        if shard.start == 0 and shard.end is None:
+            yield from f
+            return
+        position = shard.start
+        if position:
+            # Skip the rest of a line that started in the previous shard.
+            f.seek(position - 1)
+            position += len(f.readline()) - 1
+        while shard.end is None or position < shard.end:
+            line = f.readline()
+            if not line:
+                break
+            position += len(line)
+            yield line
+    finally:
+        if f is not sys.stdin.buffer:
+            f.close()
+
+
+def classify_shard(classifier: Classifier, shard: Shard, outfile: Optional[TextIO], batch_size: int = 65536) -> Counter:
+    """
+    Classify every non-blank line of a shard, writing the results to `outfile` (if any) like Classifier.stream.
+
+    Returns:
+        counts (Counter): The number of addresses matching each label (see Classifier.labels).
+    """
+    counts = Counter()
+    lines = (line.strip() for line in read_lines(shard))
+    addresses = (line.decode('latin-1') for line in lines if line)
+    while True:
+        batch = list(islice(addresses, batch_size))
+        if not batch:
+            return counts
+        labels = classifier.labels(batch)
+        counts.update(labels)
+        if outfile is not None:
+            outfile.write("\n".join(f"{address}\t{label}" for address, label in zip(batch, labels)) + "\n")
+
+
+def _attach(snapshot: str):
+    """Pool initializer for platforms that can't fork: build the classifier from the shared, memory-mapped snapshot."""
+    global _CLASSIFIER
+    from .snapshot import Snapshot
+
+    snap = Snapshot(snapshot)
+    try:
+        rows = [_Row(**row) for version in (4, 6) for row in snap.rows(version)]
+    finally:
+        snap.close()
+    _CLASSIFIER = Classifier(RangeIndex(rows))
+
+
+def _run(task: Tuple[Shard, Optional[str], int]) -> Counter:
+    """Classify one shard in a worker, writing its results to a part file."""
+    shard, part, batch_size = task
+    if part is None:
+        return classify_shard(_CLASSIFIER, shard, None, batch_size)
+    with open(part, 'w', buffering=1 << 20) as out:
+        return classify_shard(_CLASSIFIER, shard, out, batch_size)
+
+
+def classify_files(classifier: Classifier,
+                   paths: Iterable[str],
+                   outfile: Optional[TextIO],
+                   jobs: int = 1,
+                   batch_size: int = 65536,
+                   snapshot: Optional[str] = None,
+                   shard_size: int = SHARD_SIZE) -> Counter:
+    """
+    Classify the addresses in several files (each optionally gzip/bzip2/xz compressed), sharded across a pool of
+    `jobs` worker processes.
+
+    Workers share the parent's classifier: on platforms that fork they inherit its tables copy-on-write, and
+    elsewhere each builds it from `snapshot`, a memory-mapped file written with `write_snapshot` (required there).
+    Nothing is downloaded or parsed again either way.
+
+    Each worker writes its shard's results to a temporary part file, and the parts are copied to `outfile` in
+    input order as they finish, so the output is the same as classifying the files one after another.
+    With `outfile` None, only the counts are produced, which skips formatting a line per address.
+
+    Returns:
+        counts (Counter): The number of addresses matching each label (see Classifier.labels), merged over all shards.
+    """
+    global _CLASSIFIER
+    pieces = shards(paths, jobs, shard_size)
+    counts = Counter()
+    if jobs <= 1 or len(pieces) == 1:
+        for shard in pieces:
+            counts.update(classify_shard(classifier, shard, outfile, batch_size))
+        return counts
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    if 'fork' in multiprocessing.get_all_start_methods():
+        _CLASSIFIER = classifier
+        pool = ProcessPoolExecutor(jobs, mp_context=multiprocessing.get_context('fork'))
+    elif snapshot is not None:
+        pool = ProcessPoolExecutor(jobs, initializer=_attach, initargs=(snapshot,))
+    else:
+        raise ValueError("Classifying in parallel on this platform needs a snapshot of the data")
+
+    workdir = tempfile.mkdtemp(prefix='classify-') if outfile is not None else None
+    try:
+        with pool:
+            parts = [os.path.join(workdir, f"{i:06d}") if workdir else None for i in range(len(pieces))]
+            results = pool.map(_run, [(shard, part, batch_size) for shard, part in zip(pieces, parts)])
+            for part, shard_counts in zip(parts, results):
+                counts.update(shard_counts)
+                if part is not None:
+                    outfile.flush()
+                    with open(part) as f:
+                        shutil.copyfileobj(f, outfile, 1 << 20)
+                    os.unlink(part)
+    finally:
+        _CLASSIFIER = None
+        if workdir is not None:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return counts
+
+
+def summarize(counts: Counter) -> List[Tuple[str, str, str, int]]:
+    """
+    Merge per-label counts into `(services, regions, border groups, addresses)` rows, most addresses first.
+    Unmatched addresses are counted under "-" in every column.
+    """
+    totals = Counter()
+    for label, count in counts.items():
+        totals[label.split("\t", 1)[1]] += count
+    return [tuple(key.split("\t")) + (count,) for key, count in totals.most_common()]
@@ -0,0 +1,218 @@
+import asyncio
+import sys
+import time
+
+from typing import Callable, Optional
+from urllib.parse import parse_qs, urlsplit
+
+from .data import ActiveRangeData, RangeData
+from .timings import Timings
+
+# Content types for formatter codes that have one; everything else is served as plain text.
+CONTENT_TYPES = {
+    'json': 'application/json',
+    'yaml': 'application/yaml',
+    'mmdb': 'application/octet-stream',
+}
+
+# Content types sent without a charset.
+BINARY_TYPES = {'application/octet-stream'}
+
+# /list/<kind> kinds and the RangeData category tables they list.
+LIST_FIELDS = {
+    'regions': 'regions',
+    'services': 'services',
+    'border-groups': 'network_border_groups',
+}
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 503: 'Service Unavailable'}
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class RangeServer:
+    """
+    A small asyncio HTTP server answering lookups and queries from an in-memory RangeData.
+
+    Endpoints (all GET; `format` selects any --format code and defaults to json):
+        /lookup?ip=<ip>[&ip=<ip>...][&longest=1]          The rows containing each address.
+        /query?service=&region=&border_group=&within=&overlaps=
+                                                           Rows matching every given field; each may repeat.
+        /list/(regions|services|border-groups)             The distinct values of a field.
+        /status                                            The loaded syncToken and when it was loaded.
+
+    The data is reloaded every `refresh` seconds on a worker thread, with its indexes built before it's
+    swapped in (see ActiveRangeData). Requests read whichever RangeData was current when they started, so they
+    never wait on a reload. Responses are built and rendered on worker threads too, so a large query (e.g.
+    format=mmdb) doesn't hold up the event loop, and other requests, while it's formatted.
+    """
+    def __init__(self, loader: Callable[[], Optional[object]], encode: Callable, refresh: float = 3600,
+                 timings: Optional[Timings] = None):
+        """
+        Args:
+            loader: Returns a fresh RangeData, or None when loading failed (the current data is kept).
+            encode: `encode(data, format_code)` returns the Formatter for a response.
+            refresh (float): Seconds between reloads; 0 disables them.
+            timings (Timings): Records an "index" stage for each reload and a "request" stage for each request,
+                e.g. for its hooks to export as metrics.
+        """
+        self.loader = loader
+        self.encode = encode
+        self.refresh = refresh
+        self.timings = timings or Timings(keep=False)
+        self.active = ActiveRangeData()
+        self.loaded_at = None
+
+    def load(self) -> Optional[RangeData]:
+        """
+        Load and index a new RangeData, and make it the current one unless it's older than that.
+        Blocking; runs on a worker thread after startup.
+        """
+        data = self.loader()
+        if data is None:
+            return None
+
+        # Build the lazily-created indexes now, rather than on the first request.
+        with self.timings.stage('index', rows=data.row_count()):
+            data.prepare()
+
+        if self.active.replace(data):
+            self.loaded_at = time.time()
+        else:
+            print(f"Warning: not reloading the IP ranges: syncToken {data.syncToken} is older than the current one",
+                  file=sys.stderr)
+        return data
+
+    async def _refresh_forever(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.refresh)
+            try:
+                await loop.run_in_executor(None, self.load)
+            except Exception as e:
+                print(f"Warning: reloading the IP ranges failed: {e}", file=sys.stderr)
+
+    def respond(self, method: str, target: str) -> tuple:
+        """
+        Returns `(status, content type, body)` for a request, with the body encoded as bytes.
+        Blocking, since formatting a large result takes a while; `_handle` runs it on a worker thread.
+        """
+        if method != 'GET':
+            raise HTTPError(405, f"Unsupported method {method}")
+        try:
+            data = self.active.data
+        except LookupError:
+            raise HTTPError(503, "No data loaded yet")
+        loaded_at = self.loaded_at
+
+        url = urlsplit(target)
+        params = parse_qs(url.query)
+        fmt = params.get('format', ['json'])[-1]
+        path = url.path.rstrip('/')
+
+        if path == '/lookup':
+            if 'ip' not in params:
+                raise HTTPError(400, "Missing 'ip' parameter")
+            longest = params.get('longest', ['0'])[-1] not in ('0', 'false', '')
+            result = []
+            for ip in params['ip']:
+                try:
+                    result.extend(data.lookup(ip, longest=longest))
+                except ValueError as e:
+                    raise HTTPError(400, str(e))
+        elif path == '/query':
+            try:
+                r = data.query(
+                    service=params.get('service', '*'),
+                    region=params.get('region', '*'),
+                    network_border_group=params.get('border_group', '*'),
+                    within=params.get('within'),
+                    overlaps=params.get('overlaps'))
+            except ValueError as e:
+                raise HTTPError(400, str(e))
+            result = r.ipv4 + r.ipv6
+        elif path.startswith('/list/') and path[len('/list/'):] in LIST_FIELDS:
+            result = sorted(getattr(data, LIST_FIELDS[path[len('/list/'):]]))
+        elif path == '/status':
+            result = {
+                'syncToken': data.syncToken,
+                'createDate': data.createDate,
+                'loaded_at': loaded_at,
+            }
+        else:
+            raise HTTPError(404, f"Unknown path {url.path}")
+
+        try:
+            body = self.encode(result, fmt).encoded()
+        except ValueError as e:
+            raise HTTPError(400, str(e))
+        return 200, CONTENT_TYPES.get(fmt, 'text/plain'), body
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                try:
+                    method, target, version = request_line.decode('latin-1').split()
+                except ValueError:
+                    method, target, version = None, None, 'HTTP/1.0'
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+
+                with self.timings.stage('request', path=urlsplit(target or '').path) as stage:
+                    try:
+                        if method is None:
+                            raise HTTPError(400, "Malformed request line")
+                        status, content_type, payload = await loop.run_in_executor(None, self.respond, method, target)
+                    except HTTPError as e:
+                        status, content_type, payload = e.status, 'text/plain', f"{e}\n".encode()
+                    stage.counters.update(status=status, bytes=len(payload))
+
+                head = (
+                    f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+                    f"Content-Type: {content_type}{'' if content_type in BINARY_TYPES else '; charset=utf-8'}\r\n"
+                    f"Content-Length: {len(payload)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+                    "\r\n"
+                )
+                writer.write(head.encode() + payload)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host: str = '127.0.0.1', port: int = 8080) -> asyncio.AbstractServer:
+        """
+        Load the initial data, start listening and schedule the background refresh.
+        """
+        loop = asyncio.get_running_loop()
+        if await loop.run_in_executor(None, self.load) is None:
+            raise RuntimeError("Couldn't load the IP ranges")
+        if self.refresh > 0:
+            self._refresher = asyncio.create_task(self._refresh_forever())
+        return await asyncio.start_server(self._handle, host, port)
+
+    def serve_forever(self, host: str = '127.0.0.1', port: int = 8080):
+        async def _main():
+            server = await self.start(host, port)
+            print(f"Serving on {', '.join(str(s.getsockname()) for s in server.sockets)}", file=sys.stderr)
+            async with server:
+                await server.serve_forever()
+        asyncio.run(_main())
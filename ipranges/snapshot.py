@@ -0,0 +1,233 @@
+import ipaddress
+import mmap
+import os
+import struct
+import sys
+import tempfile
+
+from typing import Iterator, List, Optional
+
+from .categories import Criteria, normalize, wanted
+
+MAGIC = b'AWSIPRNG'
+VERSION = 1
+
+# magic, format version, reserved, IPv4 rows, IPv6 rows, strings, services, regions, border groups
+HEADER = struct.Struct('<8sHHIIIIII')
+
+# Category id stored for rows where the value is missing.
+NONE_ID = 0xFFFF
+
+
+def _pad(n: int) -> int:
+    return (n + 7) & ~7
+
+
+class Snapshot:
+    """
+    A compact, memory-mapped copy of the ip-ranges.json data.
+
+    The file is little-endian and column-oriented, with every section 8-byte aligned:
+
+        header
+        string offsets      uint32 x (strings + 1)
+        string data         utf-8; string 0 is the syncToken, string 1 the createDate
+        service ids         uint16 x services       (ids into the string table)
+        region ids          uint16 x regions
+        border group ids    uint16 x border groups
+        for IPv4 then IPv6:
+            networks        uint32 x rows (IPv4), or uint64 x 2 x rows as (high, low) halves (IPv6)
+            prefix lengths  uint8 x rows
+            service ids     uint16 x rows
+            region ids      uint16 x rows
+            border groups   uint16 x rows
+
+    Every column is exposed as a memoryview over the mapping, so opening a snapshot only decodes the
+    (small) string table, and concurrent processes mapping the same file share its pages.
+    Since memoryviews use native byte order, snapshots can only be mapped on little-endian hosts.
+    """
+    def __init__(self, path: str):
+        if sys.byteorder != 'little':
+            raise ValueError("Snapshots can only be loaded on little-endian hosts")
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        buf = memoryview(self._mmap)
+
+        magic, version, _, n4, n6, n_strings, n_services, n_regions, n_groups = HEADER.unpack_from(buf)
+        if magic != MAGIC:
+            raise ValueError(f"{path} isn't an IP ranges snapshot")
+        if version != VERSION:
+            raise ValueError(f"{path} is snapshot version {version}; expected {VERSION}")
+
+        offset = _pad(HEADER.size)
+
+        def _column(fmt: str, count: int) -> memoryview:
+            nonlocal offset
+            size = struct.calcsize(fmt) * count
+            view = buf[offset:offset + size].cast(fmt)
+            offset = _pad(offset + size)
+            return view
+
+        offsets = _column('I', n_strings + 1)
+        data = bytes(_column('B', offsets[-1]))
+        self.strings = [data[offsets[i]:offsets[i + 1]].decode() for i in range(n_strings)]
+        self.sync_token = self.strings[0]
+        self.create_date = self.strings[1]
+
+        self.services = [self.strings[i] for i in _column('H', n_services)]
+        self.regions = [self.strings[i] for i in _column('H', n_regions)]
+        self.border_groups = [self.strings[i] for i in _column('H', n_groups)]
+
+        self._columns = {}
+        for version, count, network_fmt, width in ((4, n4, 'I', 1), (6, n6, 'Q', 2)):
+            self._columns[version] = (
+                _column(network_fmt, count * width),
+                _column('B', count),
+                _column('H', count),
+                _column('H', count),
+                _column('H', count),
+            )
+
+    def __len__(self):
+        return sum(len(columns[1]) for columns in self._columns.values())
+
+    def _string(self, i: int) -> Optional[str]:
+        return None if i == NONE_ID else self.strings[i]
+
+    def _ids(self, field: str, criteria: Criteria) -> Optional[set]:
+        values = wanted(field, criteria)
+        if values is None:
+            return None
+        return {i for i, s in enumerate(self.strings) if normalize(field, s) in values}
+
+    def select(self, version: int, service: Criteria = '*', region: Criteria = '*', network_border_group: Criteria = '*') -> List[int]:
+        """
+        Return the row numbers matching the given criteria, comparing category ids rather than strings.
+
+        Arguments are interpreted as in CategoryIndex.select.
+        """
+        _, _, services, regions, groups = self._columns[version]
+        filters = []
+        for column, field, criteria in ((services, 'service', service), (regions, 'region', region), (groups, 'network_border_group', network_border_group)):
+            ids = self._ids(field, criteria)
+            if ids is not None:
+                filters.append((column, ids))
+
+        rows = range(len(services))
+        for column, ids in filters:
+            rows = [i for i in rows if column[i] in ids]
+        return list(rows)
+
+    def row(self, version: int, i: int) -> dict:
+        """Return row `i` as keyword arguments for IPRange."""
+        networks, lengths, services, regions, groups = self._columns[version]
+        if version == 4:
+            network = ipaddress.IPv4Network((networks[i], lengths[i]))
+        else:
+            network = ipaddress.IPv6Network(((networks[2 * i] << 64) | networks[2 * i + 1], lengths[i]))
+        return {
+            'ip_prefix' if version == 4 else 'ipv6_prefix': str(network),
+            'region': self._string(regions[i]),
+            'service': self._string(services[i]),
+            'network_border_group': self._string(groups[i]),
+        }
+
+    def rows(self, version: int) -> Iterator[dict]:
+        """Yield every row for one IP version, as keyword arguments for IPRange."""
+        for i in range(len(self._columns[version][1])):
+            yield self.row(version, i)
+
+    def close(self):
+        self._columns = {}
+        self._mmap.close()
+
+
+def read_sync_token(path: str) -> Optional[str]:
+    """Return the syncToken of the snapshot at `path`, or None when there isn't a usable one."""
+    try:
+        snapshot = Snapshot(path)
+    except (OSError, ValueError):
+        return None
+    try:
+        return snapshot.sync_token
+    finally:
+        snapshot.close()
+
+
+def write_snapshot(path: str, data) -> bool:
+    """
+    Write `data` (a RangeData) to `path`, unless a snapshot with the same syncToken is already there.
+
+    The file is written to a temporary name and renamed into place, so processes that already have
+    the old snapshot mapped keep reading a consistent copy.
+
+    Returns:
+        written (bool): False when the existing snapshot was already up to date.
+    """
+    if read_sync_token(path) == data.syncToken:
+        return False
+
+    # The syncToken and createDate always occupy the first two slots of the string table.
+    strings = [data.syncToken, data.createDate]
+    ids = {}
+
+    def _intern(value: Optional[str]) -> int:
+        if value is None:
+            return NONE_ID
+        if value not in ids:
+            ids[value] = len(strings)
+            strings.append(value)
+            if len(strings) >= NONE_ID:
+                raise ValueError("Too many distinct strings for a snapshot")
+        return ids[value]
+
+    def _columns(items, version: int) -> list:
+        networks, lengths, services, regions, groups = [], [], [], [], []
+        for item in items:
+            network = ipaddress.ip_network(item.ip_prefix if version == 4 else item.ipv6_prefix, strict=False)
+            value = int(network.network_address)
+            if version == 4:
+                networks.append(value)
+            else:
+                networks.extend((value >> 64, value & 0xFFFFFFFFFFFFFFFF))
+            lengths.append(network.prefixlen)
+            services.append(_intern(item.service))
+            regions.append(_intern(item.region))
+            groups.append(_intern(item.network_border_group))
+        return [('I' if version == 4 else 'Q', networks), ('B', lengths), ('H', services), ('H', regions), ('H', groups)]
+
+    rows4 = _columns(data.prefixes, 4)
+    rows6 = _columns(data.ipv6_prefixes, 6)
+    items = data.prefixes + data.ipv6_prefixes
+    categories = [
+        sorted({_intern(getattr(i, field)) for i in items} - {NONE_ID})
+        for field in ('service', 'region', 'network_border_group')
+    ]
+
+    encoded = [s.encode() for s in strings]
+    offsets = [0]
+    for s in encoded:
+        offsets.append(offsets[-1] + len(s))
+
+    sections = [('I', offsets), ('B', list(b''.join(encoded)))]
+    sections += [('H', ids) for ids in categories]
+    sections += rows4 + rows6
+
+    header = HEADER.pack(MAGIC, VERSION, 0, len(data.prefixes), len(data.ipv6_prefixes), len(strings),
+                         *[len(ids) for ids in categories])
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(header.ljust(_pad(len(header)), b'\0'))
+            for fmt, values in sections:
+                chunk = struct.pack(f'<{len(values)}{fmt}', *values)
+                f.write(chunk.ljust(_pad(len(chunk)), b'\0'))
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return True
@@ -0,0 +1,105 @@
+import socket
+
+from dataclasses import dataclass
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+from .aggregate import ATTRIBUTION
+
+# Value of the grouping fields in the per-version total rows.
+ALL = '*'
+
+
+@dataclass
+class PrefixStats:
+    """
+    Address-space totals for one group of rows (e.g. one service, region and border group) and IP version.
+
+    `addresses` sums the size of every prefix, so an address published by several rows (e.g. AMAZON and EC2)
+    is counted once per row. `unique_addresses` counts the union of the prefixes, each address once.
+    """
+    service: str
+    region: str
+    network_border_group: str
+    version: int
+    prefixes: int
+    addresses: int
+    unique_addresses: int
+
+
+def interval(prefix: str) -> Tuple[int, int, int]:
+    """
+    Return `(version, first address, last address)` of a CIDR prefix, as integers.
+
+    Uses `socket.inet_pton` rather than `ipaddress`, which is several times faster for a whole document.
+
+    Raises:
+        ValueError: when `prefix` isn't a CIDR block.
+    """
+    address, _, length = prefix.partition('/')
+    family, bits, version = (socket.AF_INET6, 128, 6) if ':' in address else (socket.AF_INET, 32, 4)
+    try:
+        value = int.from_bytes(socket.inet_pton(family, address), 'big')
+    except OSError:
+        raise ValueError(f"{prefix!r} isn't a valid prefix") from None
+    size = bits - int(length) if length else 0
+    if not 0 <= size <= bits:
+        raise ValueError(f"{prefix!r} isn't a valid prefix")
+    start = value >> size << size
+    return version, start, start + (1 << size) - 1
+
+
+def union_size(intervals: List[Tuple[int, int]]) -> int:
+    """The number of integers covered by a list of inclusive `(start, end)` intervals, counting overlaps once."""
+    total = 0
+    last = -1
+    for start, end in sorted(intervals):
+        if end > last:
+            total += end - max(start, last + 1) + 1
+            last = end
+    return total
+
+
+def prefix_stats(items: Iterable, group_by: Optional[Sequence[str]] = None, totals: bool = True) -> List[PrefixStats]:
+    """
+    Count the prefixes and addresses of each group of rows, per IP version, in one pass over `items`.
+
+        prefix_stats(rows)                        # Per service, region and border group.
+        prefix_stats(rows, group_by=['service'])  # Per service; region and border group are "*".
+
+    Args:
+        items (Iterable[IPRange]): The rows to count.
+        group_by (Sequence[str]): Group by these of service, region and network_border_group (default: all three).
+        totals (bool): Also return a row per IP version for all of `items`, with "*" in every grouping field.
+
+    Raises:
+        ValueError: when `group_by` names another field.
+
+    Returns:
+        result (List[PrefixStats]): IPv4 before IPv6, then by group; each version's total comes first.
+    """
+    group_by = tuple(group_by or ATTRIBUTION)
+    unknown = set(group_by) - set(ATTRIBUTION)
+    if unknown:
+        raise ValueError(f"Can't group by {', '.join(sorted(unknown))}; expected some of {', '.join(ATTRIBUTION)}")
+
+    groups = {}
+    for item in items:
+        version, start, end = interval(item.ip_prefix or item.ipv6_prefix)
+        key = tuple((getattr(item, field) or '-') if field in group_by else ALL for field in ATTRIBUTION)
+        groups.setdefault((version,) + key, []).append((start, end))
+        if totals:
+            groups.setdefault((version,) + (ALL,) * len(ATTRIBUTION), []).append((start, end))
+
+    result = []
+    for key in sorted(groups, key=lambda k: (k[0], k[1:] != (ALL,) * len(ATTRIBUTION), k[1:])):
+        intervals = groups[key]
+        version, service, region, border_group = key
+        result.append(PrefixStats(
+            service=service,
+            region=region,
+            network_border_group=border_group,
+            version=version,
+            prefixes=len(intervals),
+            addresses=sum(end - start + 1 for start, end in intervals),
+            unique_addresses=union_size(intervals)))
+    return result
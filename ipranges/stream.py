@@ -0,0 +1,140 @@
+import codecs
+import json
+import re
+
+from typing import Iterable, Iterator, Tuple, Union
+
+# Top-level arrays of ip-ranges.json that are yielded one element at a time.
+ARRAYS = ('prefixes', 'ipv6_prefixes')
+
+# How much to read at a time from files and streamed downloads.
+CHUNK_SIZE = 1 << 16
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+# The separator after an array element, and the start of whatever follows it.
+_SEPARATOR = re.compile(r'[ \t\n\r]*([,\]])[ \t\n\r]*')
+
+# Characters that can follow a complete value.
+_TERMINATORS = frozenset(' \t\n\r,:]}')
+
+
+class _Buffer:
+    """
+    The unparsed tail of a JSON document being read from an iterable of chunks.
+    """
+    def __init__(self, chunks: Iterable[Union[bytes, str]]):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self.text = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self) -> bool:
+        """Append the next chunk, dropping the text already parsed. Returns False at the end of the input."""
+        if self.eof:
+            return False
+        self.text = self.text[self.pos:]
+        self.pos = 0
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            self.text += self._decoder.decode(b'', final=True)
+            self.eof = True
+        else:
+            self.text += self._decoder.decode(chunk) if isinstance(chunk, bytes) else chunk
+        return True
+
+    def peek(self) -> str:
+        """Skip whitespace and return the next character, or '' at the end of the input."""
+        while True:
+            self.pos = _WHITESPACE.match(self.text, self.pos).end()
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.fill():
+                return ''
+
+    def expect(self, chars: str) -> str:
+        """Consume and return the next character, which must be one of `chars`."""
+        c = self.peek()
+        if not c or c not in chars:
+            raise json.JSONDecodeError(f"Expecting one of {chars!r}", self.text, self.pos)
+        self.pos += 1
+        return c
+
+    def value(self, decoder: json.JSONDecoder):
+        """Decode the next complete JSON value, reading more of the input until it's all there."""
+        if self.pos >= len(self.text) or self.text[self.pos] in _TERMINATORS:
+            self.peek()
+        while True:
+            try:
+                value, end = decoder.raw_decode(self.text, self.pos)
+                # A number cut off by the end of the buffer (e.g. "1." of "1.5e3") may continue in the next chunk,
+                # so a value only counts as complete once it's followed by something that can end it.
+                if self.eof or (end < len(self.text) and self.text[end] in _TERMINATORS):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.fill()
+
+    def elements(self, decoder: json.JSONDecoder) -> Iterator[object]:
+        """Yield the elements of the array whose '[' was just consumed, and consume its ']'."""
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.value(decoder)
+            # Fast path: the separator and the start of the next element are already buffered.
+            m = _SEPARATOR.match(self.text, self.pos)
+            if m is not None and m.end() < len(self.text):
+                self.pos = m.end()
+                if m.group(1) == ']':
+                    return
+            elif self.expect(',]') == ']':
+                return
+
+
+def iter_document(chunks: Iterable[Union[bytes, str]], arrays: Tuple[str, ...] = ARRAYS) -> Iterator[Tuple[str, object]]:
+    """
+    Incrementally parse a JSON object (e.g. ip-ranges.json) from an iterable of UTF-8 chunks.
+
+    Yields `(key, value)` for each top-level member, except that members named in `arrays` yield
+    `(key, element)` for each of their elements instead. Only one element (plus the chunk being
+    parsed) is held in memory at a time, however large the arrays are:
+
+        with open('ip-ranges.json', 'rb') as f:
+            for key, value in iter_document(read_chunks(f)):
+                ...
+
+    Raises:
+        json.JSONDecodeError: when the input isn't a JSON object.
+    """
+    buf = _Buffer(chunks)
+    decoder = json.JSONDecoder()
+
+    buf.expect('{')
+    if buf.peek() == '}':
+        buf.pos += 1
+    else:
+        while True:
+            if buf.peek() != '"':
+                raise json.JSONDecodeError("Expecting property name enclosed in double quotes", buf.text, buf.pos)
+            key = buf.value(decoder)
+            buf.expect(':')
+            if key in arrays and buf.peek() == '[':
+                buf.pos += 1
+                for element in buf.elements(decoder):
+                    yield key, element
+            else:
+                yield key, buf.value(decoder)
+            if buf.expect(',}') == '}':
+                break
+
+    if buf.peek():
+        raise json.JSONDecodeError("Extra data", buf.text, buf.pos)
+
+
+def read_chunks(f, size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """Yield the rest of a binary file in chunks of `size` bytes."""
+    return iter(lambda: f.read(size), b'')
@@ -0,0 +1,152 @@
+import json
+import sys
+import time
+
+from contextlib import contextmanager
+from typing import Callable, Iterable, Iterator, List, Optional, TextIO
+
+try:
+    import resource
+except ImportError: # Not available on Windows
+    resource = None
+
+
+def peak_rss() -> Optional[int]:
+    """The process's peak resident set size so far, in bytes, or None where it can't be measured."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes.
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class Stage:
+    """
+    One timed stage of a run: its wall time, the process's peak RSS when it ended, and whatever
+    counters were recorded during it (rows, bytes, ...).
+    """
+    __slots__ = ('name', 'seconds', 'peak_rss', 'counters')
+
+    def __init__(self, name: str, seconds: float = 0.0, peak_rss: Optional[int] = None, **counters):
+        self.name = name
+        self.seconds = seconds
+        self.peak_rss = peak_rss
+        self.counters = counters
+
+    def count(self, counter: str, amount: float = 1):
+        self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def reading(self, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """
+        Pass `chunks` through, counting their bytes ("bytes") and the time spent waiting for them
+        ("read_seconds"), which separates the network or disk from the parsing that consumes them.
+        """
+        chunks = iter(chunks)
+        while True:
+            start = time.perf_counter()
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                return
+            finally:
+                self.count('read_seconds', time.perf_counter() - start)
+            self.count('bytes', len(chunk))
+            yield chunk
+
+    def rates(self) -> dict:
+        """Rows and bytes per second, for the counters this stage has."""
+        result = {}
+        if self.seconds > 0:
+            for counter in ('rows', 'bytes'):
+                if counter in self.counters:
+                    result[f"{counter}_per_second"] = self.counters[counter] / self.seconds
+        return result
+
+    def as_dict(self) -> dict:
+        return {'name': self.name, 'seconds': self.seconds, 'peak_rss': self.peak_rss, **self.counters, **self.rates()}
+
+
+class Timings:
+    """
+    Per-stage wall time, peak memory and counters for one run (or one long-running process).
+
+        timings = Timings()
+        timings.add_hook(lambda stage: statsd.timing(stage.name, stage.seconds))
+        with timings.stage('query') as stage:
+            rows = data.query(service='EC2')
+            stage.count('matched', len(rows))
+
+    Hooks are called with each Stage as it finishes, so long-running modes (e.g. `serve`) can export them
+    as metrics. With `keep=False`, finished stages are only passed to the hooks rather than also kept in `stages`.
+    """
+    def __init__(self, keep: bool = True):
+        self.keep = keep
+        self.stages: List[Stage] = []
+        self.hooks: List[Callable[[Stage], None]] = []
+
+    def add_hook(self, hook: Callable[[Stage], None]):
+        self.hooks.append(hook)
+
+    def record(self, stage: Stage) -> Stage:
+        """Add a finished stage, e.g. one timed in another process."""
+        if stage.peak_rss is None:
+            stage.peak_rss = peak_rss()
+        if self.keep:
+            self.stages.append(stage)
+        for hook in self.hooks:
+            hook(stage)
+        return stage
+
+    @contextmanager
+    def stage(self, name: str, **counters) -> Iterator[Stage]:
+        """Time the body of the `with` block as a stage named `name`, yielding the Stage to record counters on."""
+        stage = Stage(name, **counters)
+        start = time.perf_counter()
+        try:
+            yield stage
+        finally:
+            stage.seconds = time.perf_counter() - start
+            self.record(stage)
+
+    def as_dict(self) -> dict:
+        return {
+            'stages': [stage.as_dict() for stage in self.stages],
+            'seconds': sum(stage.seconds for stage in self.stages),
+            'peak_rss': peak_rss(),
+        }
+
+    def write_json(self, fp: TextIO):
+        json.dump(self.as_dict(), fp, indent=2)
+        fp.write("\n")
+
+    def report(self, fp: TextIO):
+        """Write a table of the stages, one per line."""
+        fp.write(f"{'stage':<20} {'seconds':>9} {'peak RSS':>10}  details\n")
+        for stage in self.stages:
+            details = " ".join(f"{k}={_number(v)}" for k, v in {**stage.counters, **stage.rates()}.items())
+            rss = f"{stage.peak_rss / (1 << 20):.1f}M" if stage.peak_rss is not None else '-'
+            fp.write(f"{stage.name:<20} {stage.seconds:>9.4f} {rss:>10}  {details}\n")
+
+
+def _number(value) -> str:
+    if isinstance(value, float):
+        return f"{value:,.4f}" if value < 10 else f"{value:,.0f}"
+    return f"{value:,}" if isinstance(value, int) else str(value)
+
+
+def load_hook(spec: str) -> Callable[[Stage], None]:
+    """
+    Import a hook given as "module:function", e.g. "mymetrics:export_stage".
+
+    Raises:
+        ValueError: when `spec` isn't in that form, or doesn't name a callable.
+    """
+    import importlib
+
+    module_name, sep, attribute = spec.partition(':')
+    if not sep or not module_name or not attribute:
+        raise ValueError(f"Expected a hook as module:function, got '{spec}'")
+    hook = getattr(importlib.import_module(module_name), attribute, None)
+    if not callable(hook):
+        raise ValueError(f"{spec} isn't a callable")
+    return hook
@@ -0,0 +1,30 @@
+"""
+Providers of IP range lists, each normalizing its own format into the rows used everywhere else.
+
+Provider modules are imported on first use, like formatters.
+"""
+import importlib
+
+from typing import List
+
+from .provider import Provider, Row
+
+# Provider codes and the modules defining them, in the order they're listed.
+PROVIDERS = {
+    'aws': 'aws_provider',
+    'gcp': 'gcp_provider',
+    'azure': 'azure_provider',
+    'cloudflare': 'cloudflare_provider',
+    'fastly': 'fastly_provider',
+}
+
+
+def Get(code: str) -> Provider:
+    if code in PROVIDERS:
+        importlib.import_module(f".{PROVIDERS[code]}", __name__)
+    provider = Provider.get_provider(code)
+    return provider()
+
+
+def List() -> List[str]:
+    return list(PROVIDERS)
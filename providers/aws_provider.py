@@ -0,0 +1,24 @@
+from ipranges.stream import iter_document
+
+from .provider import Provider, Row
+
+
+class AWSProvider(Provider):
+    """
+    Amazon Web Services' ip-ranges.json.
+    """
+    code = 'aws'
+    url = 'https://ip-ranges.amazonaws.com/ip-ranges.json'
+
+    def rows(self, chunks):
+        for key, value in iter_document(chunks):
+            if key == 'prefixes':
+                yield Row(value.get('ip_prefix'), None, value.get('region'), value.get('service'),
+                          value.get('network_border_group'))
+            elif key == 'ipv6_prefixes':
+                yield Row(None, value.get('ipv6_prefix'), value.get('region'), value.get('service'),
+                          value.get('network_border_group'))
+            elif key == 'syncToken':
+                self.sync_token = value
+            elif key == 'createDate':
+                self.create_date = value
@@ -0,0 +1,28 @@
+from ipranges.stream import iter_document
+
+from .provider import Provider, Row
+
+
+class AzureProvider(Provider):
+    """
+    Microsoft Azure's service tags (ServiceTags_Public_<date>.json).
+
+    Microsoft publishes the file under a new URL every week, so there's no default; give the current
+    one (or a downloaded copy) with `--provider-url azure=<url or file>`.
+
+    Every tag becomes one row per prefix, with the tag's system service as the service (falling back to
+    the tag name, e.g. "AzureCloud" for "AzureCloud.eastus") and its region, if it has one.
+    """
+    code = 'azure'
+    url = ''
+
+    def rows(self, chunks):
+        for key, value in iter_document(chunks, arrays=('values',)):
+            if key == 'values':
+                properties = value.get('properties', {})
+                service = properties.get('systemService') or value.get('name', '').split('.')[0] or None
+                region = properties.get('region') or None
+                for prefix in properties.get('addressPrefixes', []):
+                    yield Row.of(prefix, region=region, service=service)
+            elif key == 'changeNumber':
+                self.sync_token = str(value)
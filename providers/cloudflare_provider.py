@@ -0,0 +1,18 @@
+from ipranges.stream import iter_document
+
+from .provider import Provider, Row
+
+
+class CloudflareProvider(Provider):
+    """
+    Cloudflare's edge ranges, from the (unauthenticated) /ips API.
+    """
+    code = 'cloudflare'
+    url = 'https://api.cloudflare.com/client/v4/ips'
+
+    def rows(self, chunks):
+        for key, value in iter_document(chunks, arrays=()):
+            if key == 'result':
+                self.sync_token = value.get('etag')
+                for prefix in value.get('ipv4_cidrs', []) + value.get('ipv6_cidrs', []):
+                    yield Row.of(prefix, service='CLOUDFLARE')
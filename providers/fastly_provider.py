@@ -0,0 +1,16 @@
+from ipranges.stream import iter_document
+
+from .provider import Provider, Row
+
+
+class FastlyProvider(Provider):
+    """
+    Fastly's edge ranges, from its public IP list.
+    """
+    code = 'fastly'
+    url = 'https://api.fastly.com/public-ip-list'
+
+    def rows(self, chunks):
+        for key, value in iter_document(chunks, arrays=('addresses', 'ipv6_addresses')):
+            if key in ('addresses', 'ipv6_addresses'):
+                yield Row.of(value, service='FASTLY')
@@ -0,0 +1,24 @@
+from ipranges.stream import iter_document
+
+from .provider import Provider, Row
+
+
+class GCPProvider(Provider):
+    """
+    Google Cloud's cloud.json, the ranges available to customer resources.
+
+    Each prefix has a `service` ("Google Cloud") and a `scope`, which is used as the region.
+    """
+    code = 'gcp'
+    url = 'https://www.gstatic.com/ipranges/cloud.json'
+
+    def rows(self, chunks):
+        for key, value in iter_document(chunks):
+            if key == 'prefixes':
+                prefix = value.get('ipv4Prefix') or value.get('ipv6Prefix')
+                if prefix:
+                    yield Row.of(prefix, region=value.get('scope'), service=value.get('service'))
+            elif key == 'syncToken':
+                self.sync_token = value
+            elif key == 'creationTime':
+                self.create_date = value
@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+from abc import ABC, abstractmethod
+from typing import Iterable, Iterator, List, NamedTuple, Optional
+
+
+class Row(NamedTuple):
+    """
+    One prefix from a provider, normalized to the fields of IPRange.
+    """
+    ip_prefix: Optional[str]
+    ipv6_prefix: Optional[str]
+    region: Optional[str]
+    service: Optional[str]
+    network_border_group: Optional[str]
+
+    @classmethod
+    def of(cls, prefix: str, region: Optional[str] = None, service: Optional[str] = None,
+           network_border_group: Optional[str] = None) -> Row:
+        """Build a Row for an IPv4 or IPv6 prefix, putting it in the matching field."""
+        if ':' in prefix:
+            return cls(None, prefix, region, service, network_border_group)
+        return cls(prefix, None, region, service, network_border_group)
+
+
+class Provider(ABC):
+    # The --provider <code> value
+    code: str = ''
+
+    # Where the provider publishes its ranges; empty when there's no stable URL and one must be given.
+    url: str = ''
+
+    def __init__(self):
+        # Set by `rows` as the document is parsed.
+        self.sync_token = None
+        self.create_date = None
+
+    @abstractmethod
+    def rows(self, chunks: Iterable[bytes]) -> Iterator[Row]:
+        """
+        Parse the provider's document from an iterable of byte chunks, yielding a Row for each prefix.
+
+        This is the main function that subclasses must implement. It should parse incrementally
+        (see ipranges.stream.iter_document) and record the document's version and date in
+        `sync_token` and `create_date` as it comes across them.
+        """
+        pass
+
+    def check(self, chunks: Iterable[bytes]) -> Optional[str]:
+        """
+        Parse a whole document without keeping its rows, e.g. to validate a download before it's used.
+
+        Raises:
+            ValueError: when the document isn't valid (json.JSONDecodeError is a ValueError).
+
+        Returns:
+            sync_token (str): The document's version, or None when it doesn't have one.
+        """
+        for _ in self.rows(chunks):
+            pass
+        return self.sync_token
+
+    @classmethod
+    def get_provider(cls, code: str) -> Provider:
+        """
+        Returns the provider based on the code (flag value)
+
+        Raises:
+            ValueError when no provider code is matched.
+
+        Returns:
+            Provider
+        """
+        for sub in cls.registered():
+            if sub.code == code:
+                return sub
+        raise ValueError(f"Unsupported provider: {code}")
+
+    @classmethod
+    def registered(cls) -> List[type]:
+        """
+        Returns every subclass of this provider, including subclasses of subclasses.
+        """
+        result = []
+        for sub in cls.__subclasses__():
+            result.append(sub)
+            result.extend(sub.registered())
+        return result
@@ -0,0 +1,116 @@
+"""
+A local HTTP server replaying scripted responses, for testing downloads without the network.
+"""
+import gzip
+import http.server
+import socket
+import threading
+import time
+
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+
+@dataclass
+class Reply:
+    status: int = 200
+    body: bytes = b''
+    headers: Dict[str, str] = field(default_factory=dict)
+    # Send the body gzip-compressed.
+    gzip: bool = False
+    # Answer Range/If-Range requests (matching the ETag header) with 206 Partial Content.
+    ranges: bool = False
+    # Drop the connection after sending this many bytes of the body.
+    cut: Optional[int] = None
+    # Seconds to wait before answering at all.
+    delay: float = 0
+    # Send the body a byte at a time, this many seconds apart.
+    trickle: float = 0
+
+
+class StubServer:
+    """
+    Serves `Reply`s for each path, in order (the last one is repeated), and records the requests made.
+
+        with StubServer() as stub:
+            stub.add('/ip-ranges.json', Reply(503), Reply(body=b'...'))
+            http_get(stub.url('/ip-ranges.json'))
+    """
+    def __init__(self):
+        self.routes: Dict[str, List[Reply]] = {}
+        self.requests: List[tuple] = []
+        stub = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                stub.requests.append((self.path, dict(self.headers)))
+                replies = stub.routes.get(self.path) or [Reply(404)]
+                reply = replies.pop(0) if len(replies) > 1 else replies[0]
+                stub.respond(self, reply)
+
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+
+    def __enter__(self) -> 'StubServer':
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def add(self, path: str, *replies: Reply):
+        self.routes[path] = list(replies)
+
+    def url(self, path: str) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}{path}"
+
+    def paths(self) -> List[str]:
+        return [path for path, _ in self.requests]
+
+    @staticmethod
+    def respond(handler, reply: Reply):
+        body = gzip.compress(reply.body, mtime=0) if reply.gzip else reply.body
+        headers = dict(reply.headers)
+        if reply.gzip:
+            headers['Content-Encoding'] = 'gzip'
+        if reply.ranges:
+            headers['Accept-Ranges'] = 'bytes'
+
+        status, start = reply.status, 0
+        requested = handler.headers.get('Range')
+        if reply.ranges and requested and handler.headers.get('If-Range') == headers.get('ETag'):
+            start = int(requested.split('=')[1].rstrip('-'))
+            status = 206
+            headers['Content-Range'] = f"bytes {start}-{len(body) - 1}/{len(body)}"
+        body = body[start:] if status != 304 else b''
+
+        time.sleep(reply.delay)
+        handler.send_response(status)
+        for name, value in headers.items():
+            handler.send_header(name, value)
+        handler.send_header('Content-Length', str(len(body)))
+        handler.end_headers()
+        if reply.cut is not None:
+            handler.wfile.write(body[:reply.cut])
+            handler.wfile.flush()
+            handler.connection.shutdown(socket.SHUT_RDWR)
+            handler.close_connection = True
+            return
+        if reply.trickle:
+            try:
+                for i in range(len(body)):
+                    handler.wfile.write(body[i:i + 1])
+                    handler.wfile.flush()
+                    time.sleep(reply.trickle)
+            except (BrokenPipeError, ConnectionResetError):
+                handler.close_connection = True
+            return
+        handler.wfile.write(body)
@@ -0,0 +1,64 @@
+import ipaddress
+import os
+import subprocess
+import sys
+import unittest
+
+import formatters
+
+from ipranges import RangeData
+from ipranges.aggregate import aggregate
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'ip-ranges.json')
+GENERATE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'generate.py')
+
+
+class AggregateTest(unittest.TestCase):
+    def setUp(self):
+        data = RangeData.from_file(FIXTURE)
+        self.rows = data.prefixes + data.ipv6_prefixes
+
+    def test_cidr_output_is_the_minimal_cover(self):
+        lines = formatters.Get('cidr', aggregate(self.rows)).string().splitlines()
+        self.assertEqual(len(lines), len(set(lines)))
+
+        cover = []
+        for version, field in ((4, 'ip_prefix'), (6, 'ipv6_prefix')):
+            networks = [ipaddress.ip_network(getattr(r, field)) for r in self.rows if getattr(r, field)]
+            cover.extend(str(n) for n in ipaddress.collapse_addresses(networks))
+        self.assertEqual(lines, cover)
+
+    def test_merged_blocks_join_attributions(self):
+        rows = {r.ip_prefix or r.ipv6_prefix: r for r in aggregate(self.rows)}
+        self.assertEqual(rows['52.95.110.0/23'].service, 'AMAZON,EC2,S3')
+        self.assertEqual(rows['52.95.110.0/23'].region, 'us-east-1')
+        self.assertEqual(rows['64.252.64.0/18'].service, 'EC2')
+        # The joined services still map to every port they need.
+        ports = {port for ip, port, _ in formatters.Get('iptables', list(rows.values())).rules() if ip == '3.5.140.0/22'}
+        self.assertEqual(ports, {80, 443})
+
+    def test_group_by_keeps_one_attribution_per_row(self):
+        rows = aggregate(self.rows, group_by=['service', 'region'])
+        self.assertTrue(all(',' not in r.service for r in rows))
+        blocks = [(r.ip_prefix or r.ipv6_prefix, r.service) for r in rows]
+        self.assertEqual(len(blocks), len(set(blocks)))
+        self.assertIn(('52.95.110.0/23', 'AMAZON'), blocks)
+        self.assertIn(('52.95.110.0/24', 'EC2'), blocks)
+
+    def test_group_by_rejects_unknown_fields(self):
+        with self.assertRaises(ValueError) as raised:
+            aggregate(self.rows, group_by=['servce'])
+        self.assertIn("servce", str(raised.exception))
+        self.assertIn("service, region, network_border_group", str(raised.exception))
+
+    def test_cli_reports_unknown_fields(self):
+        process = subprocess.run(
+            [sys.executable, GENERATE, 'query', '--aggregate', '--aggregate-by', 'servce', '--url', FIXTURE],
+            capture_output=True, text=True)
+        self.assertEqual(process.returncode, 1)
+        self.assertEqual(process.stderr, "Error: Can't aggregate by servce; expected some of service, region, "
+                                         "network_border_group\n")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+import os
+import stat
+import tempfile
+import time
+import unittest
+
+from ipranges.cache import CacheError, DownloadCache
+from ipranges.fetch import DownloadError, Fetcher
+
+from .stub import Reply, StubServer
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'ip-ranges.json')
+
+with open(FIXTURE, 'rb') as f:
+    BODY = f.read()
+CHANGED = BODY.replace(b'"syncToken": "1700000000"', b'"syncToken": "1700000600"')
+
+HEADERS = {'ETag': '"v1"', 'Last-Modified': 'Tue, 14 Nov 2023 22:13:20 GMT'}
+
+
+class DownloadCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.stub = StubServer().__enter__()
+        self.addCleanup(self.stub.__exit__)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.url = self.stub.url('/ip-ranges.json')
+        self.fetcher = Fetcher(connect_timeout=2, read_timeout=2, retries=0)
+
+    def cache(self, ttl: float = 3600) -> DownloadCache:
+        return DownloadCache(self.directory, ttl=ttl, fetcher=self.fetcher)
+
+    def expire(self, cache: DownloadCache, age: float = 7200):
+        """Make the cached copy of self.url look `age` seconds old."""
+        path = cache.path(self.url, offline=True)
+        os.utime(path, (time.time() - age, time.time() - age))
+
+    def test_fresh_copy_is_served_without_a_request(self):
+        self.stub.add('/ip-ranges.json', Reply(body=BODY, headers=HEADERS))
+        cache = self.cache()
+        self.assertEqual(cache.fetch(self.url), BODY)
+        self.assertEqual(cache.fetch(self.url), BODY)
+        self.assertEqual(len(self.stub.requests), 1)
+
+    def test_expired_copy_is_revalidated(self):
+        self.stub.add('/ip-ranges.json', Reply(body=BODY, headers=HEADERS), Reply(304, headers=HEADERS))
+        cache = self.cache(ttl=60)
+        cache.fetch(self.url)
+        self.expire(cache, age=120)
+
+        self.assertEqual(cache.fetch(self.url), BODY)
+        headers = self.stub.requests[1][1]
+        self.assertEqual(headers['If-None-Match'], HEADERS['ETag'])
+        self.assertEqual(headers['If-Modified-Since'], HEADERS['Last-Modified'])
+        # The 304 restarts the TTL.
+        self.assertLess(cache.age(self.url), 60)
+        self.assertIsNone(cache.previous(self.url))
+
+    def test_changed_document_replaces_the_copy(self):
+        self.stub.add('/ip-ranges.json', Reply(body=BODY, headers=HEADERS), Reply(body=CHANGED, headers={'ETag': '"v2"'}))
+        cache = self.cache()
+        cache.fetch(self.url)
+        self.expire(cache)
+
+        self.assertEqual(cache.fetch(self.url), CHANGED)
+        self.assertEqual(cache.previous(self.url), BODY)
+
+    def test_stale_copy_is_used_when_revalidation_fails(self):
+        self.stub.add('/ip-ranges.json', Reply(body=BODY, headers=HEADERS), Reply(503))
+        cache = self.cache()
+        cache.fetch(self.url)
+        self.expire(cache)
+
+        self.assertEqual(cache.fetch(self.url), BODY)
+        self.assertEqual(len(self.stub.requests), 2)
+
+    def test_failure_without_a_cached_copy(self):
+        self.stub.add('/ip-ranges.json', Reply(503))
+        with self.assertRaises(DownloadError):
+            self.cache().fetch(self.url)
+
+    def test_offline(self):
+        cache = self.cache()
+        with self.assertRaises(CacheError):
+            cache.fetch(self.url, offline=True)
+
+        self.stub.add('/ip-ranges.json', Reply(body=BODY, headers=HEADERS))
+        cache.fetch(self.url)
+        self.expire(cache)
+        self.assertEqual(cache.fetch(self.url, offline=True), BODY)
+        self.assertEqual(len(self.stub.requests), 1)
+
+    def test_files_are_readable_by_other_users(self):
+        self.stub.add('/ip-ranges.json', Reply(body=BODY, headers=HEADERS), Reply(body=CHANGED))
+        umask = os.umask(0o022)
+        try:
+            cache = self.cache()
+            cache.fetch(self.url)
+            self.expire(cache)
+            cache.fetch(self.url)
+        finally:
+            os.umask(umask)
+
+        names = os.listdir(self.directory)
+        self.assertEqual(sorted(n.rsplit('.', 1)[1] for n in names), ['body', 'meta', 'prev'])
+        for name in names:
+            mode = stat.S_IMODE(os.stat(os.path.join(self.directory, name)).st_mode)
+            self.assertEqual(mode, 0o644, name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import os
+import tempfile
+import threading
+import unittest
+
+from ipranges import ActiveRangeData, RangeData, SnapshotRangeData
+from ipranges.snapshot import Snapshot, write_snapshot
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'ip-ranges.json')
+
+
+class SnapshotRangeDataTest(unittest.TestCase):
+    def setUp(self):
+        self.data = RangeData.from_file(FIXTURE)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'ip-ranges.snapshot')
+        write_snapshot(self.path, self.data)
+
+    def snapshot(self) -> SnapshotRangeData:
+        snapshot = Snapshot(self.path)
+        self.addCleanup(snapshot.close)
+        return SnapshotRangeData(snapshot)
+
+    def run_with_timeout(self, function, timeout=10):
+        """Run `function` in a thread, failing (rather than hanging) if it doesn't finish in time."""
+        result = {}
+        thread = threading.Thread(target=lambda: result.setdefault('value', function()), daemon=True)
+        thread.start()
+        thread.join(timeout)
+        self.assertFalse(thread.is_alive(), f"{function} didn't finish within {timeout}s")
+        return result['value']
+
+    def test_index_and_categories(self):
+        data = self.snapshot()
+        self.run_with_timeout(lambda: data.index)
+        self.run_with_timeout(lambda: data.categories)
+        self.assertEqual(len(data.prefixes) + len(data.ipv6_prefixes), self.data.row_count())
+
+    def test_lookup_and_query_match_json(self):
+        data = self.snapshot()
+        self.assertEqual(self.run_with_timeout(lambda: data.lookup('52.95.110.1')), self.data.lookup('52.95.110.1'))
+        self.assertEqual(self.run_with_timeout(lambda: data.query(within='52.95.0.0/16').all()),
+                         self.data.query(within='52.95.0.0/16').all())
+
+    def test_active_range_data(self):
+        active = self.run_with_timeout(lambda: ActiveRangeData(self.snapshot()))
+        self.assertEqual([r.service for r in active.lookup('2600:1f14::1', longest=True)], ['EC2', 'AMAZON'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+import os
+import socket
+import tempfile
+import time
+import unittest
+
+import generate
+
+from ipranges.cache import DownloadCache
+from ipranges.fetch import DownloadError, Fetcher
+
+from .stub import Reply, StubServer
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'ip-ranges.json')
+
+with open(FIXTURE, 'rb') as f:
+    BODY = f.read()
+OLDER = BODY.replace(b'"syncToken": "1700000000"', b'"syncToken": "1600000000"')
+
+
+def dead_url() -> str:
+    """A URL nothing is listening on."""
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    return f"http://127.0.0.1:{port}/ip-ranges.json"
+
+
+class FetcherTest(unittest.TestCase):
+    def setUp(self):
+        self.stub = StubServer().__enter__()
+        self.addCleanup(self.stub.__exit__)
+        self.fetcher = Fetcher(connect_timeout=2, read_timeout=2, retries=2, backoff=0.01)
+
+    def test_retries_after_503(self):
+        self.stub.add('/ip-ranges.json', Reply(503), Reply(body=BODY))
+        self.assertEqual(self.fetcher.get(self.stub.url('/ip-ranges.json')).content, BODY)
+        self.assertEqual(len(self.stub.requests), 2)
+
+    def test_honours_retry_after(self):
+        self.stub.add('/ip-ranges.json', Reply(429, headers={'Retry-After': '1'}), Reply(body=BODY))
+        started = time.monotonic()
+        self.assertEqual(self.fetcher.get(self.stub.url('/ip-ranges.json')).content, BODY)
+        self.assertGreaterEqual(time.monotonic() - started, 1)
+
+    def test_gives_up_after_the_retries(self):
+        self.stub.add('/ip-ranges.json', Reply(503))
+        with self.assertRaises(DownloadError):
+            self.fetcher.get(self.stub.url('/ip-ranges.json'))
+        self.assertEqual(len(self.stub.requests), 3)
+
+    def test_does_not_retry_404(self):
+        self.stub.add('/ip-ranges.json', Reply(404))
+        with self.assertRaises(DownloadError):
+            self.fetcher.get(self.stub.url('/ip-ranges.json'))
+        self.assertEqual(len(self.stub.requests), 1)
+
+    def test_resumes_a_truncated_body(self):
+        headers = {'ETag': '"v1"'}
+        self.stub.add('/ip-ranges.json', Reply(body=BODY, headers=headers, gzip=True, ranges=True, cut=200),
+                      Reply(body=BODY, headers=headers, gzip=True, ranges=True))
+        response = self.fetcher.get(self.stub.url('/ip-ranges.json'), stream=True)
+        self.assertEqual(b"".join(response.chunks()), BODY)
+        resumed = self.stub.requests[1][1]
+        self.assertEqual((resumed['Range'], resumed['If-Range']), ('bytes=200-', '"v1"'))
+
+    def test_restarts_without_range_support(self):
+        self.stub.add('/ip-ranges.json', Reply(body=BODY, headers={'ETag': '"v1"'}, gzip=True, cut=200),
+                      Reply(body=BODY, headers={'ETag': '"v1"'}, gzip=True))
+        response = self.fetcher.get(self.stub.url('/ip-ranges.json'), stream=True)
+        self.assertEqual(b"".join(response.chunks()), BODY)
+        self.assertNotIn('Range', self.stub.requests[1][1])
+
+    def test_stalled_response_times_out(self):
+        self.stub.add('/ip-ranges.json', Reply(body=BODY, delay=5))
+        fetcher = Fetcher(read_timeout=0.5, retries=0)
+        started = time.monotonic()
+        with self.assertRaises(DownloadError):
+            fetcher.get(self.stub.url('/ip-ranges.json'))
+        self.assertLess(time.monotonic() - started, 2)
+
+    def test_stalled_body_times_out(self):
+        self.stub.add('/ip-ranges.json', Reply(body=BODY, trickle=5))
+        fetcher = Fetcher(read_timeout=0.5, retries=0)
+        started = time.monotonic()
+        with self.assertRaises(DownloadError):
+            fetcher.get(self.stub.url('/ip-ranges.json'))
+        self.assertLess(time.monotonic() - started, 2)
+
+    def test_trickled_body_stops_at_the_deadline(self):
+        # A byte every 20ms resets any read timeout, but would take over a minute for the whole body.
+        self.stub.add('/ip-ranges.json', Reply(body=BODY, trickle=0.02))
+        fetcher = Fetcher(read_timeout=5, retries=0, deadline=1)
+        started = time.monotonic()
+        with self.assertRaises(DownloadError) as raised:
+            fetcher.get(self.stub.url('/ip-ranges.json'))
+        self.assertLess(time.monotonic() - started, 1.5)
+        self.assertIn('deadline', str(raised.exception))
+
+    def test_rejects_a_changed_document_when_resuming(self):
+        self.stub.add('/ip-ranges.json', Reply(body=BODY, headers={'ETag': '"v1"'}, ranges=True, cut=200),
+                      Reply(body=OLDER, headers={'ETag': '"v2"'}, ranges=True))
+        response = self.fetcher.get(self.stub.url('/ip-ranges.json'), stream=True)
+        with self.assertRaises(DownloadError):
+            b"".join(response.chunks())
+
+
+class DownloadTest(unittest.TestCase):
+    def setUp(self):
+        self.stub = StubServer().__enter__()
+        self.addCleanup(self.stub.__exit__)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.fetcher = Fetcher(connect_timeout=2, read_timeout=2, retries=0)
+
+    def test_rejects_an_older_sync_token(self):
+        url = self.stub.url('/ip-ranges.json')
+        self.stub.add('/ip-ranges.json', Reply(body=BODY), Reply(body=OLDER))
+        cache = DownloadCache(self.directory, ttl=0, fetcher=self.fetcher)
+        self.assertEqual(generate.download(url, cache=cache, fetcher=self.fetcher).syncToken, '1700000000')
+
+        # The older copy is rejected, and the newer cached copy used instead.
+        self.assertEqual(generate.download(url, cache=cache, fetcher=self.fetcher).syncToken, '1700000000')
+        self.assertEqual(len(self.stub.requests), 2)
+        self.assertEqual(cache.version(url), '1700000000')
+
+    def test_falls_back_to_a_mirror(self):
+        self.stub.add('/mirror.json', Reply(body=BODY))
+        data = generate.download(dead_url(), mirrors=[self.stub.url('/mirror.json')], fetcher=self.fetcher)
+        self.assertEqual(data.syncToken, '1700000000')
+
+    def test_truncated_document_falls_back_to_a_mirror(self):
+        self.stub.add('/ip-ranges.json', Reply(body=BODY[:len(BODY) // 2]))
+        self.stub.add('/mirror.json', Reply(body=BODY))
+        data = generate.download(self.stub.url('/ip-ranges.json'), mirrors=[self.stub.url('/mirror.json')],
+                                 fetcher=self.fetcher)
+        self.assertEqual(data.row_count(), 21)
+
+    def test_fails_without_a_usable_source(self):
+        with self.assertRaises(DownloadError):
+            generate.download(dead_url(), mirrors=[dead_url()], fetcher=self.fetcher)
+
+
+if __name__ == '__main__':
+    unittest.main()
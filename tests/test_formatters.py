@@ -0,0 +1,23 @@
+import os
+import unittest
+
+import formatters
+
+from ipranges import RangeData
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'ip-ranges.json')
+
+
+class SequenceInputTest(unittest.TestCase):
+    def test_formats_accept_range_data_rows(self):
+        """RangeData rows are tuples; every format renders them as it does a list of the same rows."""
+        data = RangeData.from_file(FIXTURE)
+        rows = data.prefixes + data.ipv6_prefixes
+        self.assertIsInstance(rows, tuple)
+        for code in formatters.List():
+            with self.subTest(format=code):
+                self.assertEqual(formatters.Get(code, rows).encoded(), formatters.Get(code, list(rows)).encoded())
+
+
+if __name__ == '__main__':
+    unittest.main()
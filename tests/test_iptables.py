@@ -0,0 +1,80 @@
+import os
+import unittest
+
+import formatters
+
+from ipranges import RangeData
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'ip-ranges.json')
+
+
+class IptablesDeltaTest(unittest.TestCase):
+    def setUp(self):
+        data = RangeData.from_file(FIXTURE)
+        self.old = list(data.prefixes + data.ipv6_prefixes)
+        # 18.34.248.0/22 and 2406:da70:8000::/40 were removed.
+        self.new = [r for r in self.old if r.ip_prefix != '18.34.248.0/22' and r.ipv6_prefix != '2406:da70:8000::/40']
+
+    def delta(self, template=None) -> list:
+        formatter = formatters.Get('iptables', self.new)
+        if template is not None:
+            formatter.rule_template = template
+        return "".join(formatter.delta_chunks(self.old)).splitlines()
+
+    def test_append_template(self):
+        lines = self.delta()
+        self.assertIn("iptables -D OUTPUT -d 18.34.248.0/22 -p tcp --dport 443 -j ACCEPT", lines)
+        self.assertFalse(any(line.startswith("iptables -A") for line in lines))
+
+    def test_insert_template(self):
+        lines = self.delta("iptables -I OUTPUT 3 -d {ip} -p tcp --dport {port} -j ACCEPT")
+        self.assertIn("iptables -D OUTPUT -d 18.34.248.0/22 -p tcp --dport 443 -j ACCEPT", lines)
+        self.assertFalse(any(line.startswith("iptables -I") for line in lines))
+
+    def test_template_without_chain_is_rejected(self):
+        with self.assertRaises(ValueError):
+            self.delta("iptables -d {ip} -p tcp --dport {port} -j ACCEPT")
+
+    def test_ipv6_changes_are_reported(self):
+        self.assertIn("# Skipped 1 changed IPv6 prefixes; the iptables format only covers IPv4", self.delta())
+
+
+class EmptySideDeltaTest(unittest.TestCase):
+    """A service appearing or going away leaves one side of a filtered diff empty."""
+    def setUp(self):
+        data = RangeData.from_file(FIXTURE)
+        self.s3 = [r for r in data.prefixes + data.ipv6_prefixes if r.service == 'S3']
+
+    def delta(self, code: str, old: list, new: list) -> list:
+        return "".join(formatters.Get(code, new).delta_chunks(old)).splitlines()
+
+    def test_iptables_service_added(self):
+        lines = self.delta('iptables', [], self.s3)
+        self.assertIn("iptables -A OUTPUT -d 3.5.140.0/22 -p tcp --dport 80 -j ACCEPT", lines)
+        self.assertFalse(any(" -D " in line for line in lines))
+        self.assertIn("# Skipped 1 changed IPv6 prefixes; the iptables format only covers IPv4", lines)
+
+    def test_iptables_service_removed(self):
+        lines = self.delta('iptables', self.s3, [])
+        self.assertIn("iptables -D OUTPUT -d 3.5.140.0/22 -p tcp --dport 80 -j ACCEPT", lines)
+        self.assertFalse(any(" -A " in line for line in lines))
+
+    def test_ipset_service_added(self):
+        lines = self.delta('ipset', [], self.s3)
+        self.assertIn("create aws-80-v4 hash:net family inet maxelem 65536 -exist", lines)
+        self.assertIn("add aws-443-v6 2a05:d07a:a000::/40 -exist", lines)
+        self.assertFalse(any(line.startswith("del ") for line in lines))
+
+    def test_ipset_service_removed(self):
+        lines = self.delta('ipset', self.s3, [])
+        self.assertIn("del aws-80-v4 3.5.140.0/22 -exist", lines)
+        self.assertFalse(any(line.startswith(("add ", "create ")) for line in lines))
+
+    def test_nftables_service_removed(self):
+        lines = self.delta('nftables', self.s3, [])
+        self.assertIn("delete element inet aws aws_443_v6 { 2a05:d07a:a000::/40 }", lines)
+        self.assertFalse(any(line.startswith("add ") for line in lines))
+
+
+if __name__ == '__main__':
+    unittest.main()
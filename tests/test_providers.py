@@ -0,0 +1,107 @@
+import contextlib
+import io
+import os
+import unittest
+
+from docopt import docopt
+
+import generate
+import providers
+
+from ipranges.fetch import DownloadError
+from ipranges.stream import read_chunks
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def fixture(code: str) -> str:
+    if code == 'aws':
+        return os.path.join(FIXTURES, 'ip-ranges.json')
+    return os.path.join(FIXTURES, 'providers', f"{code}.json")
+
+
+def parse(code: str) -> tuple:
+    """Returns `(provider, rows)` for a provider's fixture."""
+    provider = providers.Get(code)
+    with open(fixture(code), 'rb') as f:
+        return provider, list(provider.rows(read_chunks(f)))
+
+
+class ProviderParserTest(unittest.TestCase):
+    def test_gcp(self):
+        provider, rows = parse('gcp')
+        self.assertEqual(rows, [
+            ('34.1.208.0/20', None, 'africa-south1', 'Google Cloud', None),
+            (None, '2600:1900:8000::/44', 'us-central1', 'Google Cloud', None),
+            ('34.35.0.0/16', None, 'us-central1', 'Google Cloud', None),
+        ])
+        self.assertEqual((provider.sync_token, provider.create_date), ('1700000001', '2023-11-14T22:13:21.000000'))
+
+    def test_azure(self):
+        provider, rows = parse('azure')
+        self.assertEqual(rows, [
+            ('13.68.128.0/17', None, 'eastus', 'AzureCloud', None),
+            (None, '2603:1030:210::/47', 'eastus', 'AzureCloud', None),
+            ('13.69.40.16/28', None, 'westeurope', 'AzureStorage', None),
+        ])
+        self.assertEqual(provider.sync_token, '311')
+
+    def test_cloudflare(self):
+        provider, rows = parse('cloudflare')
+        self.assertEqual([(r.ip_prefix or r.ipv6_prefix, r.service) for r in rows], [
+            ('173.245.48.0/20', 'CLOUDFLARE'), ('103.21.244.0/22', 'CLOUDFLARE'), ('2400:cb00::/32', 'CLOUDFLARE'),
+        ])
+        self.assertEqual(provider.sync_token, '38f79d050aa027e3be3865e495dcc9bc')
+
+    def test_fastly(self):
+        provider, rows = parse('fastly')
+        self.assertEqual([(r.ip_prefix, r.ipv6_prefix, r.service) for r in rows], [
+            ('23.235.32.0/20', None, 'FASTLY'), ('151.101.0.0/16', None, 'FASTLY'), (None, '2a04:4e40::/32', 'FASTLY'),
+        ])
+        self.assertIsNone(provider.sync_token)
+
+    def test_aws(self):
+        provider, rows = parse('aws')
+        self.assertEqual(len(rows), 21)
+        self.assertEqual(rows[0], ('52.95.110.0/24', None, 'us-east-1', 'AMAZON', 'us-east-1'))
+        self.assertEqual(provider.sync_token, '1700000000')
+
+    def test_check_rejects_truncated_documents(self):
+        for code in providers.List():
+            with self.subTest(provider=code), open(fixture(code), 'rb') as f:
+                body = f.read()
+                self.assertEqual(providers.Get(code).check([body]), parse(code)[0].sync_token)
+                with self.assertRaises(ValueError):
+                    providers.Get(code).check([body[:len(body) // 2]])
+
+
+class LoadProvidersTest(unittest.TestCase):
+    def opts(self, *args):
+        return docopt(generate.__doc__, argv=['lookup', '151.101.1.1'] + list(args))
+
+    def test_merges_providers(self):
+        data = generate.load_providers(['aws', 'fastly'], {'aws': fixture('aws'), 'fastly': fixture('fastly')})
+        self.assertEqual(data.syncToken, 'aws:1700000000 fastly:None')
+        self.assertEqual([(r.provider, r.service) for r in data.lookup('151.101.1.1')], [('fastly', 'FASTLY')])
+        self.assertEqual(data.row_count(), 24)
+
+    def test_all_skips_azure_without_a_url(self):
+        urls = [f"--provider-url={code}={fixture(code)}" for code in providers.List() if code != 'azure']
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            data = generate.load_data(self.opts('--provider', 'all', *urls))
+        self.assertIn("skipping the 'azure' provider", stderr.getvalue())
+        self.assertEqual({r.provider for r in data.prefixes}, {'aws', 'gcp', 'cloudflare', 'fastly'})
+
+    def test_all_includes_azure_with_a_url(self):
+        urls = [f"--provider-url={code}={fixture(code)}" for code in providers.List()]
+        data = generate.load_data(self.opts('--provider', 'all', *urls))
+        self.assertEqual({r.provider for r in data.prefixes}, set(providers.List()))
+
+    def test_azure_without_a_url_is_an_error(self):
+        with self.assertRaises(DownloadError):
+            generate.load_data(self.opts('--provider', 'azure'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import asyncio
+import http.client
+import json
+import os
+import threading
+import time
+import unittest
+
+import formatters
+
+from ipranges import RangeData
+from ipranges.server import RangeServer
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'ip-ranges.json')
+
+
+class RangeServerTest(unittest.TestCase):
+    def setUp(self):
+        self.release = threading.Event()
+
+        def encode(data, fmt):
+            if fmt == 'slow':  # A format that takes as long as the test wants.
+                self.release.wait(10)
+                fmt = 'cidr'
+            return formatters.Get(fmt, data)
+
+        self.server = RangeServer(loader=lambda: RangeData.from_file(FIXTURE), encode=encode, refresh=0)
+        self.loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        thread.start()
+        listener = asyncio.run_coroutine_threadsafe(self.server.start('127.0.0.1', 0), self.loop).result(10)
+        self.port = listener.sockets[0].getsockname()[1]
+
+        async def _close():
+            listener.close()
+            await listener.wait_closed()
+
+        def _stop():
+            self.release.set()
+            asyncio.run_coroutine_threadsafe(_close(), self.loop).result(10)
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            thread.join(10)
+            self.loop.close()
+        self.addCleanup(_stop)
+
+    def get(self, target: str) -> tuple:
+        connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=10)
+        try:
+            connection.request('GET', target)
+            response = connection.getresponse()
+            return response.status, response.getheader('Content-Type'), response.read()
+        finally:
+            connection.close()
+
+    def test_lookup(self):
+        status, content_type, body = self.get('/lookup?ip=52.95.110.1&longest=1')
+        self.assertEqual((status, content_type), (200, 'application/json; charset=utf-8'))
+        self.assertEqual(sorted((r['ip_prefix'], r['service']) for r in json.loads(body)),
+                         [('52.95.110.0/24', 'AMAZON'), ('52.95.110.0/24', 'EC2')])
+
+        self.assertEqual(self.get('/lookup?ip=not-an-ip')[0], 400)
+        self.assertEqual(self.get('/lookup')[0], 400)
+
+    def test_query(self):
+        status, _, body = self.get('/query?service=S3&format=cidr')
+        self.assertEqual(status, 200)
+        self.assertEqual(body.decode().split(), ['52.95.111.0/24', '3.5.140.0/22', '2a05:d07a:a000::/40'])
+
+        _, _, body = self.get('/query?within=15.230.39.0/24&format=cidr')
+        self.assertEqual(body.decode().split(), ['15.230.39.0/26', '15.230.39.64/26', '15.230.39.128/25'])
+
+        self.assertEqual(self.get('/query?within=nonsense')[0], 400)
+        self.assertEqual(self.get('/query?format=nonsense')[0], 400)
+
+    def test_list(self):
+        status, _, body = self.get('/list/services')
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body), ['AMAZON', 'CLOUDFRONT', 'EC2', 'ROUTE53_HEALTHCHECKS', 'S3'])
+        self.assertIn('us-east-1-wl1-bos-wlz-1', json.loads(self.get('/list/border-groups')[2]))
+        self.assertEqual(self.get('/list/nonsense')[0], 404)
+
+    def test_status(self):
+        status, _, body = self.get('/status')
+        self.assertEqual(status, 200)
+        result = json.loads(body)
+        self.assertEqual((result['syncToken'], result['createDate']), ('1700000000', '2023-11-14-22-13-20'))
+        self.assertLessEqual(result['loaded_at'], time.time())
+
+    def test_slow_render_does_not_block_other_requests(self):
+        slow = {}
+        thread = threading.Thread(target=lambda: slow.setdefault('response', self.get('/query?format=slow')))
+        thread.start()
+        try:
+            started = time.monotonic()
+            self.assertEqual(self.get('/status')[0], 200)
+            self.assertLess(time.monotonic() - started, 5)
+            self.assertNotIn('response', slow)
+        finally:
+            self.release.set()
+            thread.join(10)
+        self.assertEqual(slow['response'][0], 200)
+
+    def test_older_data_is_not_swapped_in(self):
+        older = RangeData.from_file(FIXTURE)
+        object.__setattr__(older, 'syncToken', '1600000000')
+        self.server.loader = lambda: older
+        self.server.load()
+        self.assertEqual(json.loads(self.get('/status')[2])['syncToken'], '1700000000')
+
+
+if __name__ == '__main__':
+    unittest.main()